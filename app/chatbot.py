@@ -1,90 +1,383 @@
 ﻿# File: app/chatbot.py
 # Description: This module handles processing of user messages for the Bangla chatbot.
-# It normalizes user input, checks Redis cache for previous responses, searches FAQ data,
-# retrieves chat history from MongoDB for context, queries the Bangla LLM for an answer,
-# caches the response, stores chat history, and returns a structured ChatResponse including
-# sentiment and source information.
+# It normalizes user input, checks the in-process and Redis caches for previous responses, searches FAQ data,
+# checks the shared cross-user answer cache, builds a token-budgeted conversation context (rolling
+# summary of older turns plus the most recent turns) and picks the most relevant FAQ entries, queries the Bangla LLM for an answer, caches the response,
+# stores chat history, and returns a structured ChatResponse including sentiment and source information.
+# Identical concurrent LLM misses with identical context share one completion, and a streaming variant yields the LLM
+# answer token by token. When the LLM is unavailable or misses its deadline, the best FAQ match
+# (or a canned reply) is returned instead; calls shed by LLM admission control get the same fallback,
+# or are refused when LLM_OVERLOAD_ACTION is "reject". Every stage is timed for the metrics endpoint.
+# WebSocket connections keep a ChatSession with the user's latest turns and recently retrieved FAQ
+# context in memory, so follow-up messages on the same connection skip those lookups.
+# Batches of messages are answered together: one normalization/sentiment/intent pass, one Redis MGET
+# for cached replies, and one LLM call (at most BATCH_LLM_CONCURRENCY at a time) per distinct question and context.
+# Only answers generated without the asking user's conversation (history or summary) are shared with
+# other users, through the shared answer cache, single flight or batch deduplication.
 
-from datetime import datetime, timezone  # Import datetime utilities for timestamping messages
-from app.utils import normalize_text, detect_intent, sentiment_analysis, FAQ_DATA  # Import utility functions and FAQ data
+import asyncio  # Import asyncio to wait on shared in-flight completions
+import time  # Import time to measure the time to the first streamed token
+from collections import OrderedDict  # Import OrderedDict to bound the FAQ contexts kept per session
+from typing import List, Optional  # Import typing helpers for annotations
+from datetime import datetime, timedelta, timezone  # Import datetime utilities for timestamping messages
+from app.utils import normalize_text, detect_intent, sentiment_analysis, get_faq_index  # Import utility functions and the current FAQ index
 from app.redis_client import r  # Import Redis client instance
-from app.db import chat_collection  # Import MongoDB collection for chat messages
 from app.models import UserMessage, ChatResponse  # Import data models for user messages and chatbot responses
-from app.config import REDIS_TTL  # Import Redis TTL configuration
-from app.llm import BanglaLLM  # Import Bangla language model class
+from app.config import REDIS_TTL, FAQ_TOP_K, FAQ_CONTEXT_TOKENS, LLM_FALLBACK_REPLY, LLM_OVERLOAD_ACTION, HISTORY_CONTEXT_TURNS, BATCH_LLM_CONCURRENCY  # Import Redis TTL, FAQ retrieval, fallback, context and batch configuration
+from app.llm import get_llm, LLMUnavailable, LLMOverloaded  # Import accessor for the shared Bangla language model and its unavailability errors
+from app.services.history_service import cache_turn, recent_messages  # Import helpers appending to and reading a user's cached history
+from app.services.summary_service import conversation_context  # Import the token-budgeted conversation context builder
+from app.services.answer_cache import lookup_answer, store_answer  # Import the shared cross-user answer cache
+from app.services.singleflight import flight_key, coalesce, join, lead, finish  # Import coalescing of identical in-flight LLM calls
+from app.services.local_cache import local_cache  # Import the in-process L1 cache
+from app.services.write_behind import turn_writer, mark_pending  # Import the write-behind queue for chat turns
+from app.services.metrics import timed, observe_stage, count_reply  # Import the stage timers and reply counter
+from bson import ObjectId  # Import ObjectId to assign turn ids before they are written
 
-llm = BanglaLLM()  # Initialize the Bangla language model instance
+# Retrieved FAQ contexts kept per WebSocket session (most recent questions)
+SESSION_FAQ_CONTEXTS = 32
 
-async def get_reply(user_msg: UserMessage) -> ChatResponse:
+
+class ChatSession:
+    """
+    Conversation state of one WebSocket connection, kept in memory for its lifetime: the user's
+    latest turns (loaded once, then extended with every saved turn) and the FAQ context retrieved
+    for recent questions.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id  # User the connection belongs to
+        self.turns: Optional[List[dict]] = None  # Latest turns, oldest first; loaded on the first LLM miss
+        self.faq_index = None  # FAQ index the cached contexts were retrieved from
+        self.faq_contexts = OrderedDict()  # normalized question -> retrieved FAQ context, least recently used first
+
+    async def recent_turns(self) -> List[dict]:
+        if self.turns is None:
+            self.turns = list(await recent_messages(self.user_id, HISTORY_CONTEXT_TURNS))  # Own copy: cached lists are shared
+        return self.turns
+
+    def add_turn(self, turn: dict):
+        if self.turns is not None:
+            self.turns.append(turn)
+            del self.turns[:-HISTORY_CONTEXT_TURNS]  # Only the context window is needed
+
+    def faq_context(self, normalized: str) -> str:
+        index = get_faq_index()
+        if index is not self.faq_index:
+            self.faq_index = index  # The FAQ was reloaded: contexts retrieved from the old one are stale
+            self.faq_contexts.clear()
+        context = self.faq_contexts.get(normalized)
+        if context is None:
+            context = index.retriever.context(normalized, FAQ_TOP_K, FAQ_CONTEXT_TOKENS)
+            self.faq_contexts[normalized] = context
+            if len(self.faq_contexts) > SESSION_FAQ_CONTEXTS:
+                self.faq_contexts.popitem(last=False)  # Forget the least recently asked question
+        else:
+            self.faq_contexts.move_to_end(normalized)
+        return context
+
+
+async def _lookup(user_msg: UserMessage):
     normalized = normalize_text(user_msg.message)  # Normalize the user's message text
-    sentiment = sentiment_analysis(user_msg.message)  # Analyze the sentiment of the user's message
+    with timed("sentiment"):
+        sentiment = sentiment_analysis(user_msg.message)  # Analyze the sentiment of the user's message
     cache_key = f"{user_msg.user_id}:{normalized}"  # Create a unique cache key for Redis
 
-    # 1️⃣ Redis cache
-    cached = r.get(cache_key)  # Check if the response exists in Redis cache
+    # 1️⃣ In-process cache, then Redis cache
+    with timed("cache_lookup"):
+        cached = local_cache.get(cache_key)  # Hot replies are served without a network hop
+        if cached is None:
+            cached = await r.get(cache_key)  # Check if the response exists in Redis cache
+            if cached:
+                local_cache.set(cache_key, cached)  # Keep it in this worker for the next request (replies are never invalidated)
     if cached:
-        return ChatResponse(
-            reply=cached,  # Return the cached reply
-            source="redis-cache",  # Indicate the response came from Redis cache
-            sentiment=sentiment  # Include the sentiment analysis
-        )
+        return normalized, cache_key, sentiment, cached, "redis-cache"  # Reply served from Redis cache
 
     # 2️⃣ FAQ lookup
-    record = detect_intent(normalized)  # Check if the normalized message matches any FAQ intent
+    with timed("intent"):
+        record = detect_intent(normalized)  # Check if the normalized message matches any FAQ intent
     if record:
-        reply = record["answer_bn"]  # Get the answer in Bangla from the FAQ
-        source = "json"  # Mark the source as JSON (FAQ)
-        r.setex(cache_key, REDIS_TTL, reply)  # Store the reply in Redis with TTL
-    else:
-        # 3️⃣ Chat history for context
-        history_doc = await chat_collection.find_one({"user_id": user_msg.user_id})  # Retrieve user's chat history from MongoDB
-        context_history = ""  # Initialize context history string
-        if history_doc:
-            context_history = "\n".join(
-                [f"User: {m['message']} | Reply: {m['reply']}"
-                 for m in history_doc.get("messages", [])]  # Format previous messages and replies
-            )
-
-        # 4️⃣ FAQ context
-        faq_context = "\n".join(
-            [f"{f['topic']}: {f['answer_bn']}" for f in FAQ_DATA]  # Concatenate all FAQ topics and answers
-        )
+        return normalized, cache_key, sentiment, record["answer_bn"], "json"  # Reply served from the FAQ (JSON)
+
+    return normalized, cache_key, sentiment, None, "llm"  # No ready answer: the LLM has to generate one
+
+
+async def _build_context(user_msg: UserMessage, normalized: str, session: Optional[ChatSession] = None):
+    # Returns the full LLM context (FAQ plus chat history) and whether it carries the user's own conversation
+    # 3️⃣ Chat history for context: a rolling summary of older turns plus the latest turns that fit in the token budget
+    with timed("history"):
+        turns = await session.recent_turns() if session is not None else None  # Held by the session after its first load
+        summary, context_history = await conversation_context(user_msg.user_id, turns)
 
-        # Combine FAQ context and chat history for LLM input
-        context = f"""
+    # 4️⃣ FAQ context: only the top-k most relevant entries that fit in the token budget
+    with timed("faq_retrieval"):
+        if session is not None:
+            faq_context = session.faq_context(normalized)
+        else:
+            faq_context = get_faq_index().retriever.context(normalized, FAQ_TOP_K, FAQ_CONTEXT_TOKENS)
+
+    # Combine FAQ context and chat history for LLM input
+    personal = bool(summary or context_history)  # Answers to personal contexts are never shared with other users
+    return f"""
 FAQ তথ্য:
 {faq_context}
 
+আগের কথোপকথনের সারাংশ:
+{summary}
+
 চ্যাট ইতিহাস:
 {context_history}
-        """
-
-        # 5️⃣ LLM
-        reply = llm.generate_answer(user_msg.message, context)  # Generate a reply using Bangla LLM with context
-        source = "llm"  # Mark the source as LLM
-        r.setex(cache_key, REDIS_TTL, reply)  # Cache the LLM response in Redis
-
-    # 6️⃣ Save to MongoDB
-    await chat_collection.update_one(
-        {"user_id": user_msg.user_id},  # Filter for the specific user
-        {
-            "$push": {
-                "messages": {
-                    "message": user_msg.message,  # Store the original user message
-                    "reply": reply,  # Store the generated reply
-                    "sentiment": sentiment,  # Store sentiment analysis
-                    "created_at": datetime.now(timezone.utc)  # Timestamp in UTC
-                }
-            }
-        },
-        upsert=True  # Create a new document if it does not exist
-    )
+        """, personal
+
+
+def _fallback_reply(normalized: str) -> str:
+    # Answer without the LLM: the most relevant FAQ entry, or a canned reply when nothing is relevant
+    records = get_faq_index().retriever.top_k(normalized, 1, FAQ_CONTEXT_TOKENS)
+    return records[0]["answer_bn"] if records else LLM_FALLBACK_REPLY
+
+
+async def _save_turns(saves: List[tuple], session: Optional[ChatSession] = None):
+    # Store turns in order, each given as (user_msg, normalized, cache_key, reply, sentiment, source, shareable);
+    # however many there are, their Redis writes go out in a single round-trip
+    turns, queued = [], []
+    last = {}  # user_id -> timestamp of the user's previous turn in this call
+    for user_msg, _, _, reply, sentiment, source, _ in saves:
+        now = datetime.now(timezone.utc)
+        created_at = now.replace(microsecond=now.microsecond // 1000 * 1000)  # Timestamp in UTC, at MongoDB's millisecond precision so cached and stored copies compare equal
+        previous = last.get(user_msg.user_id)
+        if previous is not None and created_at <= previous:
+            created_at = previous + timedelta(milliseconds=1)  # Same millisecond: keep the user's turns in order with distinct timestamps
+        last[user_msg.user_id] = created_at
+        turns.append({
+            "message": user_msg.message,  # Store the original user message
+            "reply": reply,  # Store the generated reply
+            "sentiment": sentiment,  # Store sentiment analysis
+            "source": source,  # Store where the reply came from
+            "created_at": created_at
+        })
 
-    # 7️⃣ Invalidate history cache
-    r.delete(f"chat_history:{user_msg.user_id}")  # Delete cached chat history to maintain consistency
+    # 6️⃣ Queue the turns for MongoDB (one document per turn, written in batches off the request path)
+    with timed("mongo_write"):
+        for (user_msg, *_), turn in zip(saves, turns):
+            queued.append(await turn_writer.submit({"_id": ObjectId(), "user_id": user_msg.user_id, **turn}))
+
+    # 7️⃣ Cache the replies and append the turns to the cached histories in a single round-trip
+    with timed("redis_write"):  # Includes broadcasting the L1 cache invalidations
+        async with r.pipeline(transaction=False) as pipe:
+            for (user_msg, normalized, cache_key, reply, _, source, shareable), turn, was_queued in zip(saves, turns, queued):
+                if was_queued:
+                    mark_pending(pipe, user_msg.user_id)  # Other workers must not rebuild this user's history from MongoDB yet
+                if source != "fallback":
+                    pipe.setex(cache_key, REDIS_TTL, reply)  # Store the reply in Redis with TTL (fallbacks are not, so the LLM is asked again later)
+                if source == "llm" and shareable:
+                    store_answer(pipe, normalized, reply)  # Share a fresh LLM answer with every user, unless the prompt held this user's conversation
+                cache_turn(pipe, user_msg.user_id, turn)  # Append the turn to the user's capped history list
+            await pipe.execute()  # Send all commands together
+    for (_, _, cache_key, reply, _, source, _), turn in zip(saves, turns):
+        if source != "fallback":
+            local_cache.set(cache_key, reply)  # Keep the reply in this worker's L1 cache as well
+        if session is not None:
+            session.add_turn(turn)  # The next message on this connection sees the turn without a round-trip
+
+
+async def _save_turn(user_msg: UserMessage, normalized: str, cache_key: str, reply: str, sentiment: str, source: str, session: Optional[ChatSession] = None, shareable: bool = False):
+    await _save_turns([(user_msg, normalized, cache_key, reply, sentiment, source, shareable)], session)
+
+
+async def get_reply(user_msg: UserMessage) -> ChatResponse:
+    normalized, cache_key, sentiment, reply, source = await _lookup(user_msg)  # Try the Redis cache and the FAQ first
+    if source == "redis-cache":
+        count_reply(source)
+        return ChatResponse(
+            reply=reply,  # Return the cached reply
+            source=source,  # Indicate the response came from Redis cache
+            sentiment=sentiment  # Include the sentiment analysis
+        )
+
+    if reply is None:
+        with timed("answer_cache"):
+            reply = await lookup_answer(normalized)  # Shared answer given to another user for the same question
+        if reply is not None:
+            source = "redis-cache"  # Served from the shared cache instead of the LLM
+
+    shareable = False  # Whether the answer may be shared with other users
+    if reply is None:
+        context, personal = await _build_context(user_msg, normalized)  # Build FAQ and chat history context for the LLM
+        shareable = not personal
+
+        # 5️⃣ LLM, shared by every concurrent caller asking the same question with the same context
+        try:
+            with timed("llm"):
+                reply = await coalesce(
+                    flight_key(normalized, context),
+                    lambda: get_llm().generate_answer(user_msg.message, context)  # Generate a reply using Bangla LLM without blocking the event loop
+                )
+        except (LLMUnavailable, asyncio.TimeoutError) as e:
+            if isinstance(e, LLMOverloaded) and LLM_OVERLOAD_ACTION == "reject":
+                raise  # Shed: the endpoint answers 429 so the client backs off
+            reply, source = _fallback_reply(normalized), "fallback"  # Answer right away instead of failing the request
+
+    await _save_turn(user_msg, normalized, cache_key, reply, sentiment, source, shareable=shareable)  # Cache the reply and store the turn
+    count_reply(source)
 
     return ChatResponse(
         reply=reply,  # Return the final reply
         source=source,  # Return the source of the reply (FAQ, LLM, or Redis)
         sentiment=sentiment  # Return the sentiment of the message
     )
+
+
+async def stream_reply(user_msg: UserMessage, session: Optional[ChatSession] = None):
+    # Yields ("token", text) events while the LLM is generating and a final ("reply", ChatResponse) event.
+    # Redis cache and FAQ hits are served right away as a single "reply" event. A WebSocket connection
+    # passes its session, which supplies the conversation state and records the new turn.
+    normalized, cache_key, sentiment, reply, source = await _lookup(user_msg)  # Try the Redis cache and the FAQ first
+    if source == "redis-cache":
+        count_reply(source)
+        yield "reply", ChatResponse(reply=reply, source=source, sentiment=sentiment)  # Serve the cached reply at once
+        return
+
+    if reply is None:
+        with timed("answer_cache"):
+            reply = await lookup_answer(normalized)  # Shared answer given to another user for the same question
+        if reply is not None:
+            source = "redis-cache"  # Served from the shared cache instead of the LLM
+
+    shareable = False  # Whether the answer may be shared with other users
+    if reply is None:
+        context, personal = await _build_context(user_msg, normalized, session)  # Build FAQ and chat history context for the LLM
+        shareable = not personal
+
+        key = flight_key(normalized, context)
+        parts = []  # Collected tokens of the full answer
+        try:
+            with timed("llm"):
+                reply = await join(key)  # Identical question already being answered in this worker: reuse its answer as a single event
+            if reply is None:
+                # 5️⃣ LLM, forwarding every token to the caller as soon as it arrives; identical requests meanwhile wait for the answer
+                future = lead(key)
+                try:
+                    started = time.perf_counter()
+                    with timed("llm"):
+                        async for token in get_llm().stream_answer(user_msg.message, context):
+                            if not parts:
+                                observe_stage("llm_first_token", time.perf_counter() - started)  # Time to first token
+                            parts.append(token)  # Keep the token for caching and persistence
+                            yield "token", token  # Forward the token to the client
+                    reply = "".join(parts).strip()  # Assemble the complete answer
+                except BaseException as e:
+                    finish(key, future, error=e)  # Waiters fail the same way, or lead themselves if the client went away
+                    raise
+                finish(key, future, reply)
+        except (LLMUnavailable, asyncio.TimeoutError) as e:
+            if parts or (isinstance(e, LLMOverloaded) and LLM_OVERLOAD_ACTION == "reject"):
+                raise  # Part of the answer was already sent, or the call was shed: report the error instead of switching answers
+            reply, source = _fallback_reply(normalized), "fallback"
+
+    await _save_turn(user_msg, normalized, cache_key, reply, sentiment, source, session, shareable)  # Cache the reply and store the turn, same as get_reply
+    count_reply(source)
+
+    yield "reply", ChatResponse(reply=reply, source=source, sentiment=sentiment)  # Final event with the complete reply
+
+
+def _analyze_batch(messages: List[str]) -> List[tuple]:
+    # One pass over a batch (run in a worker thread): (normalized text, sentiment, matched FAQ record) per message
+    index = get_faq_index()  # The same FAQ index for the whole batch, even if a reload lands meanwhile
+    sentiments = {}  # Repeated messages are analyzed once
+    results = []
+    for message in messages:
+        normalized = normalize_text(message)
+        if message not in sentiments:
+            sentiments[message] = sentiment_analysis(message)
+        results.append((normalized, sentiments[message], index.intents.match(normalized)))
+    return results
+
+
+async def get_replies(user_msgs: List[UserMessage], concurrency: int = BATCH_LLM_CONCURRENCY) -> List[ChatResponse]:
+    """
+    Answer a batch of messages with the same caching, sources and persistence as get_reply,
+    returning the replies in input order. Identical questions without a ready answer share one
+    answer when their LLM context is identical too (users without a conversation of their own),
+    and at most 'concurrency' of them are sent to the LLM at once; questions the LLM
+    cannot answer (including shed ones) get the FAQ fallback, so every message gets a reply.
+    """
+    # 1️⃣ Normalization, sentiment and intent detection for the whole batch, off the event loop
+    with timed("batch_analysis"):
+        analyzed = await asyncio.to_thread(_analyze_batch, [m.message for m in user_msgs])
+    keys = [f"{m.user_id}:{normalized}" for m, (normalized, _, _) in zip(user_msgs, analyzed)]
+
+    # 2️⃣ Reply cache: in-process first, then a single MGET for everything else
+    replies = [local_cache.get(key) for key in keys]
+    sources = ["redis-cache" if reply else None for reply in replies]
+    missing = [i for i, reply in enumerate(replies) if not reply]
+    if missing:
+        with timed("cache_lookup"):
+            values = await r.mget([keys[i] for i in missing])
+        for i, value in zip(missing, values):
+            if value:
+                replies[i], sources[i] = value, "redis-cache"
+                local_cache.set(keys[i], value)
+    cached = [source == "redis-cache" for source in sources]  # Per-user cache hits are not stored again, as in get_reply
+
+    # 3️⃣ FAQ hits, and the distinct questions left for the answer cache and the LLM
+    questions = OrderedDict()  # normalized question -> indices of the messages asking it
+    for i, (normalized, _, record) in enumerate(analyzed):
+        if sources[i] is None and record:
+            replies[i], sources[i] = record["answer_bn"], "json"
+        elif sources[i] is None:
+            questions.setdefault(normalized, []).append(i)
+
+    # 4️⃣ Shared answers, one lookup per distinct question, a bounded number at a time
+    slots = asyncio.Semaphore(concurrency)
+
+    async def shared_answer(normalized: str):
+        async with slots:
+            with timed("answer_cache"):
+                return await lookup_answer(normalized)  # Shared answer given to another user for the same question
+
+    asks = OrderedDict()  # (user_id, normalized question) -> indices of the messages left for the LLM
+    shared = await asyncio.gather(*(shared_answer(normalized) for normalized in questions))
+    for (normalized, indices), reply in zip(questions.items(), shared):
+        for i in indices:
+            if reply is not None:
+                replies[i], sources[i] = reply, "redis-cache"
+            else:
+                asks.setdefault((user_msgs[i].user_id, normalized), []).append(i)
+
+    # 5️⃣ LLM context of every user asking; only identical questions with identical context
+    # (no conversation of their own) share one answer, so no user gets an answer built from another's history
+    async def build(user_msg: UserMessage, normalized: str):
+        async with slots:
+            return await _build_context(user_msg, normalized)
+
+    contexts = await asyncio.gather(*(build(user_msgs[indices[0]], normalized) for (_, normalized), indices in asks.items()))
+    flights = OrderedDict()  # flight key -> [first message asking, normalized question, context, personal, indices]
+    for ((_, normalized), indices), (context, personal) in zip(asks.items(), contexts):
+        key = flight_key(normalized, context)
+        flights.setdefault(key, [user_msgs[indices[0]], normalized, context, personal, []])[4].extend(indices)
+
+    # 6️⃣ One LLM answer per flight, a bounded number at a time
+    async def answer(key: str, user_msg: UserMessage, normalized: str, context: str):
+        async with slots:
+            try:
+                with timed("llm"):
+                    reply = await coalesce(key, lambda: get_llm().generate_answer(user_msg.message, context))
+                return reply, "llm"
+            except (LLMUnavailable, asyncio.TimeoutError):
+                return _fallback_reply(normalized), "fallback"
+
+    shareable = [False] * len(user_msgs)  # Whether each answer may be shared with other users
+    answers = await asyncio.gather(*(answer(key, user_msg, normalized, context) for key, (user_msg, normalized, context, _, _) in flights.items()))
+    for (_, _, _, personal, indices), (reply, source) in zip(flights.values(), answers):
+        for i in indices:
+            replies[i], sources[i], shareable[i] = reply, source, not personal
+
+    # 7️⃣ Store the turns in input order, so each user's history keeps the order of the batch, with one Redis round-trip
+    await _save_turns([
+        (user_msg, analyzed[i][0], keys[i], replies[i], analyzed[i][1], sources[i], shareable[i])
+        for i, user_msg in enumerate(user_msgs) if not cached[i]
+    ])
+    for source in sources:
+        count_reply(source)
+
+    return [ChatResponse(reply=reply, source=source, sentiment=sentiment) for reply, source, (_, sentiment, _) in zip(replies, sources, analyzed)]
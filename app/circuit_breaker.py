@@ -0,0 +1,63 @@
+"""
+File: circuit_breaker.py
+Directory: app/circuit_breaker.py
+Description:
+This file contains the circuit breaker used to stop calling a failing LLM provider.
+After a number of consecutive failures the circuit opens and calls are refused at once,
+so requests fall back immediately instead of queuing behind a broken upstream. Once the
+reset timeout has passed, a single trial call is let through (half-open): its success
+closes the circuit again, its failure keeps it open for another timeout.
+"""
+
+import time  # Import time for the monotonic clock
+from typing import Callable, Optional  # Import typing helpers for annotations
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker with a single half-open trial call.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold  # Consecutive failures that open the circuit
+        self.reset_timeout = reset_timeout  # Seconds the circuit stays open before a trial call
+        self.clock = clock  # Time source (replaceable in tests)
+        self.failures = 0  # Current run of consecutive failures
+        self.opened_at: Optional[float] = None  # When the circuit last opened; None while closed
+        self.trial = False  # A half-open trial call is in progress
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.trial or self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def is_open(self) -> bool:
+        # True while calls would be refused (without claiming the trial call)
+        return self.opened_at is not None and (self.trial or self.clock() - self.opened_at < self.reset_timeout)
+
+    def allow(self) -> bool:
+        # Whether a call may go ahead now; in the half-open state only the first caller gets the trial
+        if self.opened_at is None:
+            return True
+        if self.trial or self.clock() - self.opened_at < self.reset_timeout:
+            return False
+        self.trial = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None  # Close the circuit
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()  # Open, or stay open after a failed trial
+        self.trial = False
+
+    def abandon(self):
+        # A call was cancelled before its outcome was known: let another caller make the trial
+        self.trial = False
@@ -9,6 +9,8 @@ and cache TTL.
 """
 
 import os  # Import the built-in os module to interact with environment variables
+import json  # Import json to parse structured settings such as the LLM provider list
+from pathlib import Path  # Import Path to locate files relative to this package
 from dotenv import load_dotenv  # Import load_dotenv to load environment variables from a .env file
 
 # Load environment variables from a .env file located at the project root
@@ -22,3 +24,128 @@ REDIS_URL = os.getenv("REDIS_URL") or "redis://localhost:6379/0"
 
 # Cache TTL (Time-To-Live) in seconds for Redis entries
 REDIS_TTL = 3600
+
+# LLM endpoint: OpenAI-compatible base URL and model name used by BanglaLLM
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or "https://models.inference.ai.azure.com"
+LLM_MODEL = os.getenv("LLM_MODEL") or "gpt-4.1-mini"
+
+# Maximum number of LLM completions allowed in flight at once per worker
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY") or 100)
+
+# Per-call deadline in seconds for an LLM completion (includes time spent waiting for a free slot)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT") or 30)
+
+# Prioritized LLM providers as a JSON list of {"name", "base_url", "model", "api_key_env"} objects;
+# the first provider whose circuit is closed is used, the next ones on failure or for hedging.
+# Defaults to a single provider built from LLM_BASE_URL, LLM_MODEL and OPENAI_API_KEY
+LLM_PROVIDERS = json.loads(os.getenv("LLM_PROVIDERS") or "null") or [
+    {"name": "default", "base_url": LLM_BASE_URL, "model": LLM_MODEL, "api_key_env": "OPENAI_API_KEY"}
+]
+
+# Deadline in seconds of a single provider attempt within the per-call deadline
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT") or LLM_TIMEOUT)
+
+# Send a hedged second request when no answer arrived after this many seconds (0 disables hedging)
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER") or 0)
+
+# Circuit breaker per provider: consecutive failures that open it, and seconds before a trial call
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES") or 5)
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET") or 30)
+
+# Reply used when the LLM is unavailable and no FAQ entry matches the question
+LLM_FALLBACK_REPLY = os.getenv("LLM_FALLBACK_REPLY") or "দুঃখিত, এই মুহূর্তে উত্তর দিতে পারছি না। অনুগ্রহ করে কিছুক্ষণ পরে আবার চেষ্টা করুন।"
+
+# Admission control of LLM calls: calls allowed to wait for a free slot beyond LLM_MAX_CONCURRENCY, the longest
+# wait for a slot (seconds), and what happens to a shed /chat request: "fallback" answers from the FAQ,
+# "reject" returns HTTP 429
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX") or LLM_MAX_CONCURRENCY)
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT") or 2)
+LLM_OVERLOAD_ACTION = os.getenv("LLM_OVERLOAD_ACTION") or "fallback"
+
+# Per-user rate limit of chat requests (token bucket in Redis): sustained requests per second and burst size;
+# a rate of 0 disables the limit
+RATE_LIMIT_PER_SEC = float(os.getenv("RATE_LIMIT_PER_SEC") or 1)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST") or 10)
+
+# Size of the shared keep-alive HTTP connection pool used to reach the LLM endpoint
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS") or 100)
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE") or 20)
+
+# Size of the shared async Redis connection pool and how long (seconds) a request waits for a free connection
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS") or 50)
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT") or 5)
+
+# FAQ retrieval: number of FAQ entries and approximate token budget for the FAQ part of an LLM prompt
+FAQ_TOP_K = int(os.getenv("FAQ_TOP_K") or 5)
+FAQ_CONTEXT_TOKENS = int(os.getenv("FAQ_CONTEXT_TOKENS") or 600)
+
+# Chat history: most recent turns considered for the LLM context, and default/maximum page sizes of /chat/history
+HISTORY_CONTEXT_TURNS = int(os.getenv("HISTORY_CONTEXT_TURNS") or 10)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE") or 50)
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE") or 200)
+# Token budget of the conversation part of the LLM context (rolling summary plus verbatim recent turns)
+HISTORY_CONTEXT_TOKENS = int(os.getenv("HISTORY_CONTEXT_TOKENS") or 800)
+# Rolling summary of older turns: maximum size, how many unsummarized turns outside the context
+# trigger a summary update, and the most turns folded into the summary by one update
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS") or 200)
+SUMMARY_FOLD_TURNS = int(os.getenv("SUMMARY_FOLD_TURNS") or 4)
+SUMMARY_FOLD_MAX = int(os.getenv("SUMMARY_FOLD_MAX") or 50)
+
+# Cached chat turns: entries larger than this many bytes are stored zlib-compressed (0 disables
+# compression), at this zlib level (1 = fastest, 9 = smallest)
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES") or 1024)
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL") or 1)
+
+# Shared answer cache: optional near-duplicate matching of questions with MinHash/LSH over character n-grams
+# (similarity threshold is the minimum estimated Jaccard similarity; bands x rows = MinHash permutations)
+ANSWER_CACHE_NEAR_DUPLICATES = (os.getenv("ANSWER_CACHE_NEAR_DUPLICATES") or "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY") or 0.85)
+ANSWER_CACHE_NGRAM = int(os.getenv("ANSWER_CACHE_NGRAM") or 3)
+ANSWER_CACHE_BANDS = int(os.getenv("ANSWER_CACHE_BANDS") or 32)
+ANSWER_CACHE_ROWS = int(os.getenv("ANSWER_CACHE_ROWS") or 4)
+
+# Single-flight coalescing of identical LLM requests across workers: Redis lock lifetime (seconds),
+# how long a finished answer stays available to waiting workers, and how often they poll for it
+SINGLEFLIGHT_LOCK_TTL = int(os.getenv("SINGLEFLIGHT_LOCK_TTL") or LLM_TIMEOUT + 5)
+SINGLEFLIGHT_RESULT_TTL = int(os.getenv("SINGLEFLIGHT_RESULT_TTL") or 30)
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL") or 0.05)
+
+# In-process (L1) cache in front of Redis: memory budget in bytes, entry lifetime in seconds,
+# and the Redis pub/sub channel used to broadcast invalidations to every worker
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES") or 32 * 1024 * 1024)
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL") or 60)
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL") or "cache_invalidate"
+
+# Write-behind persistence of chat turns: queue capacity, turns per bulk_write, maximum seconds a turn
+# waits for its batch, and how long (seconds) a reply waits for queue space before writing directly
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE") or 10000)
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE") or 500)
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL") or 0.05)
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT") or 1.0)
+# Retries of a batch failing with a transient MongoDB error before its turns are dropped (and logged), and the
+# longest time (seconds) shutdown waits for the queue to be flushed
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES") or 5)
+WRITE_BEHIND_STOP_TIMEOUT = float(os.getenv("WRITE_BEHIND_STOP_TIMEOUT") or 10)
+
+# FAQ data file (defaults to app/faq_data.json, independent of the working directory) and how often (seconds)
+# each worker checks it for changes to hot-reload the FAQ index; 0 disables the file watcher
+FAQ_PATH = os.getenv("FAQ_PATH") or str(Path(__file__).resolve().parent / "faq_data.json")
+FAQ_WATCH_INTERVAL = float(os.getenv("FAQ_WATCH_INTERVAL") or 5)
+
+# Token required in the X-Admin-Token header of admin endpoints; admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or ""
+
+# Add a Server-Timing header with per-stage timings to every HTTP response (for finding regressions in production)
+METRICS_TIMING_HEADER = (os.getenv("METRICS_TIMING_HEADER") or "false").lower() in ("1", "true", "yes")
+
+# NDJSON export of chat turns: documents fetched per MongoDB batch, read preference of the export
+# cursors (secondaries keep the primary free for live chat), exports allowed at once per worker,
+# and the gzip level of compressed exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE") or 1000)
+EXPORT_READ_PREFERENCE = os.getenv("EXPORT_READ_PREFERENCE") or "secondaryPreferred"
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT") or 1)
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL") or 6)
+
+# Batch chat (/chat/batch): most messages accepted per request, and LLM misses of one batch answered at once
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE") or 1000)
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY") or 4)
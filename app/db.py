@@ -1,7 +1,7 @@
 ﻿"""
 File: app/db.py
 Description: This file establishes the MongoDB Atlas connection using Motor (async MongoDB driver).
-It defines references to the 'users' and 'chat_histories' collections for use across the app.
+It defines references to the 'users', 'chat_messages', 'chat_summaries' and legacy 'chat_histories' collections for use across the app.
 """
 
 # Import the asynchronous MongoDB client from the Motor library
@@ -10,8 +10,11 @@ from motor.motor_asyncio import AsyncIOMotorClient
 # Import the MongoDB connection URI from the app's configuration file
 from app.config import MONGO_URI
 
+# Import the listener reporting connection pool usage to the metrics endpoint
+from app.services.metrics import mongo_pool_listener
+
 # Create an asynchronous MongoDB client using the connection URI
-client = AsyncIOMotorClient(MONGO_URI)
+client = AsyncIOMotorClient(MONGO_URI, event_listeners=[mongo_pool_listener])
 
 # Access the 'smart_cooking_db' database from the MongoDB client
 db = client.smart_cooking_db
@@ -19,5 +22,11 @@ db = client.smart_cooking_db
 # Define a reference to the 'users' collection within the database
 users_collection = db.users
 
-# Define a reference to the 'chat_histories' collection within the database
+# Define a reference to the legacy 'chat_histories' collection (one document per user with an embedded messages array)
 chat_collection = db.chat_histories
+
+# Define a reference to the 'chat_messages' collection (one document per chat turn, indexed on user_id and created_at)
+messages_collection = db.chat_messages
+
+# Define a reference to the 'chat_summaries' collection (one rolling summary of older chat turns per user)
+summaries_collection = db.chat_summaries
@@ -0,0 +1,87 @@
+"""
+File: intent_index.py
+Directory: app/intent_index.py
+Description:
+This file contains a compiled keyword index used for FAQ intent detection.
+All FAQ keywords are normalized once and compiled into an Aho-Corasick automaton,
+so matching a message costs a single pass over its characters, no matter how many
+records or keywords the FAQ contains. When keywords of several records occur in the
+same message, the record that comes first in the FAQ wins, as in the original linear scan.
+Unlike that scan, keywords go through the same normalization as messages (the scan only
+lowercased them), so keywords are matched as substrings of the normalized message.
+"""
+
+from collections import deque  # Import deque for the breadth-first construction of failure links
+from typing import Callable, List, Optional  # Import typing helpers for annotations
+
+
+class KeywordIndex:
+    """
+    Aho-Corasick automaton mapping normalized keywords to the FAQ records that own them.
+    """
+
+    def __init__(self, records: List[dict], normalize: Callable[[str], str]):
+        self.records = records  # FAQ records, in priority order
+        self.goto = [{}]  # Trie transitions: one dict of char -> node per node (node 0 is the root)
+        self.fail = [0]  # Failure link of each node
+        self.best = [None]  # Lowest record index among keywords ending at (or via failure links, below) each node
+
+        # 1️⃣ Insert every normalized keyword into the trie
+        for index, record in enumerate(records):
+            for kw in record.get("keywords", []):
+                pattern = normalize(kw).strip()  # Normalize the keyword exactly like incoming messages
+                if pattern:
+                    self._insert(pattern, index)
+
+        # 2️⃣ Compute failure links and merge match priorities along them
+        self._build_links()
+
+    def _insert(self, pattern: str, index: int):
+        node = 0  # Start at the root
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)  # Follow an existing edge if there is one
+            if nxt is None:
+                nxt = len(self.goto)  # Allocate a new node
+                self.goto.append({})
+                self.fail.append(0)
+                self.best.append(None)
+                self.goto[node][ch] = nxt
+            node = nxt
+        # Keep the highest-priority (lowest index) record for this keyword
+        if self.best[node] is None or index < self.best[node]:
+            self.best[node] = index
+
+    def _build_links(self):
+        queue = deque(self.goto[0].values())  # Depth-1 nodes fail back to the root
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                # Walk failure links until a node with a matching edge is found
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                # A match at the failure target is also a match here; keep the best priority
+                inherited = self.best[self.fail[child]]
+                if inherited is not None and (self.best[child] is None or inherited < self.best[child]):
+                    self.best[child] = inherited
+
+    def match(self, text: str) -> Optional[dict]:
+        """
+        Return the highest-priority FAQ record with a keyword occurring in the text, or None.
+        """
+        goto, fail, best = self.goto, self.fail, self.best  # Local aliases for the hot loop
+        node = 0  # Current automaton state
+        found = None  # Best record index seen so far
+        for ch in text:
+            # Follow failure links until the character can be consumed (or we are back at the root)
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = best[node]
+            if hit is not None and (found is None or hit < found):
+                found = hit
+                if found == 0:
+                    break  # Nothing can beat the first record
+        return self.records[found] if found is not None else None
@@ -1,36 +1,127 @@
 """
 File: app/llm.py
 Description: GPT-4.1-mini wrapper for a Bangla chatbot that generates answers using provided context.
+The wrapper is fully asynchronous: it shares one keep-alive HTTP connection pool across all calls,
+caps the number of in-flight completions with a semaphore and enforces a deadline on every call,
+so a slow completion never blocks the event loop.
+Calls go to a prioritized list of OpenAI-compatible providers. Each provider has a circuit
+breaker; a failed or timed-out attempt fails over to the next provider, a slow one can be
+hedged with a second request, and when every circuit is open LLMUnavailable is raised at once,
+so callers can fall back instead of queuing behind a broken upstream.
+Admission control bounds the queue in front of the semaphore: when LLM_QUEUE_MAX calls are
+already waiting for a slot, or a slot does not free up within LLM_QUEUE_TIMEOUT, the call is
+shed with LLMOverloaded right away instead of piling up until its deadline.
 """
 
 import os  # Import the OS module to access environment variables
+import asyncio  # Import asyncio for the concurrency semaphore and per-call deadlines
+import httpx  # Import httpx to build the shared async connection pool
+from typing import List, Optional  # Import typing helpers for annotations
 from dotenv import load_dotenv  # Import load_dotenv to load environment variables from a .env file
-from openai import OpenAI  # Import OpenAI class to interact with OpenAI API
+from openai import AsyncOpenAI  # Import AsyncOpenAI class to interact with OpenAI API without blocking
+from app.config import (  # Import LLM provider, pool, concurrency and resilience settings
+    LLM_PROVIDERS,
+    LLM_MAX_CONCURRENCY,
+    LLM_QUEUE_MAX,
+    LLM_QUEUE_TIMEOUT,
+    LLM_TIMEOUT,
+    LLM_ATTEMPT_TIMEOUT,
+    LLM_HEDGE_AFTER,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE,
+)
+from app.circuit_breaker import CircuitBreaker  # Import the per-provider circuit breaker
+from app.retrieval import estimate_tokens  # Import the token estimate used for prompt and completion sizes
+from app.services.metrics import (  # Import LLM metrics
+    timed,
+    PROMPT_TOKENS,
+    COMPLETION_TOKENS,
+    LLM_IN_FLIGHT,
+    LLM_WAITING,
+    LLM_ATTEMPTS,
+    LLM_HEDGES,
+    LLM_CIRCUIT_OPEN,
+    LLM_SHED,
+)
 
 load_dotenv()  # Load environment variables from a .env file into the environment
 
+
+class LLMUnavailable(Exception):
+    """
+    Raised when no provider can answer: every circuit is open or every attempt failed.
+    """
+
+
+class LLMOverloaded(LLMUnavailable):
+    """
+    Raised when admission control sheds a call: too many calls are already waiting for a slot.
+    """
+
+
+class Provider:
+    """
+    One OpenAI-compatible endpoint and model, with its own circuit breaker.
+    """
+
+    def __init__(self, name: str, base_url: str, model: str, api_key_env: str, http_client: httpx.AsyncClient):
+        self.name = name  # Label used in logs and metrics
+        self.model = model  # Model name sent with every request
+        # Retries are disabled: failing over to the next provider is faster than retrying a failing one
+        self.client = AsyncOpenAI(
+            api_key=os.getenv(api_key_env),  # Fetch API key from environment variables
+            base_url=base_url,  # Set the provider's base URL
+            http_client=http_client,  # Route requests through the shared connection pool
+            max_retries=0
+        )
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+
+    def record(self, outcome: str):
+        # Update the breaker and metrics with the outcome of an attempt ("ok", "error" or "cancelled")
+        if outcome == "ok":
+            self.breaker.record_success()
+        elif outcome == "error":
+            self.breaker.record_failure()
+        else:
+            self.breaker.abandon()
+        LLM_ATTEMPTS.labels(self.name, outcome).inc()
+        LLM_CIRCUIT_OPEN.labels(self.name).set(int(self.breaker.opened_at is not None))
+
+
 class BanglaLLM:
     """
     A wrapper class for interacting with GPT-4.1-mini model for Bangla question answering.
     """
 
-    def __init__(self):
-        # Initialize the OpenAI client with API key and custom base URL
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),  # Fetch API key from environment variables
-            base_url="https://models.inference.ai.azure.com"  # Set the Azure OpenAI base URL
+    def __init__(self, providers: List[dict] = None):
+        # Shared keep-alive connection pool reused by every completion request
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,  # Upper bound on open connections to the LLM endpoints
+                max_keepalive_connections=LLM_MAX_KEEPALIVE  # Idle connections kept warm for reuse
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT)  # Transport-level timeout matching the call deadline
         )
 
-    def generate_answer(self, question: str, context: str) -> str:
+        # Providers in priority order
+        self.providers = [Provider(http_client=self.http_client, **p) for p in (providers or LLM_PROVIDERS)]
+
+        # Semaphore capping the number of completions in flight at once
+        self.semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.waiting = 0  # Calls currently queued for a slot
+
+    def build_prompt(self, question: str, context: str) -> str:
         """
-        Generate an answer in Bangla given a question and context.
+        Build the instruction prompt for a question and its context.
         """
 
         # Construct the prompt that instructs the model to answer using provided context
-        prompt = f"""
+        return f"""
 তুমি একজন বাংলা সহকারী।
 শুধুমাত্র নিচের তথ্য ব্যবহার করে উত্তর দাও।
-যদি তথ্য না পাওয়া যায়, বলো: "এই বিষয়ে আমার কাছে তথ্য নেই।"
+যদি তথ্য না পাওয়া যায়, বলো: "এই বিষয়ে আমার কাছে তথ্য নেই।"
 
 তথ্য:
 {context}
@@ -38,15 +129,250 @@ class BanglaLLM:
 প্রশ্ন:
 {question}
 
-উত্তর বাংলা ভাষায় দাও।
+উত্তর বাংলা ভাষায় দাও।
 """
 
-        # Call the OpenAI chat completion API with GPT-4.1-mini model
-        response = self.client.chat.completions.create(
-            model="gpt-4.1-mini",  # Specify the GPT-4.1-mini model
-            messages=[{"role": "user", "content": prompt}],  # Pass the prompt as user message
-            temperature=0.3  # Set temperature for controlled randomness
-        )
+    def available(self) -> bool:
+        # False when every provider's circuit is open: calls would be refused anyway
+        return any(not p.breaker.is_open() for p in self.providers)
+
+    async def _acquire(self, deadline: float):
+        # Wait for a free slot, but never past the deadline; refuse at once when no provider can answer
+        # and shed the call when the wait queue is full or no slot frees up within LLM_QUEUE_TIMEOUT
+        if not self.available():
+            raise LLMUnavailable("every LLM provider circuit is open")
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()  # Free slot: taken at once, so callers arriving right after see it taken
+            return
+        if self.waiting >= LLM_QUEUE_MAX:
+            LLM_SHED.labels("queue_full").inc()
+            raise LLMOverloaded("too many LLM calls waiting")
+        remaining = deadline - asyncio.get_running_loop().time()
+        self.waiting += 1
+        try:
+            with LLM_WAITING.track_inprogress():
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=min(remaining, LLM_QUEUE_TIMEOUT))
+        except asyncio.TimeoutError:
+            if LLM_QUEUE_TIMEOUT < remaining:
+                LLM_SHED.labels("queue_timeout").inc()
+                raise LLMOverloaded("no LLM slot became free in time") from None
+            raise  # The call's own deadline passed first
+        finally:
+            self.waiting -= 1
+
+    async def _attempt(self, provider: Provider, messages: list, timeout: float, **params) -> str:
+        # One request to one provider; its outcome feeds the provider's circuit breaker
+        try:
+            response = await asyncio.wait_for(
+                provider.client.chat.completions.create(model=provider.model, messages=messages, **params),
+                timeout=timeout
+            )
+            answer = response.choices[0].message.content.strip()
+        except asyncio.CancelledError:
+            provider.record("cancelled")  # Lost a hedge race or the caller went away
+            raise
+        except Exception:
+            provider.record("error")
+            raise
+        provider.record("ok")
+        return answer
+
+    async def _complete(self, messages: list, deadline: float, **params) -> str:
+        # Try providers in priority order until one answers before the deadline, hedging slow attempts
+        loop = asyncio.get_running_loop()
+        candidates = iter(self.providers)
+
+        def next_provider() -> Optional[Provider]:
+            return next((p for p in candidates if p.breaker.allow()), None)
+
+        def launch(provider: Provider):
+            timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - loop.time())
+            attempts.add(asyncio.create_task(self._attempt(provider, messages, timeout, **params)))
+
+        first = next_provider()
+        if first is None:
+            raise LLMUnavailable("every LLM provider circuit is open")
+        attempts, errors = set(), []
+        launch(first)
+        hedge_at = loop.time() + LLM_HEDGE_AFTER if LLM_HEDGE_AFTER > 0 else None
+        try:
+            while attempts:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                wait = remaining if hedge_at is None else max(0, min(remaining, hedge_at - loop.time()))
+                done, _ = await asyncio.wait(attempts, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempts.discard(task)
+                    if task.exception() is None:
+                        return task.result()  # First answer wins
+                    errors.append(task.exception())
+                if not done and hedge_at is not None and loop.time() >= hedge_at:
+                    # Slow answer: race a second request, on the next provider if there is one
+                    hedge_at = None
+                    launch(next_provider() or first)
+                    LLM_HEDGES.inc()
+                elif done and not attempts:
+                    # Every running attempt failed: fail over to the next provider
+                    provider = next_provider() if deadline > loop.time() else None
+                    if provider is not None:
+                        launch(provider)
+            raise LLMUnavailable(f"every LLM attempt failed: {errors[-1]!r}")
+        finally:
+            for task in attempts:
+                task.cancel()  # The losing or unfinished attempts
+
+    async def generate_answer(self, question: str, context: str, timeout: float = None) -> str:
+        """
+        Generate an answer in Bangla given a question and context.
+        Raises asyncio.TimeoutError if no answer is ready before the deadline,
+        and LLMUnavailable if no provider can answer.
+        """
+
+        with timed("prompt"):
+            prompt = self.build_prompt(question, context)  # Build the prompt for this question
+        PROMPT_TOKENS.observe(estimate_tokens(prompt))
+
+        # The per-call deadline covers both the wait for a slot and the completion itself
+        deadline = asyncio.get_running_loop().time() + (timeout or LLM_TIMEOUT)
+        await self._acquire(deadline)
+        try:
+            with LLM_IN_FLIGHT.track_inprogress():
+                answer = await self._complete(
+                    [{"role": "user", "content": prompt}],  # Pass the prompt as user message
+                    deadline,
+                    temperature=0.3  # Set temperature for controlled randomness
+                )
+        finally:
+            self.semaphore.release()  # Free the slot for the next completion
+        COMPLETION_TOKENS.observe(estimate_tokens(answer))
+        return answer
+
+    async def _open_stream(self, messages: list, deadline: float):
+        # Open a streaming completion on the first provider that delivers its first chunk in time;
+        # returns the stream, its chunk iterator and that first chunk (None for an empty answer)
+        loop = asyncio.get_running_loop()
+        for provider in self.providers:
+            if not provider.breaker.allow():
+                continue
+            stream = None
+            timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - loop.time())
+            attempt_deadline = loop.time() + timeout
+            try:
+                stream = await asyncio.wait_for(
+                    provider.client.chat.completions.create(model=provider.model, messages=messages, temperature=0.3, stream=True),
+                    timeout=timeout
+                )
+                chunks = stream.__aiter__()  # Iterator over the streamed completion chunks
+                try:
+                    first = await asyncio.wait_for(chunks.__anext__(), timeout=attempt_deadline - loop.time())
+                except StopAsyncIteration:
+                    first = None
+            except asyncio.CancelledError:
+                provider.record("cancelled")
+                if stream is not None:
+                    await stream.close()
+                raise
+            except Exception:
+                provider.record("error")
+                if stream is not None:
+                    await stream.close()
+                if loop.time() >= deadline:
+                    raise asyncio.TimeoutError()
+                continue  # Nothing was sent to the client yet: fail over to the next provider
+            provider.record("ok")
+            return stream, chunks, first
+        raise LLMUnavailable("no LLM provider could start the answer")
+
+    async def stream_answer(self, question: str, context: str, timeout: float = None):
+        """
+        Stream an answer in Bangla token by token as the model produces it.
+        Raises asyncio.TimeoutError if the whole answer is not finished before the deadline,
+        and LLMUnavailable (before the first token) if no provider can answer.
+        """
+
+        with timed("prompt"):
+            prompt = self.build_prompt(question, context)  # Build the prompt for this question
+        PROMPT_TOKENS.observe(estimate_tokens(prompt))
+        loop = asyncio.get_running_loop()  # Event loop clock used to track the deadline
+        deadline = loop.time() + (timeout or LLM_TIMEOUT)  # Absolute time by which the stream must finish
+
+        await self._acquire(deadline)
+        LLM_IN_FLIGHT.inc()
+        stream = None  # Streaming response, closed on exit so an abandoned stream frees its connection
+        completion_tokens = 0  # Estimated size of the streamed answer
+        try:
+            # Providers are only switched before the first chunk; after that the answer is committed
+            stream, chunks, chunk = await self._open_stream([{"role": "user", "content": prompt}], deadline)
+            while chunk is not None:
+                # Forward the text delta of the chunk, skipping empty keep-alive chunks
+                if chunk.choices and chunk.choices[0].delta.content:
+                    completion_tokens += estimate_tokens(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+                try:
+                    # Wait for the next chunk within the remaining time budget
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - loop.time())
+                except StopAsyncIteration:
+                    chunk = None  # The model finished the answer
+        finally:
+            if stream is not None:
+                await stream.close()  # Release the HTTP connection back to the pool
+            LLM_IN_FLIGHT.dec()
+            self.semaphore.release()  # Free the slot for the next completion
+            COMPLETION_TOKENS.observe(completion_tokens)
+
+    async def summarize(self, summary: str, conversation: str, max_tokens: int, timeout: float = None) -> str:
+        """
+        Fold new conversation turns into an existing summary and return the updated summary.
+        Raises asyncio.TimeoutError if the summary is not ready before the deadline,
+        and LLMUnavailable if no provider can answer.
+        """
+
+        # Ask for a short summary that keeps what later answers may need
+        prompt = f"""
+নিচে একজন গ্রাহকের সাথে আগের কথোপকথনের সারাংশ এবং তার পরের নতুন কথোপকথন দেওয়া আছে।
+দুটো মিলিয়ে একটি সংক্ষিপ্ত, হালনাগাদ সারাংশ লেখো, যাতে গ্রাহকের প্রশ্ন, অর্ডার ও পছন্দের গুরুত্বপূর্ণ তথ্য থাকে।
+শুধু সারাংশটি লেখো।
+
+আগের সারাংশ:
+{summary or "(নেই)"}
+
+নতুন কথোপকথন:
+{conversation}
+"""
+
+        deadline = asyncio.get_running_loop().time() + (timeout or LLM_TIMEOUT)
+        await self._acquire(deadline)  # Summaries share the completion slots with replies
+        try:
+            return await self._complete(
+                [{"role": "user", "content": prompt}],
+                deadline,
+                temperature=0.2,  # Keep summaries factual
+                max_tokens=max_tokens  # Keep the summary within its token budget
+            )
+        finally:
+            self.semaphore.release()
+
+    async def aclose(self):
+        """
+        Close the shared HTTP connection pool.
+        """
+        await self.http_client.aclose()  # Close the HTTP pool shared by every provider client
+
+
+# Shared BanglaLLM instance of this worker, created on first use (normally from the application lifespan)
+_llm = None
+
+
+def get_llm() -> BanglaLLM:
+    global _llm
+    if _llm is None:
+        _llm = BanglaLLM()
+    return _llm
+
 
-        # Return the model's response text after stripping extra spaces
-        return response.choices[0].message.content.strip()
+async def close_llm():
+    global _llm
+    if _llm is not None:
+        await _llm.aclose()  # Close the pooled LLM HTTP connections
+        _llm = None
@@ -10,16 +10,55 @@ MongoDB for user data and chat history. Chat responses are generated via the `ge
 from the chatbot module.
 """
 
-from fastapi import FastAPI, HTTPException  # Import FastAPI framework and HTTPException for error handling
+import asyncio  # Import asyncio to run background tasks
+from contextlib import asynccontextmanager  # Import asynccontextmanager to define the app lifespan
+from fastapi import FastAPI, HTTPException, Query, Header, Depends, WebSocket, WebSocketDisconnect  # Import FastAPI framework, HTTPException for error handling, Query for parameter validation, Header/Depends for admin checks and WebSocket types
 from fastapi.middleware.cors import CORSMiddleware  # Import CORS middleware to handle cross-origin requests
-from app.models import UserMessage, ChatResponse, UserRegister, ChatHistoryResponse  # Import Pydantic models
-from app.chatbot import get_reply  # Import chatbot function to generate replies
+from fastapi.responses import StreamingResponse, Response  # Import StreamingResponse to send Server-Sent Events and Response for raw bodies
+from starlette.background import BackgroundTask  # Import BackgroundTask to run cleanup once a response is done
+from app.models import UserMessage, ChatResponse, UserRegister, ChatHistoryResponse, BatchChatRequest, BatchChatResponse  # Import Pydantic models
+from app.chatbot import get_reply, get_replies, stream_reply, ChatSession  # Import chatbot functions to generate replies and the WebSocket session state
+from app.llm import get_llm, close_llm, LLMOverloaded  # Import accessors creating and closing the shared LLM client, and its load-shedding error
+from app.utils import get_faq_index, get_sentiment_analyzer  # Import lazy initializers of the FAQ index and sentiment analyzer
 from app.db import users_collection  # Import MongoDB users collection
+from app.redis_client import r  # Import the shared async Redis client
+from app.config import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, FAQ_WATCH_INTERVAL, ADMIN_TOKEN, LLM_QUEUE_TIMEOUT, BATCH_MAX_SIZE  # Import history pagination, FAQ reload, admin, admission and batch settings
 from datetime import datetime, timezone  # Import datetime and timezone utilities
-from app.services.history_service import load_chat_history  # Import function to load chat history from DB
+from typing import List, Optional  # Import List and Optional for optional query parameters
+from app.services.history_service import load_chat_history_json  # Import function to load chat history pages as JSON
+from app.services.answer_cache import stats as answer_cache_stats  # Import shared answer cache counters
+from app.services.local_cache import run_invalidation_listener  # Import the L1 cache invalidation listener
+from app.services.write_behind import turn_writer  # Import the write-behind queue for chat turns
+from app.services.faq_service import reload_faq_index, broadcast_faq_reload, watch_faq_file  # Import FAQ hot-reload helpers
+from app.services.summary_service import stop_summary_updates  # Import shutdown of background summary updates
+from app.services.export_service import export_ndjson, gzip_stream, export_slots  # Import the streaming NDJSON export
+from app.services.rate_limit import check_rate_limit  # Import the per-user token bucket
+from app.services.metrics import TimingMiddleware, render_metrics  # Import request timing and the Prometheus exposition
+import json  # Import JSON module to encode Server-Sent Event payloads
+import math  # Import math to round Retry-After headers up
+
+# Application lifespan: build shared state, start background tasks and release shared resources on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compile the FAQ index and load the NLTK lexicon in a thread, before the first request arrives
+    await asyncio.to_thread(get_faq_index)
+    await asyncio.to_thread(get_sentiment_analyzer)
+    get_llm()  # Create the shared LLM client and its connection pool
+
+    tasks = [asyncio.create_task(run_invalidation_listener())]  # Keep this worker's L1 cache coherent with the others
+    if FAQ_WATCH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(watch_faq_file()))  # Hot-reload the FAQ index when it changes
+    turn_writer.start()  # Persist chat turns to MongoDB in background batches
+    yield  # Serve requests
+    await stop_summary_updates()  # Abandon in-flight summary updates; they are redone later
+    await turn_writer.stop()  # Flush every queued chat turn before the connections go away
+    for task in tasks:
+        task.cancel()  # Stop background tasks
+    await close_llm()  # Close the pooled LLM HTTP connections
+    await r.aclose(close_connection_pool=True)  # Close the pooled Redis connections
 
 # Initialize FastAPI app with title
-app = FastAPI(title="Smart Cooking Customer Support Chatbot")
+app = FastAPI(title="Smart Cooking Customer Support Chatbot", lifespan=lifespan)
 
 # Add CORS middleware to allow requests from any origin
 app.add_middleware(
@@ -29,6 +68,20 @@ app.add_middleware(
     allow_headers=["*"]   # Allow all headers
 )
 
+# Time every request by route (and add a Server-Timing header when METRICS_TIMING_HEADER is set)
+app.add_middleware(TimingMiddleware)
+
+# Admin endpoints require the configured X-Admin-Token header (and are disabled when no token is configured)
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin access denied.")
+
+# Refuse the request with HTTP 429 when the user has used up their request budget
+async def enforce_rate_limit(user_id: str):
+    retry_after = await check_rate_limit(user_id)
+    if retry_after > 0:
+        raise HTTPException(status_code=429, detail="Too many requests, please slow down.", headers={"Retry-After": str(math.ceil(retry_after))})
+
 # User registration endpoint
 @app.post("/register")
 async def register(user: UserRegister):
@@ -48,19 +101,169 @@ async def register(user: UserRegister):
 # Chat endpoint to handle user messages
 @app.post("/chat", response_model=ChatResponse)
 async def chat(user_msg: UserMessage):
+    await enforce_rate_limit(user_msg.user_id)  # One user cannot crowd out the others
     try:
         # Call chatbot function to get response for user message
         return await get_reply(user_msg)
+    except LLMOverloaded:
+        # The LLM is saturated and shedding is configured to reject: tell the client to back off
+        raise HTTPException(status_code=429, detail="The assistant is busy, please try again shortly.", headers={"Retry-After": str(math.ceil(LLM_QUEUE_TIMEOUT))})
     except Exception as e:
         # Raise HTTP 500 error if any exception occurs
         raise HTTPException(status_code=500, detail=str(e))
 
-# Endpoint to retrieve chat history for a user
+# Batch chat endpoint for bulk and offline processing: many messages in, one reply per message out (same order).
+# Admin only: a batch answers messages of any user_id at once, bypassing the per-user rate limit of /chat
+@app.post("/chat/batch", response_model=BatchChatResponse, dependencies=[Depends(require_admin)])
+async def chat_batch(batch: BatchChatRequest):
+    if len(batch.messages) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_SIZE} messages per batch.")
+    try:
+        # Answer the whole batch with shared cache, FAQ and LLM passes
+        return BatchChatResponse(replies=await get_replies(batch.messages))
+    except Exception as e:
+        # Raise HTTP 500 error if any exception occurs
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Format one Server-Sent Event with a JSON payload
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Streaming chat endpoint: sends LLM tokens as Server-Sent Events as soon as they are generated
+@app.post("/chat/stream")
+async def chat_stream(user_msg: UserMessage):
+    await enforce_rate_limit(user_msg.user_id)  # Refused before the stream starts, so the client gets a real 429
+
+    async def events():
+        try:
+            # Forward tokens as "token" events and the finished reply as a final "reply" event
+            async for event, payload in stream_reply(user_msg):
+                if event == "token":
+                    yield sse_event("token", {"token": payload})
+                else:
+                    yield sse_event("reply", payload.model_dump())
+        except Exception as e:
+            # Headers are already sent, so report the failure as an "error" event
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",  # Server-Sent Events content type
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # Disable proxy buffering so tokens flush immediately
+    )
+
+# WebSocket chat: one connection per user session (/chat/ws?user_id=...). The client sends {"message": "..."}
+# frames; each reply streams back as "token" frames followed by a final "reply" frame (or an "error" frame).
+# The connection keeps its conversation state in memory, and turns are persisted in the background.
+@app.websocket("/chat/ws")
+async def chat_ws(websocket: WebSocket, user_id: str):
+    await websocket.accept()
+    session = ChatSession(user_id)  # Latest turns and FAQ context of this connection
+
+    async def send(event: str, data: dict):
+        await websocket.send_text(json.dumps({"event": event, **data}, ensure_ascii=False))
+
+    try:
+        while True:
+            try:
+                data = await websocket.receive_json()
+            except (ValueError, KeyError):
+                data = None  # Not a JSON text frame
+            message = data.get("message") if isinstance(data, dict) else None
+            if not isinstance(message, str) or not message.strip():
+                await send("error", {"detail": 'Expected a JSON frame like {"message": "..."}.'})
+                continue
+
+            retry_after = await check_rate_limit(user_id)
+            if retry_after > 0:
+                await send("error", {"detail": "Too many requests, please slow down.", "retry_after": math.ceil(retry_after)})
+                continue
+
+            try:
+                async for event, payload in stream_reply(UserMessage(user_id=user_id, message=message), session):
+                    if event == "token":
+                        await send("token", {"token": payload})
+                    else:
+                        await send("reply", payload.model_dump())
+            except LLMOverloaded as e:
+                await send("error", {"detail": str(e), "retry_after": math.ceil(LLM_QUEUE_TIMEOUT)})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # Keep the session open: the next message may well succeed
+                await send("error", {"detail": str(e)})
+    except WebSocketDisconnect:
+        pass  # Client went away; turns already saved are queued for MongoDB
+
+# Admin endpoint to rebuild the FAQ index from disk in every worker without dropping requests
+@app.post("/admin/faq/reload", dependencies=[Depends(require_admin)])
+async def admin_reload_faq():
+    try:
+        index = await reload_faq_index()  # Rebuild and swap in this worker
+    except Exception as e:
+        # Keep serving the current index if the new file is broken
+        raise HTTPException(status_code=400, detail=f"FAQ reload failed: {e}")
+    await broadcast_faq_reload()  # Other workers reload on their next watcher check
+    return {"records": len(index.records), "message": "FAQ index reloaded."}
+
+# Admin endpoint streaming chat turns as NDJSON (optionally gzip-compressed) for analytics
+@app.get("/admin/export/chats", dependencies=[Depends(require_admin)])
+async def admin_export_chats(
+    since: Optional[datetime] = None,  # Only turns created at or after this time
+    until: Optional[datetime] = None,  # Only turns created before this time
+    user_id: Optional[List[str]] = Query(None),  # Only these users (repeat the parameter for several)
+    gzip: bool = False  # Compress the stream with gzip
+):
+    if export_slots.locked():
+        # Exports read whole collections: keep them from piling up on a worker that also serves chat
+        raise HTTPException(status_code=429, detail="An export is already running, try again later.")
+    await export_slots.acquire()  # A slot is free, so this takes it without waiting: a concurrent request now gets the 429
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            export_slots.release()
+
+    async def body():
+        try:
+            chunks = export_ndjson(since, until, user_id)
+            async for chunk in (gzip_stream(chunks) if gzip else chunks):
+                yield chunk
+        finally:
+            release()
+
+    # The background task frees the slot too when the body never started (e.g. the client went away first)
+    if gzip:
+        return StreamingResponse(body(), media_type="application/gzip", headers={"Content-Disposition": 'attachment; filename="chats.ndjson.gz"'}, background=BackgroundTask(release))
+    return StreamingResponse(body(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+# Shared answer cache counters for this worker: every hit is an LLM call saved
+@app.get("/chat/cache/stats")
+async def get_answer_cache_stats():
+    hits = answer_cache_stats["exact_hits"] + answer_cache_stats["near_hits"]
+    lookups = hits + answer_cache_stats["misses"]
+    return {**answer_cache_stats, "llm_calls_saved": hits, "hit_ratio": hits / lookups if lookups else 0.0}
+
+# Prometheus metrics of this worker: per-stage latency, reply sources, LLM and pool usage
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# Endpoint to retrieve chat history for a user, one page at a time (newest page first);
+# the body is rendered by the history service, response_model only documents it
 @app.get("/chat/history/{user_id}", response_model=ChatHistoryResponse)
-async def get_chat_history(user_id: str):
+async def get_chat_history(
+    user_id: str,
+    before: Optional[datetime] = None,  # Cursor: only return turns created before this time (use next_cursor of the previous page)
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE)  # Number of turns per page
+):
     try:
-        # Load chat history from database
-        return await load_chat_history(user_id)
+        # Load one page of chat history from cache or database, already encoded
+        body = await load_chat_history_json(user_id, before, limit)
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         # Raise HTTP 500 error if any exception occurs
         raise HTTPException(status_code=500, detail=str(e))
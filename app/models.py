@@ -30,15 +30,25 @@ class ChatResponse(BaseModel):
     sentiment: Optional[str] = None  # Optional sentiment of the reply, defaults to None
 
 
+class BatchChatRequest(BaseModel):
+    messages: List[UserMessage]  # Messages to answer, possibly from many users
+
+
+class BatchChatResponse(BaseModel):
+    replies: List[ChatResponse]  # One reply per message, in the order of the request
+
+
 # ---------- Chat History ----------
 class ChatMessage(BaseModel):
     message: str  # The original user message
     reply: str  # The chatbot's reply
     sentiment: Optional[str] = None  # Optional sentiment of the message/reply
+    source: Optional[str] = None  # Optional source of the reply (redis-cache, json or llm)
     created_at: Optional[datetime] = None  # Optional timestamp of when the message was created
 
 
 class ChatHistoryResponse(BaseModel):
     user_id: str  # ID of the user whose chat history is being retrieved
     messages: List[ChatMessage]  # List of chat messages exchanged with the user
+    next_cursor: Optional[datetime] = None  # Pass as 'before' to fetch the next older page; None when there is none
     source: str  # Source of the chat history (e.g., database, knowledge base)
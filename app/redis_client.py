@@ -4,17 +4,25 @@ Directory: app/redis_client.py
 Summary:
 This file sets up the Redis client for the application. 
 It is used for caching FAQs and storing user short-term context.
+The client is asynchronous and shares a bounded connection pool, so Redis
+round-trips never block the event loop.
 """
 
-# Import the Redis library to interact with Redis database
-import redis
+# Import the asyncio flavour of the Redis library to interact with Redis without blocking
+import redis.asyncio as redis
 
-# Import the Redis connection URL from the application's config
-from app.config import REDIS_URL
+# Import the Redis connection URL and pool settings from the application's config
+from app.config import REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT
 
-# Create a Redis client instance using the connection URL
+# Create a bounded connection pool; when all connections are busy, callers wait
+# up to REDIS_POOL_TIMEOUT seconds for one instead of opening unbounded connections
 # decode_responses=True ensures that Redis responses are returned as Python strings
-r = redis.Redis.from_url(
+pool = redis.BlockingConnectionPool.from_url(
     REDIS_URL,
-    decode_responses=True
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT
 )
+
+# Create a Redis client instance backed by the shared pool
+r = redis.Redis(connection_pool=pool)
@@ -0,0 +1,108 @@
+"""
+File: retrieval.py
+Directory: app/retrieval.py
+Description:
+This file contains the offline FAQ retriever used to build LLM context.
+Every FAQ record's topic, keywords and Bangla answer are indexed once with BM25
+into per-term posting arrays (a sparse term-document matrix held in NumPy arrays).
+At query time only the postings of the query's terms are touched, and the best
+scoring records are returned within a token budget, so the prompt carries only
+the few FAQ entries that are relevant to the question.
+"""
+
+from collections import Counter  # Import Counter to count term frequencies
+from typing import Callable, Dict, List, Tuple  # Import typing helpers for annotations
+import numpy as np  # Import NumPy for vectorized BM25 scoring
+
+
+# Rough token count for budget checks: about four UTF-8 bytes per token
+# (one token per ~4 English characters, and a little more than one per Bangla character)
+def estimate_tokens(text: str) -> int:
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+class FaqRetriever:
+    """
+    BM25 index over FAQ records (topic, keywords and answer_bn).
+    """
+
+    def __init__(self, records: List[dict], normalize: Callable[[str], str], k1: float = 1.5, b: float = 0.75):
+        self.records = records  # FAQ records, in file order
+        self.normalize = normalize  # Text normalizer shared with incoming messages
+
+        # 1️⃣ Tokenize every record and collect term frequencies
+        doc_terms = [Counter(self._tokenize(self._document(rec))) for rec in records]
+        doc_len = np.array([sum(tf.values()) for tf in doc_terms], dtype=np.float32)
+        avg_len = float(doc_len.mean()) if len(records) and doc_len.mean() > 0 else 1.0
+
+        # 2️⃣ Build postings: term -> (record indices, precomputed BM25 weights)
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, tf in enumerate(doc_terms):
+            for term, count in tf.items():
+                postings.setdefault(term, []).append((doc_id, count))
+
+        n_docs = len(records)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, entries in postings.items():
+            ids = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+            tf = np.fromiter((c for _, c in entries), dtype=np.float32, count=len(entries))
+            df = len(entries)
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))  # BM25 inverse document frequency
+            norm = k1 * (1.0 - b + b * doc_len[ids] / avg_len)  # Document length normalization
+            self.postings[term] = (ids, (idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+
+        # 3️⃣ Precompute the context line and its token cost for every record
+        self.lines = [f"{rec['topic']}: {rec['answer_bn']}" for rec in records]
+        self.line_tokens = [estimate_tokens(line) for line in self.lines]
+
+    @staticmethod
+    def _document(record: dict) -> str:
+        # Text indexed for a record: its topic, all keywords and the Bangla answer
+        return " ".join([record.get("topic", "").replace("_", " "), " ".join(record.get("keywords", [])), record.get("answer_bn", "")])
+
+    def _tokenize(self, text: str) -> List[str]:
+        return self.normalize(text).split()  # Normalize like incoming messages, then split on whitespace
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Return the BM25 score of every record for the query.
+        """
+        scores = np.zeros(len(self.records), dtype=np.float32)
+        for term in set(self._tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights  # Record indices are unique within a posting list
+        return scores
+
+    def _select(self, query: str, k: int, token_budget: int) -> List[int]:
+        # Indices of up to k of the most relevant records whose context lines fit in the token budget
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores > 0)  # Only records sharing at least one term with the query
+        if candidates.size == 0:
+            return []
+        # Highest score first; ties broken by FAQ order so results are deterministic
+        ranked = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+        selected, used = [], 0
+        for doc_id in ranked:
+            cost = self.line_tokens[doc_id]
+            if used + cost > token_budget:
+                continue  # Too large for what is left of the budget; a shorter entry may still fit
+            selected.append(int(doc_id))
+            used += cost
+            if len(selected) == k:
+                break
+        return selected
+
+    def top_k(self, query: str, k: int, token_budget: int) -> List[dict]:
+        """
+        Return up to k of the most relevant records whose context lines fit in the token budget.
+        """
+        return [self.records[i] for i in self._select(query, k, token_budget)]
+
+    def context(self, query: str, k: int, token_budget: int) -> str:
+        """
+        Return the FAQ context block for the query, one "topic: answer" line per selected record.
+        """
+        return "\n".join(self.lines[i] for i in self._select(query, k, token_budget))
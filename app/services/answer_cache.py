@@ -0,0 +1,122 @@
+# File: app/services/answer_cache.py
+# Summary:
+# This service module provides the shared (cross-user) answer cache that sits in front
+# of the LLM. LLM answers are stored under a canonical form of the normalized question,
+# so the same question asked by any user is answered from Redis instead of the LLM.
+# Only non-personal answers are stored: callers skip answers whose prompt carried the
+# asking user's chat history or summary, since those may depend on that user's orders
+# and preferences.
+# Optionally, near-duplicate questions are matched too: each question gets a MinHash
+# signature over character n-grams, indexed with LSH band buckets in Redis, and a cached
+# answer is reused when the estimated Jaccard similarity reaches a tunable threshold.
+# Hit and miss counters show how many LLM calls the cache saves.
+
+import hashlib  # Import hashlib for stable cache keys
+import zlib  # Import zlib for a fast, process-independent shingle hash
+from typing import Optional  # Import Optional for annotations
+import numpy as np  # Import NumPy to compute MinHash signatures in one vectorized step
+from app.redis_client import r  # Import the Redis client instance
+from app.services.local_cache import local_cache  # Import the in-process L1 cache
+from app.config import (  # Import shared answer cache settings
+    REDIS_TTL,
+    ANSWER_CACHE_NEAR_DUPLICATES,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_NGRAM,
+    ANSWER_CACHE_BANDS,
+    ANSWER_CACHE_ROWS,
+)
+
+# MinHash permutations: h(x) = (a * x + b) mod P, with fixed coefficients so every worker agrees
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240101)
+_NUM_PERM = ANSWER_CACHE_BANDS * ANSWER_CACHE_ROWS
+_A = _rng.integers(1, _PRIME, size=_NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=_NUM_PERM, dtype=np.uint64)
+
+# Counters for this worker: exact hits, near-duplicate hits and misses (LLM calls)
+stats = {"exact_hits": 0, "near_hits": 0, "misses": 0}
+
+
+def canonical_query(normalized: str) -> str:
+    return " ".join(normalized.split())  # Collapse runs of whitespace and trim the normalized text
+
+
+def _answer_key(canonical: str) -> str:
+    return "answer:" + hashlib.sha1(canonical.encode("utf-8")).hexdigest()  # Bounded-length key per canonical question
+
+
+def _signature(canonical: str) -> np.ndarray:
+    # MinHash signature over the character n-grams of the canonical question
+    n = ANSWER_CACHE_NGRAM
+    text = f" {canonical} "  # Pad so word boundaries form n-grams too
+    shingles = {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+    x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def _band_keys(signature: np.ndarray):
+    # One LSH bucket per band: questions sharing any full band become candidates
+    rows = ANSWER_CACHE_ROWS
+    for band in range(ANSWER_CACHE_BANDS):
+        digest = hashlib.sha1(signature[band * rows:(band + 1) * rows].tobytes()).hexdigest()[:16]
+        yield f"answer_lsh:{band}:{digest}"
+
+
+async def lookup_answer(normalized: str) -> Optional[str]:
+    # Return a cached answer for the question (exact, then near-duplicate), or None
+    canonical = canonical_query(normalized)
+
+    # 1️⃣ Exact match on the canonical question (in-process cache first, then Redis)
+    key = _answer_key(canonical)
+    reply = local_cache.get(key)
+    if reply is None:
+        reply = await r.hget(key, "reply")
+        if reply is not None:
+            local_cache.set(key, reply)  # Answers are never invalidated: no version to check
+    if reply is not None:
+        stats["exact_hits"] += 1
+        return reply
+
+    # 2️⃣ Near-duplicate match through the LSH buckets
+    if ANSWER_CACHE_NEAR_DUPLICATES:
+        signature = _signature(canonical)
+        async with r.pipeline(transaction=False) as pipe:
+            for key in _band_keys(signature):
+                pipe.smembers(key)  # Candidate answer keys sharing this band
+            buckets = await pipe.execute()
+        candidates = set().union(*buckets)
+        if candidates:
+            candidates = sorted(candidates)  # Deterministic order for tie-breaking
+            async with r.pipeline(transaction=False) as pipe:
+                for key in candidates:
+                    pipe.hmget(key, "reply", "sig")
+                entries = await pipe.execute()
+            best, best_score = None, ANSWER_CACHE_SIMILARITY
+            for reply, sig in entries:
+                if reply is None or sig is None:
+                    continue  # Entry expired while its bucket was still alive
+                score = float(np.mean(np.frombuffer(bytes.fromhex(sig), dtype=np.uint64) == signature))  # Estimated Jaccard similarity
+                if score >= best_score:
+                    best, best_score = reply, score
+            if best is not None:
+                stats["near_hits"] += 1
+                return best
+
+    stats["misses"] += 1
+    return None
+
+
+def store_answer(pipe, normalized: str, reply: str):
+    # Queue the commands storing an LLM answer in the shared cache on a Redis pipeline (only for answers built without personal context)
+    canonical = canonical_query(normalized)
+    key = _answer_key(canonical)
+    if ANSWER_CACHE_NEAR_DUPLICATES:
+        signature = _signature(canonical)
+        pipe.hset(key, mapping={"reply": reply, "sig": signature.tobytes().hex()})
+        for band_key in _band_keys(signature):
+            pipe.sadd(band_key, key)  # Register the answer in every band bucket
+            pipe.expire(band_key, REDIS_TTL)
+    else:
+        pipe.hset(key, "reply", reply)
+    pipe.expire(key, REDIS_TTL)
+    local_cache.set(key, reply)  # Serve the next identical question in this worker without a Redis hop
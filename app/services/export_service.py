@@ -0,0 +1,100 @@
+# File: app/services/export_service.py
+# Summary:
+# This service module streams chat turns out of MongoDB as NDJSON (one JSON object per line)
+# for analytics, optionally gzip-compressed. Turns still embedded in legacy 'chat_histories'
+# documents are exported first, then the per-message 'chat_messages' collection; both can be
+# filtered by a created_at range and by user ids. Documents are read in cursor batches of
+# EXPORT_BATCH_SIZE and each batch is encoded and handed on before the next one is fetched, so
+# memory stays constant however large the collections are. Export cursors read with
+# EXPORT_READ_PREFERENCE (secondaries by default) and yield to the event loop between batches,
+# so live chat traffic is not starved. Lines come in storage order, not sorted.
+
+import asyncio  # Import asyncio to yield to request handlers between batches
+import zlib  # Import zlib for streaming gzip compression
+from datetime import datetime  # Import datetime for range filters
+from typing import AsyncIterator, List, Optional  # Import typing helpers for annotations
+import orjson  # Import orjson to encode NDJSON lines
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name  # Import read preference helpers
+from app.db import chat_collection, messages_collection  # Import the legacy and per-message MongoDB collections
+from app.services.turn_codec import TURN_FIELDS  # Import the public fields of a chat turn
+from app.utils import normalize_datetime  # Import utility to normalize datetime filters
+from app.config import EXPORT_BATCH_SIZE, EXPORT_READ_PREFERENCE, EXPORT_MAX_CONCURRENT, EXPORT_GZIP_LEVEL  # Import export settings
+
+# Fields of an exported line
+EXPORT_FIELDS = ("user_id",) + TURN_FIELDS
+
+# Read preference of export cursors
+READ_PREFERENCE = make_read_preference(read_pref_mode_from_name(EXPORT_READ_PREFERENCE), None)
+
+# Exports running in this worker (the admin endpoint refuses new ones beyond EXPORT_MAX_CONCURRENT)
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+def _range(since: Optional[datetime], until: Optional[datetime]) -> dict:
+    # created_at condition for [since, until); empty when unbounded
+    condition = {}
+    if since is not None:
+        condition["$gte"] = normalize_datetime(since)
+    if until is not None:
+        condition["$lt"] = normalize_datetime(until)
+    return condition
+
+
+def _encode(doc: dict) -> bytes:
+    # Naive datetimes from MongoDB are UTC; both kinds are written as ISO strings ending in 'Z'
+    return orjson.dumps(doc, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z) + b"\n"
+
+
+async def _batches(cursor, batch_size: int) -> AsyncIterator[bytes]:
+    # NDJSON chunks of up to 'batch_size' lines read from a MongoDB cursor
+    while True:
+        docs = await cursor.to_list(length=batch_size)
+        if not docs:
+            return
+        yield b"".join(_encode({field: doc.get(field) for field in EXPORT_FIELDS}) for doc in docs)
+        await asyncio.sleep(0)  # Let request handlers run between batches
+
+
+async def export_ndjson(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_ids: Optional[List[str]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Yield the chat turns created in [since, until) (of the given users only, when set) as
+    NDJSON chunks, one chunk per MongoDB batch.
+    """
+    created_at = _range(since, until)
+    users = {"user_id": {"$in": user_ids}} if user_ids else {}
+
+    # 1️⃣ Turns embedded in legacy documents not migrated yet, unwound on the server
+    pipeline = [
+        {"$match": {"migrated": {"$ne": True}, **users}},
+        {"$unwind": "$messages"},
+    ]
+    if created_at:
+        pipeline.append({"$match": {"messages.created_at": created_at}})
+    pipeline.append({"$project": {"_id": 0, "user_id": 1, **{field: f"$messages.{field}" for field in TURN_FIELDS}}})
+    legacy = chat_collection.with_options(read_preference=READ_PREFERENCE)
+    async for chunk in _batches(legacy.aggregate(pipeline, batchSize=batch_size), batch_size):
+        yield chunk
+
+    # 2️⃣ Per-message turns
+    query = dict(users)
+    if created_at:
+        query["created_at"] = created_at
+    messages = messages_collection.with_options(read_preference=READ_PREFERENCE)
+    cursor = messages.find(query, {"_id": 0, **{field: 1 for field in EXPORT_FIELDS}}, batch_size=batch_size)
+    async for chunk in _batches(cursor, batch_size):
+        yield chunk
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = EXPORT_GZIP_LEVEL) -> AsyncIterator[bytes]:
+    # Compress a stream of chunks into a single gzip stream without buffering it
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
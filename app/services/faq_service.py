@@ -0,0 +1,69 @@
+# File: app/services/faq_service.py
+# Summary:
+# This service module hot-reloads the FAQ index without restarting workers.
+# A reload reads and compiles app/faq_data.json in a worker thread, so requests keep
+# being served from the current index, and then swaps the new index in with a single
+# assignment. A broken file is rejected and the current index stays in place.
+# Every worker runs a watcher that reloads when the file changes on disk or when
+# another worker bumps the shared 'faq_index:version' key (the admin reload endpoint).
+
+import asyncio  # Import asyncio to run the compile step in a thread and to sleep between checks
+import logging  # Import logging to report reloads and failures
+import os  # Import os to read the FAQ file's modification time
+from app.redis_client import r  # Import the Redis client instance
+from app.utils import FaqIndex, load_faq_index, set_faq_index  # Import the FAQ index loader and swap helper
+from app.config import FAQ_PATH, FAQ_WATCH_INTERVAL  # Import FAQ file location and watch interval
+
+logger = logging.getLogger(__name__)
+
+# Redis key bumped whenever any worker is asked to reload, so all workers follow
+FAQ_VERSION_KEY = "faq_index:version"
+
+# Serializes reloads inside this worker
+_reload_lock = asyncio.Lock()
+
+
+def _file_stamp():
+    try:
+        return os.stat(FAQ_PATH).st_mtime_ns  # Changes whenever the file is rewritten
+    except OSError:
+        return None
+
+
+async def reload_faq_index() -> FaqIndex:
+    """
+    Rebuild the FAQ index from disk in the background and swap it in. Raises if the file is invalid.
+    """
+    async with _reload_lock:
+        index = await asyncio.to_thread(load_faq_index, FAQ_PATH)  # Parse and compile without blocking requests
+        set_faq_index(index)  # Atomic swap: in-flight requests finish on the index they already hold
+        logger.info("FAQ index reloaded: %d records", len(index.records))
+        return index
+
+
+async def broadcast_faq_reload():
+    await r.incr(FAQ_VERSION_KEY)  # Other workers' watchers see the new version and reload too
+
+
+async def watch_faq_file():
+    # Background task: reload when the FAQ file changes or another worker requested a reload
+    stamp = _file_stamp()
+    version = None
+    try:
+        version = await r.get(FAQ_VERSION_KEY)
+    except Exception as e:
+        logger.warning("could not read %s: %s", FAQ_VERSION_KEY, e)
+    while True:
+        await asyncio.sleep(FAQ_WATCH_INTERVAL)
+        try:
+            new_stamp, new_version = _file_stamp(), await r.get(FAQ_VERSION_KEY)
+        except Exception as e:
+            logger.warning("could not read %s: %s", FAQ_VERSION_KEY, e)
+            continue
+        if new_stamp == stamp and new_version == version:
+            continue
+        try:
+            await reload_faq_index()
+        except Exception as e:
+            logger.error("FAQ reload failed, keeping the current index: %s", e)
+        stamp, version = new_stamp, new_version  # Do not retry a broken file until it changes again
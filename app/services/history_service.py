@@ -1,56 +1,227 @@
 # File: app/services/history_service.py
 # Summary:
-# This service module provides functionality to load a user's chat history.
-# It first attempts to retrieve the history from Redis cache for faster access.
-# If the data is not in Redis, it fetches it from MongoDB, normalizes timestamps,
-# sorts the messages, caches the result in Redis, and then returns the data.
+# This service module provides functionality to read a user's chat history.
+# Every chat turn is stored as its own document in the 'chat_messages' collection,
+# indexed on (user_id, created_at), so reads only touch the turns they need:
+# the LLM context path fetches the last N turns, and the history endpoint pages
+# backwards in time with a 'before' cursor. A page never ends between two turns with the
+# same timestamp (it grows to hold all of them), since the next page only asks for older
+# turns. Users whose turns still live in the legacy embedded 'messages' array of
+# 'chat_histories' are served from that array (sliced server-side) until migrated.
+#
+# The latest turns of each user are also kept in a capped Redis list
+# ('chat_history:{user_id}', oldest first). New turns are appended to it as they
+# are saved, so recent-history reads are a single range read with no MongoDB
+# round-trip and no re-sort. The list is only rebuilt from MongoDB when it has expired.
+# Decoded lists are also kept in the in-process L1 cache; appending a turn broadcasts an
+# invalidation of the user's list to every worker. Turns still waiting in this worker's
+# write-behind queue are merged into MongoDB reads, so users always see their own writes.
+# Cached turns use the compact format of turn_codec (orjson, epoch-millisecond timestamps,
+# compression of large entries), and pages are rendered straight to JSON bytes without
+# re-validating turns through the response model.
 
+from datetime import datetime  # Import datetime for cursor typing
+from typing import List, Optional, Tuple  # Import typing helpers for annotations
+from redis.client import NEVER_DECODE  # Import the option reading a reply as raw bytes
+from redis.exceptions import WatchError  # Import WatchError raised when a watched key changes
 from app.redis_client import r  # Import the Redis client instance
-from app.db import chat_collection  # Import the MongoDB collection for chats
+from app.services.local_cache import local_cache, publish_invalidation  # Import the in-process L1 cache and its invalidation broadcast
+from app.services.write_behind import turn_writer, pending_key  # Import the write-behind queue and its pending-turn counter
+from app.services.turn_codec import TURN_FIELDS, encode_turn, decode_turn, render_history  # Import the cached turn format and page rendering
+from app.db import chat_collection, messages_collection  # Import the legacy and per-message MongoDB collections
 from app.models import ChatHistoryResponse  # Import the response model for chat history
-from app.config import REDIS_TTL  # Import the Redis time-to-live setting
+from app.config import REDIS_TTL, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE  # Import the Redis time-to-live and page size settings
 from app.utils import normalize_datetime  # Import utility to normalize datetime fields
-import json  # Import JSON module for serialization/deserialization
-
-async def load_chat_history(user_id: str) -> ChatHistoryResponse:
-    # Define a Redis key for storing/fetching the user's chat history
-    redis_key = f"chat_history:{user_id}"
-
-    # 1️⃣ Attempt to retrieve cached messages from Redis
-    cached = r.get(redis_key)
-    if cached:
-        # Deserialize the cached JSON string into Python objects
-        messages = json.loads(cached)
-
-        # Normalize the 'created_at' field of each message
-        for msg in messages:
-            msg["created_at"] = normalize_datetime(msg.get("created_at"))
-
-        # Return the chat history with a flag indicating it came from Redis
-        return ChatHistoryResponse(
-            user_id=user_id,
-            messages=messages,
-            source="redis"
-        )
-
-    # 2️⃣ If not in Redis, fetch the user's chat document from MongoDB
-    doc = await chat_collection.find_one({"user_id": user_id})
-    # Extract the 'messages' list from the document or use an empty list
-    messages = doc.get("messages", []) if doc else []
-
-    # Normalize the 'created_at' field of each message
+
+# Fields read for each chat turn ('_id' is also read, to merge with unwritten turns)
+MESSAGE_PROJECTION = {field: 1 for field in TURN_FIELDS}
+
+# Turns kept in the Redis list: one more than the largest page, so a cached
+# page can always tell whether an older turn exists
+HISTORY_CACHE_SIZE = HISTORY_MAX_PAGE_SIZE + 1
+
+
+def history_key(user_id: str) -> str:
+    return f"chat_history:{user_id}"  # Redis list holding the user's latest turns
+
+
+def history_version_key(user_id: str) -> str:
+    return f"chat_history_version:{user_id}"  # Counter bumped on every new turn, used to detect racing rebuilds
+
+
+def cache_turn(pipe, user_id: str, turn: dict):
+    # Queue the commands appending a new turn to the user's cached history on a Redis pipeline
+    key = history_key(user_id)
+    pipe.rpushx(key, encode_turn(turn))  # Append only if the list exists; a missing list is rebuilt on the next read
+    pipe.ltrim(key, -HISTORY_CACHE_SIZE, -1)  # Keep only the latest turns
+    pipe.expire(key, REDIS_TTL)  # Active users keep their list warm
+    pipe.incr(history_version_key(user_id))  # Tell in-flight rebuilds that they are now stale
+    pipe.expire(history_version_key(user_id), REDIS_TTL)
+    publish_invalidation(pipe, key)  # Every worker drops its L1 copy of the list
+
+
+async def _legacy_messages(user_id: str, before: Optional[datetime], limit: int) -> List[dict]:
+    # Newest-first turns older than 'before' from the legacy embedded array, sliced inside MongoDB
+    messages = "$messages"
+    if before is not None:
+        messages = {"$filter": {"input": "$messages", "cond": {"$lt": ["$$this.created_at", before]}}}
+    pipeline = [
+        {"$match": {"user_id": user_id, "migrated": {"$ne": True}}},  # Skip documents already exploded into chat_messages
+        {"$project": {"_id": 0, "messages": {"$slice": [messages, -limit]}}},  # Only the last 'limit' matching turns
+    ]
+    docs = await chat_collection.aggregate(pipeline).to_list(length=1)
+    return list(reversed(docs[0].get("messages") or [])) if docs else []
+
+
+async def _newest_messages(user_id: str, before: Optional[datetime], count: int) -> List[dict]:
+    # Up to 'count' turns older than 'before', newest first: unwritten, per-message and legacy turns merged
+    query = {"user_id": user_id}
+    if before is not None:
+        query["created_at"] = {"$lt": before}
+
+    # Turns of this user still queued for writing in this worker
+    pending = [doc for doc in turn_writer.pending_for(user_id) if before is None or doc["created_at"] < before]
+
+    cursor = messages_collection.find(query, MESSAGE_PROJECTION).sort("created_at", -1).limit(count)
+    written = await cursor.to_list(length=count)
+
+    # Merge unwritten turns in, skipping any that were written while we were reading
+    pending_ids = {doc["_id"] for doc in pending}
+    messages = pending + [doc for doc in written if doc["_id"] not in pending_ids]
+
+    # Legacy turns are all older than per-message ones, so only look there when this page is not full,
+    # and only before the oldest per-message turn (a user being migrated has turns in both places)
+    if len(messages) < count:
+        oldest = min((normalize_datetime(msg["created_at"]) for msg in messages), default=before)
+        messages += await _legacy_messages(user_id, oldest, count - len(messages))
+
+    # Keep only the public fields and normalize the 'created_at' field of each message
+    messages = [{field: msg.get(field) for field in TURN_FIELDS} for msg in messages]
     for msg in messages:
         msg["created_at"] = normalize_datetime(msg.get("created_at"))
+    messages.sort(key=lambda msg: msg["created_at"], reverse=True)  # Newest first
+    return messages[:count]
+
+
+async def fetch_messages(user_id: str, before: Optional[datetime], limit: int) -> Tuple[List[dict], Optional[datetime]]:
+    # Returns up to 'limit' turns older than 'before' from MongoDB in chronological order (more when
+    # several turns share the timestamp of the oldest one), plus the cursor for the next (older) page,
+    # or None when there is nothing older
+    if before is not None:
+        before = normalize_datetime(before)
+
+    count = limit + 1  # One extra turn to know whether an older page exists
+    while True:
+        messages = await _newest_messages(user_id, before, count)  # Newest first
+        end = limit
+        while end < len(messages) and messages[end]["created_at"] == messages[end - 1]["created_at"]:
+            end += 1  # Keep turns with the same timestamp together: the next page only asks for older ones
+        if end < len(messages) or len(messages) < count:
+            break
+        count *= 2  # Every extra turn read ties with the oldest on the page: there may be more of them
+
+    has_more = end < len(messages)
+    messages = messages[:end]
+    messages.reverse()  # Oldest first, as the history is displayed
+
+    next_cursor = messages[0]["created_at"] if has_more and messages else None
+    return messages, next_cursor
+
+
+async def _rebuild_cache(user_id: str) -> List[dict]:
+    # Reload the latest turns from MongoDB into the Redis list and return them (oldest first)
+    version, pending = await r.mget(history_version_key(user_id), pending_key(user_id))  # Version before reading MongoDB
+    l1_version = local_cache.version(history_key(user_id))  # L1 version of the list before reading MongoDB
+    turns, _ = await fetch_messages(user_id, None, HISTORY_CACHE_SIZE)
+    if not turns:
+        return turns  # Nothing to cache for a user without history
+    if pending and int(pending) > 0:
+        return turns  # Some worker still has unwritten turns of this user: MongoDB is not complete yet
+
+    key = history_key(user_id)
+    try:
+        async with r.pipeline(transaction=True) as pipe:
+            await pipe.watch(history_version_key(user_id))  # Abort if a turn is saved while we write
+            if await pipe.get(history_version_key(user_id)) != version:
+                return turns  # A newer turn landed after our MongoDB read; leave the list to the next reader
+            pipe.multi()
+            pipe.delete(key)
+            pipe.rpush(key, *[encode_turn(t) for t in turns])  # Oldest first
+            pipe.expire(key, REDIS_TTL)
+            await pipe.execute()
+        local_cache.set(key, turns, version=l1_version)  # Share the fresh list with later reads in this worker
+    except WatchError:
+        pass  # Same as above: our snapshot is stale, so it is not cached
+    return turns
+
+
+def _page(turns: List[dict], before: Optional[datetime], limit: int, complete: bool):
+    # Cut one page out of cached turns; returns None if the cache cannot answer it on its own
+    end = len(turns)
+    if before is not None:
+        end = next((i for i, t in enumerate(turns) if t["created_at"] >= before), len(turns))
+    start = max(0, end - limit)
+    while 0 < start < end and turns[start - 1]["created_at"] == turns[start]["created_at"]:
+        start -= 1  # Keep turns with the same timestamp together: the next page only asks for older ones
+    if start == 0 and not complete:
+        return None  # Older turns may exist beyond what the cache holds
+    page = turns[start:end]
+    next_cursor = page[0]["created_at"] if start > 0 and page else None
+    return page, next_cursor
+
+
+async def _cached_page(user_id: str, before: Optional[datetime], limit: int):
+    # Serve a page from the L1 cache or the Redis list when possible; returns None on a miss
+    key = history_key(user_id)
+    turns = local_cache.get(key)  # Decoded turns shared by all readers in this worker; never mutated
+    if turns is None:
+        version = local_cache.version(key)
+        raw = await r.execute_command("LRANGE", key, 0, -1, **{NEVER_DECODE: True})  # Whole (capped) list, oldest first, as bytes
+        if not raw:
+            return None
+        turns = [decode_turn(item) for item in raw]
+        local_cache.set(key, turns, version=version)  # Unless the list was invalidated meanwhile
+    # A list shorter than its cap holds the user's whole history
+    complete = len(turns) < HISTORY_CACHE_SIZE
+    return _page(turns, before, limit, complete)
+
+
+async def recent_messages(user_id: str, limit: int) -> List[dict]:
+    # The last 'limit' turns of a user, oldest first (used to build LLM context)
+    cached = await _cached_page(user_id, None, limit)
+    if cached is not None:
+        return cached[0]
+    turns = await _rebuild_cache(user_id)
+    return turns[-limit:]
+
+
+async def load_history_page(user_id: str, before: Optional[datetime] = None, limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[dict], Optional[datetime], str]:
+    # One page of chat history: the turns (oldest first), the cursor of the next older page and where it came from
+    if before is not None:
+        before = normalize_datetime(before)  # Cached turns are tz-aware UTC; a cursor without an offset is UTC too
+
+    # 1️⃣ Attempt to serve the page from the user's Redis list
+    cached = await _cached_page(user_id, before, limit)
+    if cached is not None:
+        messages, next_cursor = cached
+        return messages, next_cursor, "redis"  # Flag indicating it came from Redis
+
+    # 2️⃣ If not in Redis, rebuild the list for the latest page or page through MongoDB for older ones
+    if before is None:
+        turns = await _rebuild_cache(user_id)
+        messages, next_cursor = _page(turns, None, limit, len(turns) < HISTORY_CACHE_SIZE) or await fetch_messages(user_id, None, limit)
+    else:
+        messages, next_cursor = await fetch_messages(user_id, before, limit)
+    return messages, next_cursor, "mongodb"  # Flag indicating it came from MongoDB
+
 
-    # Sort the messages chronologically by 'created_at'
-    messages = sorted(messages, key=lambda x: x["created_at"])
+async def load_chat_history(user_id: str, before: Optional[datetime] = None, limit: int = HISTORY_PAGE_SIZE) -> ChatHistoryResponse:
+    # One page of chat history as a validated response model
+    messages, next_cursor, source = await load_history_page(user_id, before, limit)
+    return ChatHistoryResponse(user_id=user_id, messages=messages, next_cursor=next_cursor, source=source)
 
-    # 3️⃣ Save the sorted messages into Redis with a TTL
-    r.setex(redis_key, REDIS_TTL, json.dumps(messages, default=str))
 
-    # Return the chat history with a flag indicating it came from MongoDB
-    return ChatHistoryResponse(
-        user_id=user_id,
-        messages=messages,
-        source="mongodb"
-    )
+async def load_chat_history_json(user_id: str, before: Optional[datetime] = None, limit: int = HISTORY_PAGE_SIZE) -> bytes:
+    # One page of chat history rendered directly to the JSON body of ChatHistoryResponse (fast path of the endpoint)
+    messages, next_cursor, source = await load_history_page(user_id, before, limit)
+    return render_history(user_id, messages, next_cursor, source)
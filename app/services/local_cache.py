@@ -0,0 +1,134 @@
+# File: app/services/local_cache.py
+# Summary:
+# This service module provides the in-process (L1) cache that sits in front of Redis.
+# Entries live in a bounded LRU with a per-entry TTL and are evicted by an estimated
+# memory footprint, so hot replies and history lists are served with no network hop.
+# Keys that change (for example a user's history after a new chat turn) are
+# invalidated in every uvicorn worker through a Redis pub/sub channel; each worker
+# runs a listener task that drops the announced keys from its own L1 cache.
+# Fills of keys that can be invalidated carry the key's version read before the Redis
+# round-trip, and are dropped if that key (and only that key) was invalidated meanwhile.
+
+import asyncio  # Import asyncio for the listener task and reconnect back-off
+import logging  # Import logging to report listener reconnects
+import sys  # Import sys to estimate object sizes
+import time  # Import time for TTL bookkeeping
+from collections import OrderedDict  # Import OrderedDict to keep LRU order
+from app.redis_client import r  # Import the Redis client instance
+from app.config import L1_CACHE_MAX_BYTES, L1_CACHE_TTL, CACHE_INVALIDATION_CHANNEL  # Import L1 cache settings
+
+logger = logging.getLogger(__name__)
+
+# Invalidated keys whose version is tracked; past this, the versions of every key are reset at once
+MAX_TRACKED_KEYS = 50_000
+
+
+def _sizeof(value) -> int:
+    # Approximate memory footprint of cached values (strings, numbers, datetimes and lists/dicts of them)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LocalCache:
+    """
+    Bounded LRU/TTL cache evicting least recently used entries above a memory limit.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes  # Memory budget for all entries
+        self.ttl = ttl  # Default lifetime of an entry in seconds
+        self.bytes = 0  # Current estimated footprint
+        self.epoch = 0  # Bumped whenever every key's version is reset at once
+        self._generations = {}  # key -> number of invalidations of the key since the last reset
+        self._data = OrderedDict()  # key -> (expires_at, size, value), least recently used first
+
+    def version(self, key: str) -> tuple:
+        # Read before fetching an invalidatable key from Redis and pass to set(), which drops the value
+        # if the key was invalidated in between
+        return self.epoch, self._generations.get(key, 0)
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self.delete(key)  # Expired: drop it and report a miss
+            return None
+        self._data.move_to_end(key)  # Mark as most recently used
+        return value
+
+    def set(self, key: str, value, ttl: float = None, version: int = None):
+        # 'version' is the key's version read before fetching the value from Redis; if the key
+        # was invalidated since, the value may already be stale and is not stored
+        if version is not None and version != self.version(key):
+            return
+        self.delete(key)  # Replace any previous entry and its accounted size
+        size = _sizeof(key) + _sizeof(value)
+        if size > self.max_bytes:
+            return  # Larger than the whole cache: never worth keeping
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), size, value)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted, _) = self._data.popitem(last=False)  # Evict the least recently used entry
+            self.bytes -= evicted
+
+    def delete(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, key: str):
+        self.delete(key)
+        if key not in self._generations and len(self._generations) >= MAX_TRACKED_KEYS:
+            self._reset_versions()  # Bounded memory: fills in flight are dropped, nothing stale is stored
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+        self._reset_versions()
+
+    def _reset_versions(self):
+        self._generations.clear()
+        self.epoch += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+# L1 cache shared by this worker
+local_cache = LocalCache(L1_CACHE_MAX_BYTES, L1_CACHE_TTL)
+
+
+def publish_invalidation(pipe, key: str):
+    # Drop a key from this worker's L1 cache now and queue its invalidation for every worker on a Redis pipeline
+    # (the broadcast reaches this worker too, after the pipeline's writes have been applied)
+    local_cache.invalidate(key)
+    pipe.publish(CACHE_INVALIDATION_CHANNEL, key)
+
+
+async def run_invalidation_listener():
+    # Background task: apply invalidations broadcast by any worker to this worker's L1 cache
+    backoff = 0.5
+    while True:
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            local_cache.clear()  # Invalidations may have been missed while we were not subscribed
+            backoff = 0.5
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    local_cache.invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("L1 cache invalidation listener disconnected: %s", e)
+            local_cache.clear()  # Stay coherent: forget everything rather than serve stale entries
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)  # Back off up to 30 seconds between reconnect attempts
+        finally:
+            await pubsub.aclose()
@@ -0,0 +1,177 @@
+# File: app/services/metrics.py
+# Summary:
+# This service module holds the application's Prometheus metrics and the helpers that feed them.
+# Each step of the reply pipeline (cache lookup, intent detection, history fetch, prompt
+# assembly, LLM call, MongoDB write, Redis write/invalidation, ...) is timed with 'timed(stage)'
+# into one latency histogram labelled by stage. Replies are counted by source, prompt and
+# completion sizes are recorded in (estimated) tokens, and gauges track LLM calls waiting for
+# and holding a concurrency slot. Redis pool usage and the shared answer cache counters are read
+# at scrape time; MongoDB pool usage is followed through a PyMongo connection pool listener.
+# When enabled, the stage timings of a request are also returned in a 'Server-Timing' header.
+# Metrics are kept per worker process; Prometheus should scrape (or label) every worker.
+
+import time  # Import time for high-resolution stage timers
+from contextlib import contextmanager  # Import contextmanager to build the stage timer
+from contextvars import ContextVar  # Import ContextVar to collect the stage timings of the current request
+from typing import Dict, Optional  # Import typing helpers for annotations
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest  # Import Prometheus metric types and exposition
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily  # Import metric families for scrape-time collectors
+from prometheus_client.registry import Collector  # Import the base class of custom collectors
+from pymongo import monitoring  # Import PyMongo monitoring to follow MongoDB pool usage
+from app.redis_client import pool as redis_pool  # Import the shared Redis connection pool
+from app.services.answer_cache import stats as answer_cache_stats  # Import shared answer cache counters
+from app.config import METRICS_TIMING_HEADER  # Import the Server-Timing header switch
+
+# Latency buckets from sub-millisecond cache hits up to the LLM deadline
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Size buckets for prompts and completions, in estimated tokens
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Time spent in each reply pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("chatbot_request_seconds", "HTTP request latency by route", ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+REPLIES = Counter("chatbot_replies_total", "Replies served, by source", ["source"])
+PROMPT_TOKENS = Histogram("chatbot_llm_prompt_tokens", "Estimated size of LLM prompts", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram("chatbot_llm_completion_tokens", "Estimated size of LLM completions", buckets=TOKEN_BUCKETS)
+LLM_IN_FLIGHT = Gauge("chatbot_llm_in_flight", "LLM calls currently holding a concurrency slot")
+LLM_WAITING = Gauge("chatbot_llm_waiting", "LLM calls waiting for a concurrency slot")
+LLM_ATTEMPTS = Counter("chatbot_llm_attempts_total", "LLM provider requests by outcome (ok, error, cancelled)", ["provider", "outcome"])
+LLM_HEDGES = Counter("chatbot_llm_hedges_total", "Hedged second LLM requests sent")
+LLM_CIRCUIT_OPEN = Gauge("chatbot_llm_circuit_open", "1 while a provider's circuit breaker is open", ["provider"])
+LLM_SHED = Counter("chatbot_llm_shed_total", "LLM calls shed by admission control", ["reason"])
+TURNS_DROPPED = Counter("chatbot_turns_dropped_total", "Chat turns the write-behind queue could not persist, by reason", ["reason"])
+RATE_LIMITED = Counter("chatbot_rate_limited_total", "Chat requests refused by the per-user rate limit")
+MONGO_CONNECTIONS = Gauge("chatbot_mongo_pool_connections", "MongoDB pool connections by server and state", ["address", "state"])
+
+# Stage timings of the current request (stage -> seconds), set by the timing middleware when the header is enabled
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    # Record one measurement of a pipeline stage (repeated stages in one request add up)
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str):
+    # Time the enclosed block as one pipeline stage
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def count_reply(source: str):
+    REPLIES.labels(source).inc()
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware recording request latency by route and, when enabled, adding a
+    Server-Timing header with the stage timings collected before the response started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        timings = {} if METRICS_TIMING_HEADER else None
+        token = _timings.set(timings)
+        status = 500  # Reported if the app fails before starting a response
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings is not None:
+                    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+                    entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.2f}")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", ", ".join(entries).encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            route = scope.get("route")  # Set by the router; keeps label cardinality bounded (no user ids)
+            REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"), str(status)).observe(time.perf_counter() - start)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Follows MongoDB connection pool events to report open and checked-out connections.
+    Events are published from driver threads; Prometheus gauges are thread-safe.
+    """
+
+    @staticmethod
+    def _gauge(event, state: str):
+        host, port = event.address
+        return MONGO_CONNECTIONS.labels(f"{host}:{port}", state)
+
+    def connection_created(self, event):
+        self._gauge(event, "open").inc()
+
+    def connection_closed(self, event):
+        self._gauge(event, "open").dec()
+
+    def connection_checked_out(self, event):
+        self._gauge(event, "in_use").inc()
+
+    def connection_checked_in(self, event):
+        self._gauge(event, "in_use").dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+# Listener passed to the MongoDB client
+mongo_pool_listener = MongoPoolListener()
+
+
+class _ScrapeTimeCollector(Collector):
+    # Values that already live elsewhere, read when Prometheus scrapes
+
+    def collect(self):
+        redis = GaugeMetricFamily("chatbot_redis_pool_connections", "Redis pool connections by state", labels=["state"])
+        redis.add_metric(["in_use"], len(redis_pool._in_use_connections))
+        redis.add_metric(["idle"], len(redis_pool._available_connections))
+        redis.add_metric(["max"], redis_pool.max_connections)
+        yield redis
+
+        answers = CounterMetricFamily("chatbot_answer_cache_lookups", "Shared answer cache lookups by result", labels=["result"])
+        for result, count in answer_cache_stats.items():
+            answers.add_metric([result], count)
+        yield answers
+
+
+REGISTRY.register(_ScrapeTimeCollector())
+
+
+def render_metrics():
+    # Current metrics of this worker in the Prometheus text format, with its content type
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,59 @@
+# File: app/services/rate_limit.py
+# Summary:
+# This service module limits how fast a single user can send chat requests, so one noisy client
+# cannot fill the LLM slots of every worker. Each user has a token bucket in Redis
+# ('rate_limit:{user_id}') refilled at RATE_LIMIT_PER_SEC up to RATE_LIMIT_BURST tokens; a request
+# takes one token or is refused with the time until the next token. The bucket is updated by a
+# Lua script, so concurrent requests in different workers are counted exactly and the refill uses
+# the Redis server's clock. When Redis cannot be reached the limit is not enforced (fail open).
+
+import logging  # Import logging to report limiter errors
+from redis.exceptions import RedisError  # Import RedisError to fail open when Redis is unavailable
+from app.redis_client import r  # Import the Redis client instance
+from app.services.metrics import RATE_LIMITED  # Import the refused-request counter
+from app.config import RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST  # Import rate limit settings
+
+logger = logging.getLogger(__name__)
+
+# Token bucket: ARGV = refill rate (tokens/s), burst; returns {allowed, milliseconds until a token is available}
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, wait}
+"""
+
+_token_bucket = r.register_script(TOKEN_BUCKET)
+
+
+def rate_limit_key(user_id: str) -> str:
+    return f"rate_limit:{user_id}"  # Token bucket of the user
+
+
+async def check_rate_limit(user_id: str) -> float:
+    # Take one token from the user's bucket; returns 0 when the request may go ahead, otherwise the seconds to wait
+    if RATE_LIMIT_PER_SEC <= 0:
+        return 0.0
+    try:
+        allowed, wait_ms = await _token_bucket(keys=[rate_limit_key(user_id)], args=[RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST])
+    except RedisError as e:
+        logger.warning("rate limit check failed, allowing request: %s", e)
+        return 0.0
+    if allowed:
+        return 0.0
+    RATE_LIMITED.inc()
+    return int(wait_ms) / 1000
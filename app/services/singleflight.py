@@ -0,0 +1,130 @@
+# File: app/services/singleflight.py
+# Summary:
+# This service module coalesces identical in-flight LLM requests ("single flight").
+# Inside one worker, concurrent callers with the same key share one asyncio future,
+# so only the first caller runs the completion and the others await its result.
+# Across workers, the first caller takes a short Redis lock ('llm_lock:{key}') and
+# publishes its answer under 'llm_result:{key}'; callers in other workers that find
+# the lock taken poll for that result instead of starting their own completion, and
+# only fall back to calling the LLM themselves if the lock holder disappears.
+# Streaming replies lead with lead()/finish() instead of coalesce(), so the tokens reach their
+# own caller while every identical request in the worker waits for the finished answer.
+
+import asyncio  # Import asyncio for futures and polling sleeps
+import hashlib  # Import hashlib to build bounded-length keys
+import uuid  # Import uuid to tag lock ownership
+from typing import Awaitable, Callable, Dict, Optional  # Import typing helpers for annotations
+from app.redis_client import r  # Import the Redis client instance
+from app.config import SINGLEFLIGHT_LOCK_TTL, SINGLEFLIGHT_RESULT_TTL, SINGLEFLIGHT_POLL_INTERVAL  # Import single-flight settings
+
+# In-flight calls of this worker, by key
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def flight_key(normalized: str, context: str) -> str:
+    # Identical questions with identical LLM context share one completion; the context includes the
+    # user's conversation, so an answer built from one user's history is never handed to another
+    return hashlib.sha1(f"{' '.join(normalized.split())}\n{context}".encode("utf-8")).hexdigest()
+
+
+def inflight(key: str) -> Optional[asyncio.Future]:
+    return _inflight.get(key)  # The future of a call already running in this worker, if any
+
+
+async def join(key: str) -> Optional[str]:
+    """
+    Wait for the call already running for 'key' in this worker and return its result; None if there is none.
+    A leader that gets cancelled (e.g. its client disconnected) does not count: its waiters may lead instead.
+    """
+    while True:
+        future = _inflight.get(key)
+        if future is None:
+            return None
+        try:
+            return await asyncio.shield(future)  # Wait on the leader without cancelling it if we are cancelled
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise  # We were cancelled ourselves
+
+
+def lead(key: str) -> asyncio.Future:
+    # Register the caller as the leader for 'key' in this worker (join() found none); later callers wait
+    # on the returned future, which the leader must settle with finish()
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())  # Avoid "exception never retrieved" warnings
+    _inflight[key] = future
+    return future
+
+
+def finish(key: str, future: asyncio.Future, result: Optional[str] = None, error: Optional[BaseException] = None):
+    # Hand the leader's result (or failure) to its waiters and let the next call for 'key' lead again
+    if _inflight.get(key) is future:
+        del _inflight[key]
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    elif isinstance(error, Exception):
+        future.set_exception(error)  # Waiters fail the same way the leader did
+    else:
+        future.cancel()  # Cancelled or closed: waiters try again, possibly as the new leader
+
+
+async def _wait_for_result(key: str) -> Optional[str]:
+    # Poll for another worker's answer while its lock is alive; None if the lock holder went away
+    lock_key, result_key = f"llm_lock:{key}", f"llm_result:{key}"
+    while True:
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.get(result_key)
+            pipe.exists(lock_key)
+            result, locked = await pipe.execute()
+        if result is not None:
+            return result
+        if not locked:
+            return None
+        await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+
+
+async def _run_across_workers(key: str, produce: Callable[[], Awaitable[str]]) -> str:
+    lock_key, result_key = f"llm_lock:{key}", f"llm_result:{key}"
+    token = uuid.uuid4().hex  # Identifies this worker as the lock holder
+
+    # 1️⃣ Another worker already answered or is answering: wait for its result
+    while not await r.set(lock_key, token, nx=True, ex=SINGLEFLIGHT_LOCK_TTL):
+        result = await _wait_for_result(key)
+        if result is not None:
+            return result
+        # The holder released the lock without an answer (failure or timeout): try to take over
+
+    # 2️⃣ We hold the lock: run the completion and publish it for the waiting workers
+    try:
+        result = await produce()
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.setex(result_key, SINGLEFLIGHT_RESULT_TTL, result)  # Short-lived hand-off to waiters
+            pipe.delete(lock_key)  # Waiters see the result before (or together with) the lock going away
+            await pipe.execute()
+        return result
+    except BaseException:
+        # Let waiters take over right away instead of waiting for the lock to expire
+        if await r.get(lock_key) == token:
+            await r.delete(lock_key)
+        raise
+
+
+async def coalesce(key: str, produce: Callable[[], Awaitable[str]]) -> str:
+    """
+    Run produce() once for all concurrent callers with the same key and return its result to each of them.
+    """
+    result = await join(key)
+    if result is not None:
+        return result
+
+    # This caller is the leader for the key in this worker
+    future = lead(key)
+    try:
+        result = await _run_across_workers(key, produce)
+    except BaseException as e:
+        finish(key, future, error=e)
+        raise
+    finish(key, future, result)
+    return result
@@ -0,0 +1,176 @@
+# File: app/services/summary_service.py
+# Summary:
+# This service module builds the conversation part of the LLM context within a token budget.
+# The most recent turns are kept verbatim, newest first, for as long as they fit; older turns
+# are folded into a per-user rolling summary. The summary is stored in the 'chat_summaries'
+# collection together with the creation time of the last turn it covers, cached in Redis
+# ('chat_summary:{user_id}') and in the L1 cache, and updated incrementally: once enough turns
+# have fallen out of the verbatim window (by the token budget, or by the turn window sliding
+# past turns the summary does not cover yet), a background task asks the LLM to fold just those
+# turns into the previous summary. Requests never wait for a summary update, and only one
+# worker updates a given user's summary at a time.
+
+import asyncio  # Import asyncio to run summary updates in the background
+import json  # Import json to cache summaries in Redis
+import logging  # Import logging to report failed summary updates
+import uuid  # Import uuid to tag lock ownership
+from datetime import datetime, timezone  # Import datetime utilities for summary timestamps
+from typing import List, Optional, Set, Tuple  # Import typing helpers for annotations
+from app.redis_client import r  # Import the Redis client instance
+from app.db import summaries_collection  # Import the rolling summary collection
+from app.llm import get_llm  # Import accessor for the shared Bangla language model
+from app.retrieval import estimate_tokens  # Import the token estimate used for budgets
+from app.services.history_service import recent_messages, fetch_messages  # Import chat history readers
+from app.services.local_cache import local_cache, publish_invalidation  # Import the in-process L1 cache and its invalidation broadcast
+from app.services.metrics import timed  # Import the stage timer
+from app.utils import normalize_datetime  # Import utility to normalize datetime fields
+from app.config import (  # Import context budget and summary settings
+    REDIS_TTL,
+    LLM_TIMEOUT,
+    HISTORY_CONTEXT_TURNS,
+    HISTORY_CONTEXT_TOKENS,
+    SUMMARY_MAX_TOKENS,
+    SUMMARY_FOLD_TURNS,
+    SUMMARY_FOLD_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+# Users whose summary this worker is updating, and the running update tasks
+_updating: Set[str] = set()
+_tasks: Set[asyncio.Task] = set()
+
+
+def summary_key(user_id: str) -> str:
+    return f"chat_summary:{user_id}"  # Cached {summary, covered_until} of the user
+
+
+def format_turn(turn: dict) -> str:
+    return f"User: {turn['message']} | Reply: {turn['reply']}"  # One line per turn in the LLM context
+
+
+async def load_summary(user_id: str) -> Tuple[str, Optional[datetime]]:
+    # The user's rolling summary and the creation time of the last turn it covers ("" and None if none yet)
+    key = summary_key(user_id)
+    cached = local_cache.get(key)
+    if cached is None:
+        version = local_cache.version(key)
+        raw = await r.get(key)
+        if raw is None:
+            doc = await summaries_collection.find_one({"_id": user_id}) or {}
+            cached = (doc.get("summary", ""), doc.get("covered_until"))
+            # Users without a summary are cached too, so their requests do not hit MongoDB
+            # (nx: never overwrite a summary an update stored while we were reading)
+            await r.set(key, json.dumps({"summary": cached[0], "covered_until": cached[1]}, default=str), ex=REDIS_TTL, nx=True)
+        else:
+            data = json.loads(raw)
+            cached = (data["summary"], data["covered_until"])
+        summary, covered_until = cached
+        cached = (summary, normalize_datetime(covered_until) if covered_until else None)
+        local_cache.set(key, cached, version=version)
+    return cached
+
+
+def _fit_turns(turns: List[dict], covered_until: Optional[datetime], budget: int) -> Tuple[List[dict], List[dict]]:
+    # Split turns not yet in the summary into those kept verbatim (newest that fit) and those left out
+    unsummarized = [t for t in turns if covered_until is None or t["created_at"] > covered_until]
+    kept, used = [], 0
+    for turn in reversed(unsummarized):  # Newest first
+        cost = estimate_tokens(format_turn(turn)) + 1  # +1 for the line break
+        if used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    kept.reverse()  # Oldest first, as the conversation happened
+    return kept, unsummarized[:len(unsummarized) - len(kept)]
+
+
+async def conversation_context(user_id: str, turns: Optional[List[dict]] = None) -> Tuple[str, str]:
+    """
+    Return the user's rolling summary and their most recent turns (one per line) that fit in the
+    history token budget, and schedule a summary update when enough turns have fallen out of it.
+    Callers already holding the user's latest turns (oldest first) pass them as 'turns'.
+    """
+    if turns is None:
+        turns, (summary, covered_until) = await asyncio.gather(
+            recent_messages(user_id, HISTORY_CONTEXT_TURNS),
+            load_summary(user_id),
+        )
+    else:
+        turns = turns[-HISTORY_CONTEXT_TURNS:]
+        summary, covered_until = await load_summary(user_id)
+    kept, left_out = _fit_turns(turns, covered_until, max(0, HISTORY_CONTEXT_TOKENS - estimate_tokens(summary)))
+
+    # Fold turns that no longer fit, in batches
+    if len(left_out) >= SUMMARY_FOLD_TURNS:
+        schedule_summary_update(user_id, kept[0]["created_at"] if kept else None)
+    # A full window starting after the end of the summary: older turns have dropped out of the context
+    # without being summarized. Fold them together with the oldest turns of the window, so the next
+    # fold is only due once SUMMARY_FOLD_TURNS more turns have arrived (not after every turn)
+    elif len(turns) >= HISTORY_CONTEXT_TURNS and (covered_until is None or turns[0]["created_at"] > covered_until):
+        unsummarized = left_out + kept  # Every turn of the window
+        cutoff = min(max(len(left_out), SUMMARY_FOLD_TURNS), len(unsummarized) - 1)  # The newest turn always stays verbatim
+        schedule_summary_update(user_id, unsummarized[cutoff]["created_at"])
+
+    return summary, "\n".join(format_turn(t) for t in kept)
+
+
+async def update_summary(user_id: str, cutoff: Optional[datetime]):
+    """
+    Fold the user's turns between the end of the current summary and 'cutoff' (exclusive; None for
+    all turns) into the summary, using at most SUMMARY_FOLD_MAX of the newest such turns.
+    """
+    lock_key, token = f"summary_lock:{user_id}", uuid.uuid4().hex
+    if not await r.set(lock_key, token, nx=True, ex=int(LLM_TIMEOUT) + 5):
+        return  # Another worker is updating this user's summary
+    try:
+        doc = await summaries_collection.find_one({"_id": user_id}) or {}
+        summary, covered_until = doc.get("summary", ""), doc.get("covered_until")
+        covered_until = normalize_datetime(covered_until) if covered_until else None
+
+        turns, _ = await fetch_messages(user_id, cutoff, SUMMARY_FOLD_MAX)
+        turns = [t for t in turns if covered_until is None or t["created_at"] > covered_until]
+        if not turns:
+            return
+
+        with timed("summary_update"):
+            summary = await get_llm().summarize(summary, "\n".join(format_turn(t) for t in turns), SUMMARY_MAX_TOKENS)
+        covered_until = turns[-1]["created_at"]
+        await summaries_collection.update_one(
+            {"_id": user_id},
+            {"$set": {"summary": summary, "covered_until": covered_until, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.setex(summary_key(user_id), REDIS_TTL, json.dumps({"summary": summary, "covered_until": covered_until}, default=str))
+            publish_invalidation(pipe, summary_key(user_id))  # Every worker drops its L1 copy
+            await pipe.execute()
+    finally:
+        if await r.get(lock_key) == token:
+            await r.delete(lock_key)  # Only release our own lock
+
+
+def schedule_summary_update(user_id: str, cutoff: Optional[datetime]):
+    # Start a background summary update for the user unless this worker is already running one
+    if user_id in _updating:
+        return
+    _updating.add(user_id)
+
+    async def _run():
+        try:
+            await update_summary(user_id, cutoff)
+        except Exception as e:
+            logger.warning("summary update failed for %s: %s", user_id, e)  # Retried when more turns fall out
+        finally:
+            _updating.discard(user_id)
+
+    task = asyncio.create_task(_run())
+    _tasks.add(task)  # Keep a reference until the task finishes
+    task.add_done_callback(_tasks.discard)
+
+
+async def stop_summary_updates():
+    # Cancel running summary updates (on shutdown); unfinished ones are redone on later requests
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
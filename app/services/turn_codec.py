@@ -0,0 +1,78 @@
+# File: app/services/turn_codec.py
+# Summary:
+# This module holds the compact cache format of chat turns and the fast JSON rendering of
+# history pages. A cached turn is an orjson array [message, reply, sentiment, source,
+# created_at] with the timestamp as integer epoch milliseconds (MongoDB's own precision),
+# so decoding needs no ISO date parsing. Turns whose encoding exceeds CACHE_COMPRESS_MIN_BYTES
+# (long LLM replies) are stored zlib-compressed behind a one-byte marker. Entries written in
+# the previous format (JSON objects with ISO timestamps) are still decoded, so lists cached
+# before an upgrade stay readable until they expire.
+
+import zlib  # Import zlib to compress large cached turns
+from datetime import datetime, timedelta, timezone  # Import datetime utilities for epoch-millisecond timestamps
+from typing import List, Optional, Union  # Import typing helpers for annotations
+import orjson  # Import orjson for fast JSON encoding and decoding
+from app.utils import normalize_datetime  # Import utility to normalize datetime fields of old-format entries
+from app.config import CACHE_COMPRESS_MIN_BYTES, CACHE_COMPRESS_LEVEL  # Import compression settings
+
+# Fields of a cached turn, in array order
+TURN_FIELDS = ("message", "reply", "sentiment", "source", "created_at")
+
+# First byte of a compressed entry; plain entries start with '[' (or '{' in the old format)
+COMPRESSED = b"z"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_millis(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(milliseconds=1)  # Exact integer arithmetic, no float rounding
+
+
+def from_millis(ms: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=ms)  # UTC-aware datetime
+
+
+def encode_turn(turn: dict) -> bytes:
+    # Serialize one turn (with a datetime 'created_at') for the Redis history list
+    created_at = turn.get("created_at")
+    payload = orjson.dumps([
+        turn.get("message"),
+        turn.get("reply"),
+        turn.get("sentiment"),
+        turn.get("source"),
+        to_millis(created_at) if created_at is not None else None,
+    ])
+    if CACHE_COMPRESS_MIN_BYTES and len(payload) > CACHE_COMPRESS_MIN_BYTES:
+        return COMPRESSED + zlib.compress(payload, CACHE_COMPRESS_LEVEL)
+    return payload
+
+
+def decode_turn(raw: Union[bytes, str]) -> dict:
+    # Deserialize one cached turn into a dict of TURN_FIELDS with a UTC-aware 'created_at'
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if raw[:1] == COMPRESSED:
+        raw = zlib.decompress(raw[1:])
+    data = orjson.loads(raw)
+    if isinstance(data, dict):  # Old format: JSON object with an ISO timestamp
+        turn = {field: data.get(field) for field in TURN_FIELDS}
+        turn["created_at"] = normalize_datetime(turn["created_at"])
+        return turn
+    message, reply, sentiment, source, created_at = data
+    return {
+        "message": message,
+        "reply": reply,
+        "sentiment": sentiment,
+        "source": source,
+        "created_at": from_millis(created_at) if created_at is not None else None,
+    }
+
+
+def render_history(user_id: str, messages: List[dict], next_cursor: Optional[datetime], source: str) -> bytes:
+    # JSON body of a history page, identical to what FastAPI would produce from ChatHistoryResponse.
+    # The turns come from our own cache or from MongoDB documents we wrote and already normalized,
+    # so they are not validated again.
+    return orjson.dumps(
+        {"user_id": user_id, "messages": messages, "next_cursor": next_cursor, "source": source},
+        option=orjson.OPT_UTC_Z,  # '...Z' for UTC, like Pydantic
+    )
@@ -0,0 +1,238 @@
+# File: app/services/write_behind.py
+# Summary:
+# This service module moves chat-turn persistence off the request path (write-behind).
+# Replies enqueue their turn into a bounded in-process queue and return immediately;
+# a background task drains the queue and inserts turns into 'chat_messages' with
+# bulk_write, flushing whenever a batch is full or a short interval has passed.
+# When the queue is full, producers wait (backpressure) and, past a timeout, write
+# their turn directly. Turns that are queued but not yet written are kept per user
+# so this worker's history reads still see them, and a per-user Redis counter tells
+# other workers not to rebuild a user's cached history while writes are pending. Its expiry
+# is pushed back while a batch is retried, and a Lua script releases it so a counter that
+# expired anyway is never recreated negative.
+# Transient MongoDB errors are retried a bounded number of times; turns MongoDB rejects,
+# or that still fail after the last retry, are logged and dropped so the writer never stalls.
+# The queue is flushed when the application shuts down, for at most WRITE_BEHIND_STOP_TIMEOUT
+# seconds; turns still unwritten then are logged as lost.
+
+import asyncio  # Import asyncio for the queue, background task and timeouts
+import logging  # Import logging to report failed batches
+from collections import defaultdict  # Import defaultdict to group pending turns by user
+from typing import Dict, List  # Import typing helpers for annotations
+from pymongo import InsertOne  # Import InsertOne to build bulk write requests
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError  # Import MongoDB errors to tell partial, transient and permanent failures apart
+from app.redis_client import r  # Import the Redis client instance
+from app.db import messages_collection  # Import the per-message MongoDB collection
+from app.services.metrics import timed, TURNS_DROPPED  # Import the stage timer and the dropped-turn counter
+from app.config import (  # Import write-behind settings
+    WRITE_BEHIND_QUEUE_SIZE,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_PUT_TIMEOUT,
+    WRITE_BEHIND_MAX_RETRIES,
+    WRITE_BEHIND_STOP_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lifetime (seconds) of a user's pending-turn counter, so a crashed worker cannot block history rebuilds for long
+PENDING_TTL = 60
+
+# Decrement a pending-turn counter: ARGV = number of written turns. A counter that already expired stays absent
+# (DECRBY would recreate it as a negative number without a TTL) and one that reaches zero is deleted; the TTL is kept
+RELEASE_PENDING = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local left = redis.call('DECRBY', KEYS[1], ARGV[1])
+if left <= 0 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return left
+"""
+
+_release_pending = r.register_script(RELEASE_PENDING)
+
+# MongoDB error code for duplicate keys: a retried batch may contain turns that were already inserted
+DUPLICATE_KEY = 11000
+
+
+def pending_key(user_id: str) -> str:
+    return f"chat_pending:{user_id}"  # Number of this user's turns queued but not yet in MongoDB, across workers
+
+
+def _retryable(error: Exception) -> bool:
+    # Connection problems and errors MongoDB labels as retryable may succeed later; anything else fails the same way again
+    if isinstance(error, (ConnectionFailure, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+
+class TurnWriter:
+    """
+    Bounded write-behind queue persisting chat turns to MongoDB in batches.
+    """
+
+    def __init__(self, collection, max_queue: int, batch_size: int, flush_interval: float):
+        self.collection = collection  # Target MongoDB collection
+        self.queue = asyncio.Queue(maxsize=max_queue)  # Turns waiting to be written
+        self.batch_size = batch_size  # Maximum turns per bulk_write
+        self.flush_interval = flush_interval  # Maximum time a turn waits for its batch to fill
+        self.pending: Dict[str, List[dict]] = defaultdict(list)  # user_id -> turns not yet written
+        self._task = None  # Background drain task, set by start()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def pending_for(self, user_id: str) -> List[dict]:
+        return list(self.pending.get(user_id, ()))  # Snapshot of this user's unwritten turns, oldest first
+
+    async def submit(self, doc: dict) -> bool:
+        """
+        Queue a turn document for writing. Returns True if it was queued, False if it was written directly.
+        """
+        if self._task is None:
+            await self.collection.insert_one(doc)  # Writer not running (e.g. scripts): write through
+            return False
+        self.pending[doc["user_id"]].append(doc)  # Visible to this worker's reads right away
+        try:
+            # Backpressure: wait for room in the queue, but not forever
+            await asyncio.wait_for(self.queue.put(doc), timeout=WRITE_BEHIND_PUT_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            self._forget([doc])
+            await self.collection.insert_one(doc)  # Queue still full: persist this turn on the request path
+            return False
+
+    def _forget(self, docs: List[dict]):
+        # Remove written turns from the pending view
+        for doc in docs:
+            turns = self.pending.get(doc["user_id"])
+            if turns is None:
+                continue
+            try:
+                turns.remove(doc)
+            except ValueError:
+                pass
+            if not turns:
+                del self.pending[doc["user_id"]]
+
+    async def _next_batch(self) -> List[dict]:
+        # Wait for the first turn, then collect more until the batch is full or the flush interval passes
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _drop(self, docs: List[dict], reason: str, error):
+        # Give up on turns that cannot be stored; they stay in the Redis history until it expires
+        TURNS_DROPPED.labels(reason).inc(len(docs))
+        logger.error(
+            "dropped %d chat turns (%s) of users %s: %s",
+            len(docs), reason, sorted({doc["user_id"] for doc in docs}), error
+        )
+
+    async def _write(self, batch: List[dict]):
+        # Insert a batch, retrying transient failures at most WRITE_BEHIND_MAX_RETRIES times; duplicates from
+        # earlier partial attempts count as stored, and turns MongoDB rejects are dropped instead of retried
+        docs, backoff = batch, 0.1
+        for attempt in range(WRITE_BEHIND_MAX_RETRIES + 1):
+            try:
+                with timed("mongo_bulk_write"):
+                    await self.collection.bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+                break
+            except BulkWriteError as e:
+                # Unordered batch: every turn without a write error is stored
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+                if errors:
+                    rejected = {err["index"] for err in errors}  # Positions in 'docs' of turns MongoDB refused
+                    self._drop([docs[i] for i in sorted(rejected)], "rejected", errors[0].get("errmsg"))
+                    docs = [doc for i, doc in enumerate(docs) if i not in rejected]  # Never retry them
+                if not e.details.get("writeConcernErrors") or not docs:
+                    break  # Every other turn is stored; some already were
+                error = e.details["writeConcernErrors"]  # Stored but not acknowledged as durable: write again
+            except Exception as e:
+                if not _retryable(e):
+                    self._drop(docs, "rejected", e)
+                    break
+                error = e
+            if attempt == WRITE_BEHIND_MAX_RETRIES:
+                self._drop(docs, "retries_exhausted", error)
+                break
+            logger.warning("chat turn batch failed, retrying: %s", error)
+            await self._keep_pending(docs)  # Retries may outlast PENDING_TTL
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 5)
+
+        self._forget(batch)
+
+        # Let other workers rebuild these users' cached history again
+        counts = defaultdict(int)
+        for doc in batch:
+            counts[doc["user_id"]] += 1
+        try:
+            async with r.pipeline(transaction=False) as pipe:
+                for user_id, count in counts.items():
+                    await _release_pending(keys=[pending_key(user_id)], args=[count], client=pipe)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("could not clear pending counters: %s", e)  # They expire on their own
+
+    async def _keep_pending(self, docs: List[dict]):
+        # Push back the expiry of the pending counters of turns still being retried, so other workers keep
+        # waiting for them; EXPIRE leaves counters that no longer exist alone
+        try:
+            async with r.pipeline(transaction=False) as pipe:
+                for user_id in {doc["user_id"] for doc in docs}:
+                    pipe.expire(pending_key(user_id), PENDING_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("could not refresh pending counters: %s", e)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def stop(self, timeout: float = WRITE_BEHIND_STOP_TIMEOUT):
+        """
+        Flush every queued turn to MongoDB, waiting at most 'timeout' seconds, and stop the background task.
+        Turns still unwritten after the timeout are logged and counted as lost.
+        """
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)  # Wait until every queued turn has been written
+        except asyncio.TimeoutError:
+            lost = [doc for docs in self.pending.values() for doc in docs]
+            self._drop(lost, "shutdown", f"not written within {timeout}s of shutdown")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def mark_pending(pipe, user_id: str):
+    # Queue the commands announcing one more unwritten turn for the user on a Redis pipeline
+    pipe.incr(pending_key(user_id))
+    pipe.expire(pending_key(user_id), PENDING_TTL)  # Never outlive a crashed worker for long
+
+
+# Write-behind queue of this worker
+turn_writer = TurnWriter(messages_collection, WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_FLUSH_INTERVAL)
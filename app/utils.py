@@ -3,55 +3,108 @@ File: utils.py
 Directory: app/utils.py
 Description: 
 This file contains utility functions for text processing and analysis. 
-It includes text normalization, intent detection using FAQ JSON data, 
+It includes text normalization, intent detection using a compiled keyword index over FAQ JSON data, 
 sentiment analysis with NLTK, and datetime normalization.
+Nothing expensive happens at import time: the FAQ index and the NLTK analyzer are built on
+first use (normally from the application lifespan), and the FAQ index can be rebuilt and
+swapped in atomically while requests are being served.
 """
 
 # Import regular expression module for text processing
 import re
 # Import JSON module to load FAQ data
 import json
+# Import unicodedata to keep combining marks (e.g. Bangla vowel signs) and compose text consistently
+import unicodedata
+# Import lru_cache to build the sentiment analyzer once, on first use
+from functools import lru_cache
 # Import sentiment analyzer from NLTK
 from nltk.sentiment import SentimentIntensityAnalyzer
 # Import datetime and timezone utilities
 from datetime import datetime, timezone
+# Import the compiled keyword index used for intent detection
+from app.intent_index import KeywordIndex
+# Import the BM25 retriever used to pick FAQ context for the LLM
+from app.retrieval import FaqRetriever
+# Import the FAQ file location from the application's config
+from app.config import FAQ_PATH
 
-# Load FAQ data from JSON file located at app/faq_data.json with UTF-8-sig encoding
-with open("app/faq_data.json", encoding="utf-8-sig") as f:
-    FAQ_DATA = json.load(f)
 
-# Initialize NLTK's sentiment intensity analyzer
-sia = SentimentIntensityAnalyzer()
+# Function to keep a non-word character only if it is a combining mark
+def _keep_marks(match) -> str:
+    # Bangla vowel signs, hasanta and nukta are not \w; dropping them would turn "বুকিং" and "বেকিং" into the same word
+    return match.group() if unicodedata.category(match.group()).startswith("M") else ""
 
 
 # Function to normalize text: lowercase and remove non-alphanumeric characters
 def normalize_text(text: str) -> str:
+    # Compose characters the same way whatever the keyboard produced (e.g. "ড়" as one or two code points)
+    text = unicodedata.normalize("NFC", text)
     # Convert text to lowercase
     text = text.lower()
-    # Remove all characters except word characters and whitespace
-    text = re.sub(r"[^\w\s]", "", text)
+    # Remove all characters except word characters, combining marks and whitespace
+    text = re.sub(r"[^\w\s]", _keep_marks, text)
     # Return the normalized text
     return text
 
 
-# Function to detect intent from input text using keywords in FAQ data
+class FaqIndex:
+    """
+    FAQ records precompiled into their lookup structures. Instances are never modified;
+    a reload builds a new one and swaps it in.
+    """
+
+    def __init__(self, records: list):
+        self.records = records  # FAQ records, in file order
+        self.intents = KeywordIndex(records, normalize_text)  # All keywords compiled into one automaton
+        self.retriever = FaqRetriever(records, normalize_text)  # BM25 index used to pick FAQ context for LLM prompts
+
+
+# Function to load the FAQ JSON file and compile it (slow: call it off the event loop)
+def load_faq_index(path: str = FAQ_PATH) -> FaqIndex:
+    # Load FAQ data from the JSON file with UTF-8-sig encoding
+    with open(path, encoding="utf-8-sig") as f:
+        records = json.load(f)
+    # Fail before swapping anything in if the file is not a list of usable records
+    if not isinstance(records, list) or not all(isinstance(rec, dict) and "answer_bn" in rec and "topic" in rec for rec in records):
+        raise ValueError(f"{path} must be a list of FAQ records with 'topic' and 'answer_bn'")
+    return FaqIndex(records)
+
+
+# The FAQ index currently in use (replaced as a whole on reload)
+_faq_index = None
+
+
+# Function to get the current FAQ index, loading it on first use
+def get_faq_index() -> FaqIndex:
+    global _faq_index
+    if _faq_index is None:
+        _faq_index = load_faq_index()
+    return _faq_index
+
+
+# Function to swap in a new FAQ index; a single assignment, so readers see either the old or the new one
+def set_faq_index(index: FaqIndex):
+    global _faq_index
+    _faq_index = index
+
+
+# Function to detect intent from normalized input text using keywords in FAQ data
 def detect_intent(text: str):
-    # Iterate over each FAQ record
-    for record in FAQ_DATA:
-        # Iterate over each keyword in the record
-        for kw in record["keywords"]:
-            # If the keyword exists in input text (case-insensitive)
-            if kw.lower() in text:
-                # Return the matching record
-                return record
-    # Return None if no intent matched
-    return None
+    # Return the first FAQ record (in file order) with a keyword in the text, or None if no intent matched
+    return get_faq_index().intents.match(text)
+
+
+# Function to get NLTK's sentiment intensity analyzer, initialized on first use
+@lru_cache(maxsize=1)
+def get_sentiment_analyzer() -> SentimentIntensityAnalyzer:
+    return SentimentIntensityAnalyzer()
 
 
 # Function to analyze sentiment of input text
 def sentiment_analysis(text: str) -> str:
     # Get polarity scores from sentiment intensity analyzer
-    score = sia.polarity_scores(text)
+    score = get_sentiment_analyzer().polarity_scores(text)
     # Determine sentiment based on compound score
     if score["compound"] >= 0.05:
         return "positive"  # Positive sentiment
@@ -0,0 +1,91 @@
+"""
+File: batch_chat.py
+Directory: root (or your project directory)
+Description:
+This script sends many chat messages to a running chatbot through the /chat/batch endpoint, for partner
+imports and offline QA runs. It reads JSON lines with 'user_id' and 'message', posts them in batches and
+writes one JSON line per message with the input fields plus 'reply', 'source' and 'sentiment', in input order.
+The endpoint is an admin endpoint: the token is sent in the X-Admin-Token header (default: $ADMIN_TOKEN).
+
+Usage:
+    python batch_chat.py [--url http://127.0.0.1:8000] [--token TOKEN] [--input questions.jsonl] [--output replies.jsonl] [--batch-size 500]
+"""
+
+# Import argparse to read options from the command line
+import argparse
+
+# Import json to read and write JSON lines
+import json
+
+# Import os to read the admin token from the environment
+import os
+
+# Import sys to use standard input/output and report progress on standard error
+import sys
+
+# Import time to report throughput
+import time
+
+# Import httpx to call the chatbot API
+import httpx
+
+
+# Define a function to parse the command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Answer chat messages in bulk through /chat/batch")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the chatbot API")
+    parser.add_argument("--token", default=os.getenv("ADMIN_TOKEN"), help="admin token of the API (default: $ADMIN_TOKEN)")
+    parser.add_argument("--input", help="JSON lines with user_id and message (default: standard input)")
+    parser.add_argument("--output", help="JSON lines with the replies (default: standard output)")
+    parser.add_argument("--batch-size", type=int, default=500, help="messages per request (at most the server's BATCH_MAX_SIZE)")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for one batch")
+    return parser.parse_args()
+
+
+# Define a function reading the input messages in batches
+def read_batches(lines, batch_size: int):
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue  # Skip blank lines
+        item = json.loads(line)
+        batch.append({"user_id": str(item["user_id"]), "message": item["message"]})
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Define a function sending every batch and writing the replies in input order
+def run(args, lines, out):
+    # Start the throughput timer
+    start = time.perf_counter()
+    total = 0
+
+    with httpx.Client(base_url=args.url, timeout=args.timeout, headers={"X-Admin-Token": args.token or ""}) as client:
+        for batch in read_batches(lines, args.batch_size):
+            # Send the batch and fail loudly on an HTTP error
+            response = client.post("/chat/batch", json={"messages": batch})
+            response.raise_for_status()
+
+            # Write one line per message: the input and its reply
+            for item, reply in zip(batch, response.json()["replies"]):
+                out.write(json.dumps({**item, **reply}, ensure_ascii=False) + "\n")
+            total += len(batch)
+
+            # Print the progress and throughput to standard error
+            elapsed = time.perf_counter() - start
+            print(f"⏳ {total} messages answered ({total / elapsed:.0f} messages/s)", file=sys.stderr)
+
+    # Print a summary to standard error
+    elapsed = time.perf_counter() - start
+    print(f"✅ {total} messages answered in {elapsed:.1f}s", file=sys.stderr)
+
+
+# Run the batch client if this script is executed directly
+if __name__ == "__main__":
+    args = parse_args()
+    with (open(args.input, encoding="utf-8") if args.input else sys.stdin) as lines, \
+            (open(args.output, "w", encoding="utf-8") if args.output else sys.stdout) as out:
+        run(args, lines, out)
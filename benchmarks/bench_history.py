@@ -0,0 +1,124 @@
+"""
+File: bench_history.py
+Directory: benchmarks/bench_history.py
+Description:
+Micro-benchmark for chat history serialization. For histories of 10, 1,000 and 10,000
+turns it compares the original cache format (json.dumps with ISO date strings, parsed back
+with normalize_datetime and validated again through ChatHistoryResponse by FastAPI) against
+the compact format of app.services.turn_codec (orjson arrays with epoch-millisecond
+timestamps, zlib for large entries) and its direct rendering of the response body.
+The Redis list and a history page hold at most HISTORY_MAX_PAGE_SIZE + 1 turns; the larger
+sizes show how each path scales.
+
+Usage:
+    python -m benchmarks.bench_history [--repeat 5] [--long-replies 0.2] [--seed 7]
+"""
+
+import argparse  # Import argparse to read benchmark options from the command line
+import asyncio  # Import asyncio to run FastAPI's response serialization
+import json  # Import json to reproduce the original cache format
+import random  # Import random to generate synthetic turns
+import time  # Import time for high-resolution timers
+from datetime import datetime, timedelta, timezone  # Import datetime utilities for turn timestamps
+
+from fastapi.responses import JSONResponse  # Import JSONResponse, which rendered the original responses
+from fastapi.routing import serialize_response  # Import FastAPI's response_model validation and serialization
+from fastapi.utils import create_response_field  # Import the helper FastAPI uses to build a response_model field
+
+from app.models import ChatHistoryResponse  # Import the response model of the history endpoint
+from app.services.turn_codec import encode_turn, decode_turn, render_history  # Import the compact format under test
+from app.utils import normalize_datetime  # Import the datetime parsing of the original format
+
+# History sizes (turns) to benchmark
+HISTORY_SIZES = [10, 1_000, 10_000]
+
+# Bangla words used to build messages and replies
+WORDS = ["রান্না", "ডাল", "ভাত", "মসলা", "পেঁয়াজ", "তেল", "লবণ", "মিনিট", "চুলা", "কিভাবে", "অর্ডার", "ডেলিভারি"]
+
+
+# Build a chat history; a share of turns get long LLM-sized replies
+def make_turns(rng: random.Random, count: int, long_replies: float):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    turns = []
+    for i in range(count):
+        reply_words = rng.randint(150, 400) if rng.random() < long_replies else rng.randint(8, 30)
+        turns.append({
+            "message": " ".join(rng.choices(WORDS, k=rng.randint(4, 12))),
+            "reply": " ".join(rng.choices(WORDS, k=reply_words)),
+            "sentiment": rng.choice(["positive", "neutral", "negative"]),
+            "source": rng.choice(["redis-cache", "json", "llm"]),
+            "created_at": start + timedelta(milliseconds=i * 61_337),
+        })
+    return turns
+
+
+# Original format: one JSON object per turn with ISO date strings
+def old_encode(turn: dict) -> str:
+    return json.dumps(turn, default=str)
+
+
+def old_decode(raw: str) -> dict:
+    turn = json.loads(raw)
+    turn["created_at"] = normalize_datetime(turn.get("created_at"))
+    return turn
+
+
+# Original response path: build the model, then let FastAPI validate and serialize it
+RESPONSE_FIELD = create_response_field("Response_get_chat_history", ChatHistoryResponse, mode="serialization")
+
+
+async def old_render(turns) -> bytes:
+    model = ChatHistoryResponse(user_id="u", messages=turns, next_cursor=None, source="redis")
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=model)
+    return JSONResponse(content).body
+
+
+# Best time in milliseconds of running 'fn' over 'repeat' attempts
+def best_ms(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat history serialization")
+    parser.add_argument("--repeat", type=int, default=5, help="attempts per measurement (best is reported)")
+    parser.add_argument("--long-replies", type=float, default=0.2, help="share of turns with long LLM-sized replies")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    loop = asyncio.new_event_loop()
+    print(f"{'turns':>6} {'format':>7} {'KiB':>9} {'encode ms':>10} {'decode ms':>10} {'render ms':>10} {'read ms':>9}")
+    for count in HISTORY_SIZES:
+        turns = make_turns(rng, count, args.long_replies)
+        old_raw = [old_encode(t) for t in turns]
+        new_raw = [encode_turn(t) for t in turns]
+
+        # Both formats must decode to the same turns and render the same body before their timings mean anything
+        new_turns = [decode_turn(raw) for raw in new_raw]
+        assert new_turns == [old_decode(raw) for raw in old_raw]
+        assert json.loads(render_history("u", new_turns, None, "redis")) == json.loads(loop.run_until_complete(old_render(new_turns)))
+
+        rows = [
+            ("json", sum(len(raw.encode()) for raw in old_raw),
+             lambda: [old_encode(t) for t in turns],
+             lambda: [old_decode(raw) for raw in old_raw],
+             lambda: loop.run_until_complete(old_render(turns))),
+            ("orjson", sum(len(raw) for raw in new_raw),
+             lambda: [encode_turn(t) for t in turns],
+             lambda: [decode_turn(raw) for raw in new_raw],
+             lambda: render_history("u", turns, None, "redis")),
+        ]
+        for name, size, encode, decode, render in rows:
+            encode_ms, decode_ms, render_ms = (best_ms(fn, args.repeat) for fn in (encode, decode, render))
+            # A cache read (what the endpoint pays per request) is decode + render
+            print(f"{count:>6} {name:>7} {size / 1024:>9.1f} {encode_ms:>10.2f} {decode_ms:>10.2f} {render_ms:>10.2f} {decode_ms + render_ms:>9.2f}")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
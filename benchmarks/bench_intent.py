@@ -0,0 +1,101 @@
+"""
+File: bench_intent.py
+Directory: benchmarks/bench_intent.py
+Description:
+Micro-benchmark for FAQ intent detection. It builds synthetic FAQs with 100 to 50,000
+keywords and compares the original nested linear scan against the compiled
+Aho-Corasick KeywordIndex used by app.utils.detect_intent.
+
+Usage:
+    python -m benchmarks.bench_intent [--messages 2000] [--seed 7]
+"""
+
+import argparse  # Import argparse to read benchmark options from the command line
+import random  # Import random to generate synthetic keywords and messages
+import re  # Import re to reproduce app.utils.normalize_text without loading NLTK
+import string  # Import string for the synthetic alphabet
+import time  # Import time for high-resolution timers
+import unicodedata  # Import unicodedata to keep combining marks like app.utils.normalize_text
+
+from app.intent_index import KeywordIndex  # Import the compiled keyword index under test
+
+# FAQ sizes (total number of keywords) to benchmark
+KEYWORD_COUNTS = [100, 1_000, 10_000, 50_000]
+
+# Number of keywords per synthetic FAQ record, matching the shipped faq_data.json
+KEYWORDS_PER_RECORD = 20
+
+
+# Same normalization as app.utils.normalize_text
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).lower()
+    return re.sub(r"[^\w\s]", lambda m: m.group() if unicodedata.category(m.group()).startswith("M") else "", text)
+
+
+# Original detect_intent: nested scan over every record and every keyword
+def linear_detect(records, text):
+    for record in records:
+        for kw in record["keywords"]:
+            if kw.lower() in text:
+                return record
+    return None
+
+
+# Build a synthetic FAQ with the requested number of keywords
+def make_faq(rng: random.Random, keyword_count: int):
+    records = []
+    for i in range(0, keyword_count, KEYWORDS_PER_RECORD):
+        keywords = [
+            "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))  # Random 4-10 letter keyword
+            for _ in range(min(KEYWORDS_PER_RECORD, keyword_count - i))
+        ]
+        records.append({"id": i // KEYWORDS_PER_RECORD, "topic": f"topic{i}", "keywords": keywords})
+    return records
+
+
+# Build messages: half contain a random keyword, half are random words only
+def make_messages(rng: random.Random, records, count: int):
+    all_keywords = [kw for rec in records for kw in rec["keywords"]]
+    messages = []
+    for i in range(count):
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 7))) for _ in range(rng.randint(4, 12))]
+        if i % 2 == 0:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(all_keywords))
+        messages.append(normalize_text(" ".join(words)))
+    return messages
+
+
+# Time a detector over all messages and return microseconds per lookup
+def time_per_lookup(detect, messages) -> float:
+    start = time.perf_counter()
+    for text in messages:
+        detect(text)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAQ intent detection")
+    parser.add_argument("--messages", type=int, default=2000, help="messages per FAQ size")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'keywords':>9} {'build ms':>9} {'linear us':>10} {'index us':>9} {'speedup':>8}")
+    for keyword_count in KEYWORD_COUNTS:
+        records = make_faq(rng, keyword_count)
+        messages = make_messages(rng, records, args.messages)
+
+        start = time.perf_counter()
+        index = KeywordIndex(records, normalize_text)  # One-time compile cost paid at startup
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        # Both detectors must agree before their timings mean anything
+        assert all(index.match(m) is linear_detect(records, m) for m in messages[:200])
+
+        linear_us = time_per_lookup(lambda t: linear_detect(records, t), messages)
+        index_us = time_per_lookup(index.match, messages)
+        print(f"{keyword_count:>9} {build_ms:>9.1f} {linear_us:>10.1f} {index_us:>9.1f} {linear_us / index_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
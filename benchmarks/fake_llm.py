@@ -0,0 +1,95 @@
+"""
+File: fake_llm.py
+Directory: benchmarks/fake_llm.py
+Description:
+A fake OpenAI-compatible chat completion server for offline benchmarks. It answers
+POST /chat/completions (plain and streamed) with a synthetic Bangla answer after a
+configurable time to first token, then emits tokens at a configurable rate, so LLM
+misses cost realistic wall-clock time without any network access. A share of requests
+can be failed with HTTP 500 to exercise provider failover and the circuit breakers.
+
+Usage (normally started by benchmarks.load_test):
+    python -m benchmarks.fake_llm [--port 8765] [--latency-ms 300] [--tokens 60] [--tokens-per-sec 200] [--error-rate 0]
+"""
+
+import argparse  # Import argparse to read server options from the command line
+import asyncio  # Import asyncio to simulate generation time
+import json  # Import json to encode streamed chunks
+import random  # Import random to pick the requests that fail
+import time  # Import time for completion timestamps
+import uuid  # Import uuid for completion ids
+
+import uvicorn  # Import uvicorn to serve the fake API over local HTTP
+from starlette.applications import Starlette  # Import Starlette to build the fake API
+from starlette.requests import Request  # Import Request for typing
+from starlette.responses import JSONResponse, StreamingResponse  # Import response types for plain and streamed completions
+from starlette.routing import Route  # Import Route to register the completion endpoint
+
+# Word repeated to build answers: one token each
+ANSWER_TOKEN = "উত্তর "
+
+
+def create_app(latency_ms: float, tokens: int, tokens_per_sec: float, error_rate: float = 0.0) -> Starlette:
+    # Build the fake API with the given time to first token, answer length, generation speed and failure share
+    first_token = latency_ms / 1000
+    per_token = 1 / tokens_per_sec if tokens_per_sec > 0 else 0
+
+    async def completions(request: Request):
+        body = await request.json()
+        if random.random() < error_rate:
+            await asyncio.sleep(first_token)  # Fail after the usual wait, like an overloaded upstream
+            return JSONResponse({"error": {"message": "simulated failure", "type": "server_error"}}, status_code=500)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token + tokens * per_token)  # Whole answer generated before responding
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": ANSWER_TOKEN * tokens}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens},
+            })
+
+        async def events():
+            await asyncio.sleep(first_token)
+            for i in range(tokens + 1):
+                delta = {"content": ANSWER_TOKEN} if i < tokens else {}
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None if i < tokens else "stop"}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if i < tokens:
+                    await asyncio.sleep(per_token)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/chat/completions", completions, methods=["POST"])])
+
+
+def serve(port: int, latency_ms: float, tokens: int, tokens_per_sec: float, error_rate: float = 0.0):
+    # Run the fake API on localhost until the process is stopped
+    uvicorn.run(create_app(latency_ms, tokens, tokens_per_sec, error_rate), host="127.0.0.1", port=port, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completion server")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (127.0.0.1)")
+    parser.add_argument("--latency-ms", type=float, default=300, help="time to first token in milliseconds")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per answer")
+    parser.add_argument("--tokens-per-sec", type=float, default=200, help="generation speed after the first token (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500 (0-1)")
+    args = parser.parse_args()
+    serve(args.port, args.latency_ms, args.tokens, args.tokens_per_sec, args.error_rate)
+
+
+if __name__ == "__main__":
+    main()
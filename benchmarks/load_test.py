@@ -0,0 +1,243 @@
+"""
+File: load_test.py
+Directory: benchmarks/load_test.py
+Description:
+Offline load test of the FastAPI app in app/main.py. The app runs in-process with local
+stand-ins for its services: fakeredis for Redis, mongomock-motor for MongoDB and the fake
+OpenAI-compatible server from benchmarks/fake_llm.py (a local HTTP server with configurable
+latency and token rate) for the LLM. No network access is needed.
+
+Scenarios (each reports throughput and p50/p95/p99 latency):
+    cache-hit       repeated questions of warmed-up users (reply cache)
+    faq-hit         first-time questions containing an FAQ keyword
+    llm-miss        first-time questions with no FAQ match (goes to the LLM)
+    mixed           cache/FAQ/LLM requests interleaved according to --mix
+    history-latest  GET /chat/history for users with large histories, latest page
+    history-deep    GET /chat/history pages at random points deep in those histories
+
+The stand-ins are not as fast or as slow as the real services, so compare numbers between
+runs of this script (before and after a change), not against production.
+
+Usage:
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.load_test [--scenarios cache-hit,llm-miss] [--requests 1000] [--concurrency 50]
+"""
+
+import argparse  # Import argparse to read benchmark options from the command line
+import asyncio  # Import asyncio to drive concurrent requests
+import multiprocessing  # Import multiprocessing to run the fake LLM server in its own process
+import os  # Import os to point the app at the stand-ins before it is imported
+import random  # Import random to generate questions and pick users
+import socket  # Import socket to wait until the fake LLM server accepts connections
+import time  # Import time for high-resolution timers
+from collections import Counter  # Import Counter to tally reply sources and status codes
+from datetime import datetime, timedelta, timezone  # Import datetime utilities to seed chat histories
+
+import numpy as np  # Import NumPy to compute latency percentiles
+
+from benchmarks import fake_llm  # Import the fake OpenAI-compatible server
+
+SCENARIOS = ["cache-hit", "faq-hit", "llm-miss", "mixed", "history-latest", "history-deep"]
+
+# Filler words for generated questions; questions are checked against the FAQ index anyway
+FILLER = ["ami", "jante", "chai", "kivabe", "amar", "ekta", "proshno", "ache", "bolun", "please", "kothay", "apnader"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test of the chatbot API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--users", type=int, default=100, help="warmed-up users for cache hits")
+    parser.add_argument("--mix", default="cache=70,faq=20,llm=10", help="request mix of the mixed scenario (percent)")
+    parser.add_argument("--history-users", type=int, default=5, help="users seeded with a large history")
+    parser.add_argument("--history-size", type=int, default=10_000, help="chat turns per seeded user")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="fake LLM time to first token")
+    parser.add_argument("--llm-tokens", type=int, default=60, help="fake LLM tokens per answer")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=200, help="fake LLM generation speed (0 = instant)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake LLM requests failing with HTTP 500")
+    parser.add_argument("--llm-port", type=int, default=8765, help="local port of the fake LLM server")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    return parser.parse_args()
+
+
+def start_fake_llm(args) -> multiprocessing.Process:
+    # Run the fake LLM in a separate process, so its work does not share the app's event loop
+    process = multiprocessing.get_context("spawn").Process(
+        target=fake_llm.serve,
+        args=(args.llm_port, args.llm_latency_ms, args.llm_tokens, args.llm_tokens_per_sec, args.llm_error_rate),
+        daemon=True,
+    )
+    process.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", args.llm_port), timeout=0.5).close()
+            return process
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError(f"fake LLM server did not start on port {args.llm_port}")
+            time.sleep(0.05)
+
+
+def load_app(args):
+    # Point the app at the stand-ins, then import it. Order matters: modules bind the
+    # Redis client and MongoDB collections when they are first imported.
+    os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["FAQ_WATCH_INTERVAL"] = "0"
+    os.environ.setdefault("RATE_LIMIT_PER_SEC", "0")  # Simulated users repeat questions far faster than real ones
+
+    import fakeredis.aioredis  # Redis stand-in
+    from mongomock_motor import AsyncMongoMockClient  # MongoDB stand-in
+
+    import app.redis_client as redis_client
+    redis_client.r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    import app.db as db
+    db.client = AsyncMongoMockClient(tz_aware=True)
+    db.db = db.client.smart_cooking_db
+    db.users_collection = db.db.users
+    db.chat_collection = db.db.chat_histories
+    db.messages_collection = db.db.chat_messages
+    db.summaries_collection = db.db.chat_summaries
+
+    import app.main as main
+    from app.services import summary_service
+    from app.services.write_behind import turn_writer
+    assert turn_writer.collection is db.messages_collection, "app modules were imported before the stand-ins were installed"
+    assert summary_service.summaries_collection is db.summaries_collection, "app modules were imported before the stand-ins were installed"
+    return main, db
+
+
+def llm_question(rng: random.Random, detect_intent) -> str:
+    # A question no FAQ keyword matches, so it goes to the LLM
+    while True:
+        question = " ".join(rng.choices(FILLER, k=5) + [f"q{rng.getrandbits(40):x}"])
+        if detect_intent(question) is None:
+            return question
+
+
+def faq_question(rng: random.Random, keywords) -> str:
+    # A question containing an FAQ keyword
+    words = rng.choices(FILLER, k=4)
+    words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+    return " ".join(words)
+
+
+async def run(client, name: str, make_request, total: int, concurrency: int):
+    # Send 'total' requests from 'concurrency' clients and print throughput and latency percentiles
+    latencies, statuses, sources = [], Counter(), Counter()
+    next_index = iter(range(total))
+
+    async def worker():
+        for i in next_index:
+            method, url, payload = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, json=payload)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                sources[response.json().get("source")] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1e3, [50, 95, 99])
+    errors = total - statuses[200]
+    print(f"{name:<15} {total:>7} {errors:>6} {total / elapsed:>9.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}   {dict(sources)}")
+
+
+async def seed_histories(db, args):
+    # Insert large histories straight into the per-message collection
+    now = datetime.now(timezone.utc)
+    for u in range(args.history_users):
+        start = now - timedelta(seconds=args.history_size)
+        await db.messages_collection.insert_many([
+            {
+                "user_id": f"history-{u}",
+                "message": f"message {i}",
+                "reply": f"reply {i}",
+                "sentiment": "neutral",
+                "source": "json",
+                "created_at": start + timedelta(seconds=i),
+            }
+            for i in range(args.history_size)
+        ])
+    return now - timedelta(seconds=args.history_size), now
+
+
+async def main_async(args, main, db):
+    from app.utils import detect_intent, get_faq_index
+    import httpx  # Import httpx to call the app in-process
+
+    rng = random.Random(args.seed)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            keywords = [kw for record in get_faq_index().records for kw in record.get("keywords", [])]
+            new_ids = iter(range(10**9))  # Fresh user ids, so first-time questions never hit the reply cache
+
+            def cache_request(i):
+                u = rng.randrange(args.users)
+                return "POST", "/chat", {"user_id": f"warm-{u}", "message": warm_questions[u]}
+
+            def faq_request(i):
+                return "POST", "/chat", {"user_id": f"new-{next(new_ids)}", "message": faq_question(rng, keywords)}
+
+            def llm_request(i):
+                return "POST", "/chat", {"user_id": f"new-{next(new_ids)}", "message": llm_question(rng, detect_intent)}
+
+            # Warm up the reply cache: every warm user asks their question once
+            warm_questions = [faq_question(rng, keywords) for _ in range(args.users)]
+            if {"cache-hit", "mixed"} & set(scenarios):
+                for u, question in enumerate(warm_questions):
+                    await client.post("/chat", json={"user_id": f"warm-{u}", "message": question})
+
+            if {"history-latest", "history-deep"} & set(scenarios):
+                oldest, newest = await seed_histories(db, args)
+
+            print(f"{'scenario':<15} {'requests':>7} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}   sources")
+            for name in scenarios:
+                if name == "cache-hit":
+                    make_request = cache_request
+                elif name == "faq-hit":
+                    make_request = faq_request
+                elif name == "llm-miss":
+                    make_request = llm_request
+                elif name == "mixed":
+                    weights = dict(part.split("=") for part in args.mix.split(","))
+                    choices = [cache_request, faq_request, llm_request]
+                    mix = [float(weights.get(k, 0)) for k in ("cache", "faq", "llm")]
+
+                    def make_request(i):
+                        return rng.choices(choices, weights=mix)[0](i)
+                elif name == "history-latest":
+                    def make_request(i):
+                        return "GET", f"/chat/history/history-{rng.randrange(args.history_users)}", None
+                else:  # history-deep
+                    def make_request(i):
+                        before = oldest + (newest - oldest) * rng.random()
+                        return "GET", f"/chat/history/history-{rng.randrange(args.history_users)}?before={before.isoformat().replace('+', '%2B')}", None
+                await run(client, name, make_request, args.requests, args.concurrency)
+
+
+def main():
+    args = parse_args()
+    llm_process = start_fake_llm(args)
+    try:
+        main_module, db = load_app(args)
+        asyncio.run(main_async(args, main_module, db))
+    finally:
+        llm_process.terminate()
+
+
+if __name__ == "__main__":
+    main()
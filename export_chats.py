@@ -0,0 +1,81 @@
+"""
+File: export_chats.py
+Directory: root (or your project directory)
+Description:
+This script exports chat turns from MongoDB as NDJSON (one JSON object per line with user_id, message,
+reply, sentiment, source and created_at) for analytics. It streams from MongoDB cursors in batches, so
+memory use stays constant however many turns are exported, and reads from secondaries when the
+deployment has them (EXPORT_READ_PREFERENCE), so the primary stays free for live chat traffic.
+
+Usage:
+    python export_chats.py [--since 2024-01-01] [--until 2024-02-01] [--user ID ...] [--gzip] [--output chats.ndjson.gz]
+"""
+
+# Import argparse to read export options from the command line
+import argparse
+
+# Import asyncio for running asynchronous code
+import asyncio
+
+# Import sys to write the export to standard output and progress to standard error
+import sys
+
+# Import time to report export throughput
+import time
+
+# Import datetime to parse the date range
+from datetime import datetime
+
+# Import the streaming NDJSON export and gzip compression used by the admin endpoint as well
+from app.services.export_service import export_ndjson, gzip_stream
+
+# Import the default cursor batch size
+from app.config import EXPORT_BATCH_SIZE
+
+
+# Define a function to parse the command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export chat turns as NDJSON")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="only turns created at or after this ISO date/time (UTC if no offset)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="only turns created before this ISO date/time (UTC if no offset)")
+    parser.add_argument("--user", action="append", dest="users", help="only this user id (repeat for several users)")
+    parser.add_argument("--gzip", action="store_true", help="compress the output with gzip")
+    parser.add_argument("--output", help="output file (default: standard output)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="documents per MongoDB batch")
+    return parser.parse_args()
+
+
+# Define an asynchronous function to stream the export into a binary file
+async def export(args, out):
+    # Count exported turns on the uncompressed stream
+    turns = 0
+
+    async def counted(chunks):
+        nonlocal turns
+        async for chunk in chunks:
+            turns += chunk.count(b"\n")  # One line per turn
+            yield chunk
+
+    # Start the throughput timer
+    start = time.perf_counter()
+
+    # Stream the turns batch by batch, compressing them on the way when asked to
+    chunks = counted(export_ndjson(args.since, args.until, args.users, args.batch_size))
+    async for data in (gzip_stream(chunks) if args.gzip else chunks):
+        out.write(data)
+
+    # Print the number of exported turns and the throughput to standard error
+    elapsed = time.perf_counter() - start
+    print(f"✅ {turns} chat turns exported in {elapsed:.1f}s ({turns / max(elapsed, 1e-9):.0f} turns/s)", file=sys.stderr)
+
+
+# Run the export if this script is executed directly
+if __name__ == "__main__":
+    args = parse_args()
+    if args.output:
+        # Write to the given file
+        with open(args.output, "wb") as out:
+            asyncio.run(export(args, out))
+    else:
+        # Write to standard output in binary mode
+        asyncio.run(export(args, sys.stdout.buffer))
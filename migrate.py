@@ -3,13 +3,42 @@ File: migrate.py
 Directory: root (or your project directory)
 Description: 
 This script connects to a MongoDB database using Motor (AsyncIOMotorClient) and creates necessary indexes 
-for the 'users' and 'chat_histories' collections. It ensures that user mobile numbers are unique and 
-optimizes queries for chat histories by creating indexes on user_id and messages.created_at.
+for the 'users', 'chat_histories' and 'chat_messages' collections. It ensures that user mobile numbers are unique and 
+optimizes queries for chat histories by creating indexes on user_id, messages.created_at and (user_id, created_at).
+
+The 'explode' command moves legacy chat histories (one 'chat_histories' document per user with an embedded
+'messages' array) into the per-message 'chat_messages' collection. It streams user documents in _id order,
+upserts each user's turns keyed by (user_id, created_at) with bulk_write, marks the document 'migrated: true'
+and checkpoints its progress in 'migration_checkpoints' after every batch, so an interrupted run resumes
+where it stopped and re-running it never duplicates turns. The app keeps serving while it runs: unmigrated
+users are read from their embedded array, migrated ones from 'chat_messages'. Turns without a 'created_at'
+are copied too: they are keyed by their document and position in the array instead, and get a timestamp one
+millisecond after the turn before them (flagged 'created_at_estimated: true'), so they keep their place and
+never tie with another turn of the same document.
+
+Usage:
+    python migrate.py [indexes]
+    python migrate.py explode [--batch-size 100] [--pause 0] [--restart]
 """
 
 # Import AsyncIOMotorClient for asynchronous MongoDB operations
 from motor.motor_asyncio import AsyncIOMotorClient
 
+# Import UpdateOne to build bulk write requests
+from pymongo import UpdateOne
+
+# Import ObjectId to estimate a timestamp from a document id
+from bson import ObjectId
+
+# Import argparse to select the migration command and its options
+import argparse
+
+# Import time to report throughput
+import time
+
+# Import datetime utilities to timestamp checkpoints and estimate missing turn timestamps
+from datetime import datetime, timedelta, timezone
+
 # Import asyncio for running asynchronous code
 import asyncio
 
@@ -57,9 +86,175 @@ async def migrate():
     # Print a message confirming the chat_histories indexes creation
     print("✅ chat_histories indexes created")
 
+    # Reference the 'chat_messages' collection (one document per chat turn)
+    messages = db.chat_messages
+
+    # Create a compound index serving "latest N turns of a user" and cursor pagination by created_at
+    await messages.create_index([("user_id", 1), ("created_at", -1)])
+
+    # Print a message confirming the chat_messages index creation
+    print("✅ chat_messages indexes created")
+
+    # Close the MongoDB client connection
+    client.close()
+
+# Define the name of the checkpoint document of the explode migration
+EXPLODE_CHECKPOINT = "explode_chat_histories"
+
+
+# Define a function giving the turns without a timestamp one of their own: one millisecond after the turn before
+# them in the array (turns before the first timestamped one count back from it), skipping timestamps already
+# taken, so every turn of the document has a distinct timestamp and history pages, which are cut on created_at,
+# can neither split nor skip them. Returns {index in the array: estimated created_at}
+def estimated_timestamps(doc, messages):
+    stamps = [msg.get("created_at") for msg in messages]
+    taken = {created_at for created_at in stamps if created_at is not None}
+    leading = next((i for i, created_at in enumerate(stamps) if created_at is not None), len(stamps))
+    if leading < len(stamps):
+        anchor = stamps[leading]
+    else:
+        anchor = doc["_id"].generation_time if isinstance(doc["_id"], ObjectId) else datetime.now(timezone.utc)
+    previous = anchor - timedelta(milliseconds=leading + 1)
+    estimates = {}
+    for index, created_at in enumerate(stamps):
+        if created_at is not None:
+            previous = created_at
+            continue
+        candidate = previous + timedelta(milliseconds=1)
+        while candidate in taken:
+            candidate += timedelta(milliseconds=1)
+        taken.add(candidate)
+        estimates[index] = previous = candidate
+    return estimates
+
+
+# Define a function building the upserts of one legacy document's turns
+def turn_upserts(doc):
+    requests = []
+    messages = doc.get("messages") or []
+    estimates = estimated_timestamps(doc, messages)
+    for index, msg in enumerate(messages):
+        turn = {"user_id": doc["user_id"], **{k: v for k, v in msg.items() if k != "_id"}}
+        if msg.get("created_at") is not None:
+            # Insert the turn unless this (user_id, created_at) is already there, so re-runs are idempotent
+            # (turns with an estimated timestamp are keyed differently and never match)
+            key = {"user_id": doc["user_id"], "created_at": msg["created_at"], "legacy_index": {"$exists": False}}
+        else:
+            # No timestamp to key on: the document and the position in its array identify the turn instead
+            key = {"user_id": doc["user_id"], "legacy_id": doc["_id"], "legacy_index": index}
+            turn.update(created_at=estimates[index], created_at_estimated=True)
+        requests.append(UpdateOne(key, {"$setOnInsert": turn}, upsert=True))
+    return requests
+
+
+# Define an asynchronous function to explode embedded message arrays into the per-message collection
+async def explode(batch_size: int, pause: float, restart: bool):
+    # Create an asynchronous MongoDB client using the given URI
+    client = AsyncIOMotorClient(MONGO_URI)
+
+    # Select the database and the collections involved
+    db = client[DB_NAME]
+    chats = db.chat_histories
+    messages = db.chat_messages
+    checkpoints = db.migration_checkpoints
+
+    # Make sure the target index exists before writing into it
+    await messages.create_index([("user_id", 1), ("created_at", -1)])
+
+    # Resume after the last fully migrated batch, unless asked to start over
+    checkpoint = None if restart else await checkpoints.find_one({"_id": EXPLODE_CHECKPOINT})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    users = checkpoint.get("users", 0) if checkpoint else 0
+    turns = checkpoint.get("turns", 0) if checkpoint else 0
+    if last_id is not None:
+        print(f"↪️  Resuming after {last_id} ({users} users, {turns} turns already migrated)")
+
+    # Stream the unmigrated user documents in _id order, one batch at a time
+    query = {"migrated": {"$ne": True}}
+    if last_id is not None:
+        query["_id"] = {"$gt": last_id}
+    cursor = chats.find(query).sort("_id", 1).batch_size(batch_size)
+
+    # Start the throughput timer
+    start = time.perf_counter()
+    run_users = run_turns = run_estimated = 0
+
+    while True:
+        # Read the next batch of user documents
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            break
+
+        # Documents come in _id order: the checkpoint moves past the last one once the batch is done
+        batch_last_id = batch[-1]["_id"]
+
+        # Upsert the turns of the batch and mark its documents as migrated; a document whose array
+        # changed meanwhile (a push by a worker still running older code) is not marked and is redone
+        while batch:
+            requests = [req for doc in batch for req in turn_upserts(doc)]
+            if requests:
+                written = await messages.bulk_write(requests, ordered=False)
+                run_turns += written.upserted_count  # Turns already copied by an interrupted run are not counted again
+                estimated = [msg.get("created_at") is None for doc in batch for msg in doc.get("messages") or []]  # Same order as the requests
+                run_estimated += sum(estimated[i] for i in written.upserted_ids)
+            flags = [
+                UpdateOne(
+                    {"_id": doc["_id"], "messages": {"$size": len(doc.get("messages") or [])}},
+                    {"$set": {"migrated": True, "migrated_at": datetime.now(timezone.utc)}}
+                )
+                for doc in batch
+            ]
+            result = await chats.bulk_write(flags, ordered=False)
+            run_users += result.modified_count
+            if result.modified_count == len(batch):
+                break
+            batch = await chats.find({"_id": {"$in": [doc["_id"] for doc in batch]}, "migrated": {"$ne": True}}).to_list(length=None)
+
+        # Checkpoint the batch, so an interrupted run resumes after it
+        last_id = batch_last_id
+        await checkpoints.update_one(
+            {"_id": EXPLODE_CHECKPOINT},
+            {"$set": {"last_id": last_id, "users": users + run_users, "turns": turns + run_turns, "done": False, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+        # Print the progress and throughput of this run
+        elapsed = time.perf_counter() - start
+        print(f"⏳ {users + run_users} users, {turns + run_turns} turns migrated ({run_users / elapsed:.0f} users/s, {run_turns / elapsed:.0f} turns/s)")
+
+        # Leave room for live traffic between batches when asked to
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    # Mark the migration as complete
+    await checkpoints.update_one({"_id": EXPLODE_CHECKPOINT}, {"$set": {"done": True, "updated_at": datetime.now(timezone.utc)}}, upsert=True)
+
+    # Print a message confirming the migration
+    elapsed = time.perf_counter() - start
+    print(f"✅ chat_histories exploded into chat_messages: {run_users} users, {run_turns} turns in {elapsed:.1f}s")
+    if run_estimated:
+        print(f"⚠️  {run_estimated} turns had no created_at and were given a time just after the turn before them (created_at_estimated: true)")
+
     # Close the MongoDB client connection
     client.close()
 
-# Run the migrate function if this script is executed directly
+
+# Define a function to parse the command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="MongoDB migrations of the chatbot")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("indexes", help="create the indexes (default)")
+    explode_parser = commands.add_parser("explode", help="move embedded chat_histories messages into chat_messages")
+    explode_parser.add_argument("--batch-size", type=int, default=100, help="user documents per batch")
+    explode_parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between batches, to go easy on a busy database")
+    explode_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and scan every unmigrated document")
+    return parser.parse_args()
+
+
+# Run the selected migration if this script is executed directly
 if __name__ == "__main__":
-    asyncio.run(migrate())
+    args = parse_args()
+    if args.command == "explode":
+        asyncio.run(explode(args.batch_size, args.pause, args.restart))
+    else:
+        asyncio.run(migrate())
@@ -0,0 +1,54 @@
+"""
+File: conftest.py
+Directory: tests/conftest.py
+Description:
+Shared pytest setup. The app runs against in-process stand-ins, as in benchmarks/load_test.py:
+fakeredis for Redis and mongomock-motor for MongoDB. They are installed here, before any app
+module is imported, because modules bind the Redis client and MongoDB collections on import.
+Async tests use the anyio pytest plugin on asyncio; every test starts with empty Redis and MongoDB.
+
+Usage:
+    pip install -r requirements.txt -r tests/requirements.txt
+    python -m pytest -q
+"""
+
+import os  # Import os to configure the app before it is imported
+
+import fakeredis.aioredis  # Redis stand-in
+import pytest  # Import pytest for fixtures
+from mongomock_motor import AsyncMongoMockClient  # MongoDB stand-in
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["FAQ_WATCH_INTERVAL"] = "0"
+os.environ.setdefault("RATE_LIMIT_PER_SEC", "0")  # Tests of the rate limit enable it themselves
+
+import app.redis_client as redis_client  # noqa: E402
+
+redis_client.r = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+import app.db as db  # noqa: E402
+
+db.client = AsyncMongoMockClient(tz_aware=True)
+db.db = db.client.smart_cooking_db
+db.users_collection = db.db.users
+db.chat_collection = db.db.chat_histories
+db.messages_collection = db.db.chat_messages
+db.summaries_collection = db.db.chat_summaries
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+async def clean_stores(anyio_backend):
+    # Empty Redis, MongoDB and the L1 cache before every test
+    from app.services.local_cache import local_cache
+
+    await redis_client.r.flushall()
+    for name in await db.db.list_collection_names():
+        await db.db.drop_collection(name)
+    local_cache.clear()
+    yield
+    await redis_client.r.connection_pool.disconnect()  # Connections are bound to this test's event loop
@@ -0,0 +1,179 @@
+"""
+Tests of app/chatbot.py: which LLM answers are shared between users.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.chatbot as chatbot
+from app.models import UserMessage
+
+QUESTION = "xqz kichu ekta proshno"  # Matches no FAQ keyword, so it goes to the LLM
+
+
+class StubLLM:
+    # Answers every question with a numbered reply and records the contexts it was given
+    def __init__(self):
+        self.contexts = []
+
+    async def generate_answer(self, question: str, context: str, timeout: float = None) -> str:
+        self.contexts.append(context)
+        number = len(self.contexts)
+        await asyncio.sleep(0.01)
+        return f"answer {number}"
+
+    async def stream_answer(self, question: str, context: str, timeout: float = None):
+        self.contexts.append(context)
+        number = len(self.contexts)
+        for token in ("answer", f" {number}"):
+            await asyncio.sleep(0.02)
+            yield token
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    stub = StubLLM()
+    monkeypatch.setattr(chatbot, "get_llm", lambda: stub)
+    return stub
+
+
+async def seed_history(user_id: str):
+    from app.db import messages_collection
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    await messages_collection.insert_many([
+        {"user_id": user_id, "message": f"amar order {i}", "reply": f"order {i} noted", "sentiment": "neutral", "source": "llm", "created_at": start + timedelta(minutes=i)}
+        for i in range(3)
+    ])
+
+
+@pytest.mark.anyio
+async def test_answer_without_personal_context_is_shared(llm):
+    first = await chatbot.get_reply(UserMessage(user_id="new-1", message=QUESTION))
+    second = await chatbot.get_reply(UserMessage(user_id="new-2", message=QUESTION))
+
+    assert (first.source, second.source) == ("llm", "redis-cache")
+    assert second.reply == first.reply
+    assert len(llm.contexts) == 1
+
+
+@pytest.mark.anyio
+async def test_answer_built_from_history_is_not_shared(llm):
+    await seed_history("alice")
+
+    personal = await chatbot.get_reply(UserMessage(user_id="alice", message=QUESTION))
+    other = await chatbot.get_reply(UserMessage(user_id="bob", message=QUESTION))
+
+    assert (personal.source, other.source) == ("llm", "llm")
+    assert other.reply != personal.reply
+    assert "order 0 noted" in llm.contexts[0] and "order 0 noted" not in llm.contexts[1]
+
+
+@pytest.mark.anyio
+async def test_concurrent_askers_with_different_history_do_not_coalesce(llm):
+    await seed_history("alice")
+
+    replies = await asyncio.gather(
+        chatbot.get_reply(UserMessage(user_id="alice", message=QUESTION)),
+        chatbot.get_reply(UserMessage(user_id="bob", message=QUESTION)),
+        chatbot.get_reply(UserMessage(user_id="carol", message=QUESTION)),
+    )
+
+    assert len(llm.contexts) == 2  # alice alone, bob and carol together
+    assert replies[1].reply == replies[2].reply != replies[0].reply
+
+
+@pytest.mark.anyio
+async def test_batch_only_deduplicates_identical_contexts(llm):
+    await seed_history("alice")
+
+    replies = await chatbot.get_replies([
+        UserMessage(user_id="bob", message=QUESTION),
+        UserMessage(user_id="alice", message=QUESTION),
+        UserMessage(user_id="carol", message=QUESTION),
+    ])
+
+    assert len(llm.contexts) == 2
+    assert [r.source for r in replies] == ["llm", "llm", "llm"]
+    assert replies[0].reply == replies[2].reply != replies[1].reply
+    assert sum("order 0 noted" in context for context in llm.contexts) == 1
+
+
+class CountingRedis:
+    # Delegates to the Redis client and counts the pipelines opened through it
+    def __init__(self, client):
+        self.client = client
+        self.pipelines = 0
+
+    def pipeline(self, *args, **kwargs):
+        self.pipelines += 1
+        return self.client.pipeline(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+@pytest.mark.anyio
+async def test_batch_stores_every_turn_in_one_redis_round_trip(llm, monkeypatch):
+    from app.db import messages_collection
+    from app.services.history_service import recent_messages
+    from app.utils import get_faq_index
+
+    keyword = next(kw for record in get_faq_index().records for kw in record.get("keywords", []))
+    redis = CountingRedis(chatbot.r)
+    monkeypatch.setattr(chatbot, "r", redis)
+    user_msgs = [UserMessage(user_id=f"u{i % 5}", message=QUESTION if i % 2 else f"{keyword} {i}") for i in range(40)]
+
+    replies = await chatbot.get_replies(user_msgs)
+
+    assert redis.pipelines == 1
+    assert {r.source for r in replies} == {"json", "llm"}
+    assert await messages_collection.count_documents({}) == 40
+    history = await recent_messages("u0", 10)
+    assert [t["message"] for t in history] == [m.message for m in user_msgs if m.user_id == "u0"]
+
+
+async def collect(stream) -> list:
+    return [event async for event in stream]
+
+
+@pytest.mark.anyio
+async def test_identical_streams_and_calls_share_one_completion(llm):
+    message = UserMessage(user_id="new-1", message=QUESTION)
+    leader = asyncio.create_task(collect(chatbot.stream_reply(message)))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(collect(chatbot.stream_reply(UserMessage(user_id="new-2", message=QUESTION))))
+    plain = asyncio.create_task(chatbot.get_reply(UserMessage(user_id="new-3", message=QUESTION)))
+
+    leader_events, follower_events, reply = await asyncio.gather(leader, follower, plain)
+    assert len(llm.contexts) == 1
+    assert [payload for event, payload in leader_events if event == "token"] == ["answer", " 1"]
+    assert [event for event, _ in follower_events] == ["reply"]  # The finished answer as a single event
+    assert follower_events[0][1].reply == reply.reply == leader_events[-1][1].reply == "answer 1"
+
+
+@pytest.mark.anyio
+async def test_waiters_take_over_when_the_streaming_leader_goes_away(llm):
+    stream = chatbot.stream_reply(UserMessage(user_id="new-1", message=QUESTION))
+    assert await stream.__anext__() == ("token", "answer")
+    follower = asyncio.create_task(collect(chatbot.stream_reply(UserMessage(user_id="new-2", message=QUESTION))))
+    await asyncio.sleep(0.01)
+    await stream.aclose()  # The first client disconnected mid-stream
+
+    events = await follower
+    assert [payload for event, payload in events if event == "token"] == ["answer", " 2"]
+    assert events[-1][1].reply == "answer 2"
+
+
+@pytest.mark.anyio
+async def test_stream_waiting_on_a_cancelled_call_answers_itself(llm):
+    leader = asyncio.create_task(chatbot.get_reply(UserMessage(user_id="new-1", message=QUESTION)))
+    await asyncio.sleep(0.005)
+    follower = asyncio.create_task(collect(chatbot.stream_reply(UserMessage(user_id="new-2", message=QUESTION))))
+    await asyncio.sleep(0.001)
+    leader.cancel()  # The /chat client disconnected
+
+    events = await follower
+    assert events[-1][0] == "reply" and events[-1][1].reply == "answer 2"
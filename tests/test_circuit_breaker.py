@@ -0,0 +1,81 @@
+"""
+Tests of app/circuit_breaker.py, on a manual clock.
+"""
+
+from app.circuit_breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def open_breaker(clock: Clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures_only():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=Clock())
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # Breaks the run
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.is_open()
+    assert not breaker.allow()
+
+
+def test_half_open_lets_a_single_trial_through():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    clock.now = 9.9
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == "half_open" and not breaker.is_open()
+    assert breaker.allow()  # The trial call
+    assert breaker.is_open()  # Everyone else is still refused while it runs
+    assert not breaker.allow()
+
+
+def test_trial_success_closes_the_circuit():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_trial_failure_reopens_for_another_timeout():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()  # A single failure is enough in the half-open state
+    assert breaker.state == "open"
+
+    clock.now = 19.9
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_abandoned_trial_goes_to_the_next_caller():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.abandon()  # Cancelled before its outcome was known
+    assert breaker.allow()
+    assert not breaker.allow()
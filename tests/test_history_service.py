@@ -0,0 +1,79 @@
+"""
+Tests of app/services/history_service.py: history pages served from the Redis list and from MongoDB.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.redis_client import r
+from app.services.history_service import cache_turn, load_history_page, recent_messages
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_turn(i: int) -> dict:
+    return {"message": f"m{i}", "reply": f"r{i}", "sentiment": "neutral", "source": "json", "created_at": START + timedelta(minutes=i)}
+
+
+async def seed(user_id: str, count: int):
+    from app.db import messages_collection
+
+    await messages_collection.insert_many([{"user_id": user_id, **make_turn(i)} for i in range(count)])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("before", [datetime(2030, 1, 1), datetime(2030, 1, 1, tzinfo=timezone.utc), "2030-01-01T00:00:00"])
+async def test_cursor_without_offset_is_utc_on_both_paths(before):
+    await seed("u1", 5)
+
+    cold, _, source = await load_history_page("u1", before, 3)
+    assert source == "mongodb"
+
+    await recent_messages("u1", 3)  # Builds the Redis list
+    warm, _, source = await load_history_page("u1", before, 3)
+    assert source == "redis"
+    assert [t["message"] for t in warm] == [t["message"] for t in cold] == ["m2", "m3", "m4"]
+
+
+@pytest.mark.anyio
+async def test_cached_pages_follow_the_cursor():
+    await seed("u1", 5)
+    await recent_messages("u1", 5)
+
+    page, cursor, source = await load_history_page("u1", None, 2)
+    assert (source, [t["message"] for t in page]) == ("redis", ["m3", "m4"])
+    page, cursor, _ = await load_history_page("u1", cursor, 2)
+    assert [t["message"] for t in page] == ["m1", "m2"]
+    page, cursor, _ = await load_history_page("u1", cursor, 2)
+    assert [t["message"] for t in page] == ["m0"] and cursor is None
+
+
+@pytest.mark.anyio
+async def test_new_turns_are_appended_to_the_cached_list():
+    await seed("u1", 2)
+    await recent_messages("u1", 10)
+
+    async with r.pipeline(transaction=False) as pipe:
+        cache_turn(pipe, "u1", make_turn(2))
+        await pipe.execute()
+
+    assert [t["message"] for t in await recent_messages("u1", 10)] == ["m0", "m1", "m2"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("cached", [False, True])
+async def test_turns_with_the_same_timestamp_stay_on_one_page(cached):
+    from app.db import messages_collection
+
+    # Three turns saved in the same millisecond by concurrent requests, between m0 and m4
+    turns = [make_turn(0), *[{**make_turn(i), "created_at": START + timedelta(minutes=1)} for i in (1, 2, 3)], make_turn(4)]
+    await messages_collection.insert_many([{"user_id": "u1", **t} for t in turns])
+    if cached:
+        await recent_messages("u1", 5)
+
+    page, cursor, source = await load_history_page("u1", START + timedelta(minutes=5), 2)
+    assert source == ("redis" if cached else "mongodb")
+    assert sorted(t["message"] for t in page) == ["m1", "m2", "m3", "m4"]  # Grown past the limit to hold every tie
+    page, cursor, _ = await load_history_page("u1", cursor, 2)
+    assert [t["message"] for t in page] == ["m0"] and cursor is None
@@ -0,0 +1,38 @@
+"""
+Tests of FAQ intent detection: app/intent_index.py over the shipped FAQ, with app.utils.normalize_text.
+"""
+
+import pytest
+
+from app.utils import detect_intent, normalize_text
+
+
+def intent(message: str):
+    record = detect_intent(normalize_text(message))
+    return record["keywords"][0] if record else None
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("ডেলিভারি কখন পাবো?", "delivery"),
+    ("কেকের মোল্ড আছে?", "product"),
+    ("ছাড় আছে?", "discount"),
+    ("ছা\u09a1\u09bc আছে?", "discount"),  # "ড়" typed as ড + nukta
+    ("Delivery time?", "delivery"),
+])
+def test_keywords_match(message, expected):
+    assert intent(message) == expected
+
+
+@pytest.mark.parametrize("message", [
+    "আমার টাকা বাকি আছে",  # বাকি is not বেকিং
+    "বুকিং দিতে চাই",  # বুকিং is not বেকিং
+    "কোকাকোলা আছে?",  # Not কেক
+    "দম নিয়ে বলুন",  # দম is not দাম
+])
+def test_bangla_words_differing_only_in_vowel_signs_do_not_match(message):
+    assert intent(message) is None
+
+
+def test_normalization_keeps_vowel_signs():
+    assert normalize_text("বুকিং!") == "বুকিং"
+    assert normalize_text("বুকিং") != normalize_text("বেকিং")
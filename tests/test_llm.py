@@ -0,0 +1,183 @@
+"""
+Tests of the resilience layer of app/llm.py (failover, hedging, circuit breakers and deadlines)
+against in-process instances of the fake OpenAI-compatible server of benchmarks/fake_llm.py.
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import app.llm as llm_module
+from app.llm import BanglaLLM, LLMUnavailable
+from benchmarks import fake_llm
+
+ANSWER = (fake_llm.ANSWER_TOKEN * 3).strip()  # What a healthy fake provider answers
+
+
+class Upstream:
+    # ASGI wrapper around the fake LLM server that counts requests; configure() changes its behaviour
+    def __init__(self, latency_ms: float = 10, error_rate: float = 0.0):
+        self.requests = 0
+        self.configure(latency_ms, error_rate)
+
+    def configure(self, latency_ms: float = 10, error_rate: float = 0.0):
+        self.app = fake_llm.create_app(latency_ms, tokens=3, tokens_per_sec=0, error_rate=error_rate)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.requests += 1
+        await self.app(scope, receive, send)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    # Small thresholds and no hedging unless a test asks for it
+    monkeypatch.setattr(llm_module, "LLM_BREAKER_FAILURES", 1)
+    monkeypatch.setattr(llm_module, "LLM_BREAKER_RESET", 30)
+    monkeypatch.setattr(llm_module, "LLM_HEDGE_AFTER", 0)
+    monkeypatch.setattr(llm_module, "LLM_ATTEMPT_TIMEOUT", 5)
+    return monkeypatch
+
+
+@pytest.fixture
+async def make_llm(settings):
+    # Build a BanglaLLM whose providers (in order) are served by the given upstreams
+    created = []
+
+    def build(*upstreams: Upstream) -> BanglaLLM:
+        llm = BanglaLLM([
+            {"name": f"provider-{i}", "base_url": f"http://provider-{i}", "model": "fake", "api_key_env": "OPENAI_API_KEY"}
+            for i in range(len(upstreams))
+        ])
+        for provider, upstream in zip(llm.providers, upstreams):
+            http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream), base_url=f"http://{provider.name}")
+            provider.client = AsyncOpenAI(api_key="test", base_url=f"http://{provider.name}", http_client=http_client, max_retries=0)
+            provider.breaker.clock = Clock()
+        created.append(llm)
+        return llm
+
+    yield build
+    for llm in created:
+        await llm.aclose()
+        for provider in llm.providers:
+            await provider.client.close()
+
+
+@pytest.mark.anyio
+async def test_fails_over_to_the_next_provider(make_llm):
+    primary, secondary = Upstream(error_rate=1), Upstream()
+    llm = make_llm(primary, secondary)
+
+    assert await llm.generate_answer("q", "c") == ANSWER
+    assert (primary.requests, secondary.requests) == (1, 1)
+    assert llm.providers[0].breaker.state == "open"
+
+    # The open circuit is skipped without a request
+    assert await llm.generate_answer("q", "c") == ANSWER
+    assert (primary.requests, secondary.requests) == (1, 2)
+
+
+@pytest.mark.anyio
+async def test_every_circuit_open_fails_at_once(make_llm):
+    primary, secondary = Upstream(error_rate=1), Upstream(error_rate=1)
+    llm = make_llm(primary, secondary)
+
+    with pytest.raises(LLMUnavailable):
+        await llm.generate_answer("q", "c")
+    assert not llm.available()
+
+    started = time.perf_counter()
+    with pytest.raises(LLMUnavailable):
+        await llm.generate_answer("q", "c")
+    assert time.perf_counter() - started < 0.05
+    assert (primary.requests, secondary.requests) == (1, 1)
+
+
+@pytest.mark.anyio
+async def test_half_open_circuit_sends_a_single_trial(make_llm):
+    primary, secondary = Upstream(error_rate=1), Upstream()
+    llm = make_llm(primary, secondary)
+    await llm.generate_answer("q", "c")  # Opens the primary's circuit
+    breaker = llm.providers[0].breaker
+
+    primary.configure(latency_ms=100)  # Healthy again, and slow enough for the calls to overlap
+    breaker.clock.now = breaker.reset_timeout
+    answers = await asyncio.gather(*(llm.generate_answer("q", "c") for _ in range(3)))
+
+    assert answers == [ANSWER] * 3
+    assert primary.requests == 2  # The failure, then one trial while the other calls went to the secondary
+    assert secondary.requests == 3
+    assert breaker.state == "closed"
+
+
+@pytest.mark.anyio
+async def test_failed_trial_keeps_the_circuit_open(make_llm):
+    primary, secondary = Upstream(error_rate=1), Upstream()
+    llm = make_llm(primary, secondary)
+    await llm.generate_answer("q", "c")
+    breaker = llm.providers[0].breaker
+
+    breaker.clock.now = breaker.reset_timeout
+    assert await llm.generate_answer("q", "c") == ANSWER  # Trial fails over to the secondary
+    assert primary.requests == 2
+    assert breaker.state == "open"
+
+
+@pytest.mark.anyio
+async def test_slow_attempt_is_hedged_and_the_loser_cancelled(make_llm, settings):
+    settings.setattr(llm_module, "LLM_HEDGE_AFTER", 0.05)
+    primary, secondary = Upstream(latency_ms=1000), Upstream(latency_ms=10)
+    llm = make_llm(primary, secondary)
+
+    started = time.perf_counter()
+    assert await llm.generate_answer("q", "c") == ANSWER
+    assert time.perf_counter() - started < 0.5
+    assert (primary.requests, secondary.requests) == (1, 1)
+    await asyncio.sleep(0)  # Let the cancelled attempt record its outcome
+    assert llm.providers[0].breaker.state == "closed"  # Losing a race is not a failure
+    assert llm.providers[0].breaker.failures == 0
+
+
+@pytest.mark.anyio
+async def test_attempt_timeout_fails_over_within_the_call_deadline(make_llm, settings):
+    settings.setattr(llm_module, "LLM_ATTEMPT_TIMEOUT", 0.1)
+    primary, secondary = Upstream(latency_ms=1000), Upstream(latency_ms=10)
+    llm = make_llm(primary, secondary)
+
+    started = time.perf_counter()
+    assert await llm.generate_answer("q", "c", timeout=2) == ANSWER
+    assert time.perf_counter() - started < 0.5
+    assert llm.providers[0].breaker.state == "open"  # A timed-out attempt counts as a failure
+
+
+@pytest.mark.anyio
+async def test_call_deadline_is_enforced(make_llm):
+    llm = make_llm(Upstream(latency_ms=1000))
+
+    started = time.perf_counter()
+    with pytest.raises((asyncio.TimeoutError, LLMUnavailable)):
+        await llm.generate_answer("q", "c", timeout=0.1)
+    assert time.perf_counter() - started < 0.5
+    assert llm.semaphore._value == llm_module.LLM_MAX_CONCURRENCY  # The slot was released
+
+
+@pytest.mark.anyio
+async def test_stream_fails_over_before_the_first_token(make_llm):
+    primary, secondary = Upstream(error_rate=1), Upstream()
+    llm = make_llm(primary, secondary)
+
+    tokens = [token async for token in llm.stream_answer("q", "c")]
+    assert "".join(tokens).strip() == ANSWER
+    assert (primary.requests, secondary.requests) == (1, 1)
+    assert llm.providers[0].breaker.state == "open"
@@ -0,0 +1,40 @@
+"""
+Tests of app/services/local_cache.py: which L1 fills racing an invalidation are dropped.
+"""
+
+import app.services.local_cache as local_cache_module
+from app.services.local_cache import LocalCache
+
+
+def test_fill_is_dropped_only_if_its_own_key_was_invalidated():
+    cache = LocalCache(max_bytes=1_000_000, ttl=60)
+    mine, other = cache.version("history:a"), cache.version("history:b")
+
+    cache.invalidate("history:b")  # A turn of another user landed during our Redis round-trip
+    cache.set("history:a", ["turn"], version=mine)
+    assert cache.get("history:a") == ["turn"]
+
+    cache.set("history:b", ["stale"], version=other)
+    assert cache.get("history:b") is None
+    cache.set("history:b", ["fresh"], version=cache.version("history:b"))
+    assert cache.get("history:b") == ["fresh"]
+
+
+def test_tracked_versions_are_bounded(monkeypatch):
+    monkeypatch.setattr(local_cache_module, "MAX_TRACKED_KEYS", 3)
+    cache = LocalCache(max_bytes=1_000_000, ttl=60)
+    version = cache.version("k0")
+    for i in range(10):
+        cache.invalidate(f"k{i}")
+    assert len(cache._generations) <= 3
+
+    cache.set("k0", "stale", version=version)  # Its invalidation was forgotten, but the reset still drops it
+    assert cache.get("k0") is None
+
+
+def test_clear_drops_fills_in_flight():
+    cache = LocalCache(max_bytes=1_000_000, ttl=60)
+    version = cache.version("k")
+    cache.clear()  # E.g. the invalidation listener reconnected and may have missed messages
+    cache.set("k", "value", version=version)
+    assert cache.get("k") is None
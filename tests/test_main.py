@@ -0,0 +1,71 @@
+"""
+Tests of the HTTP endpoints of app/main.py.
+"""
+
+import httpx
+import pytest
+
+import app.main as main
+
+
+@pytest.fixture
+async def client(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}])
+async def test_batch_requires_the_admin_token(client, headers):
+    response = await client.post("/chat/batch", json={"messages": [{"user_id": "u1", "message": "hello"}]}, headers=headers)
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_batch_with_the_admin_token(client):
+    from app.utils import get_faq_index
+
+    keyword = next(kw for record in get_faq_index().records for kw in record.get("keywords", []))
+    messages = [{"user_id": f"u{i}", "message": f"{keyword} {i}"} for i in range(3)]
+    response = await client.post("/chat/batch", json={"messages": messages}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert [reply["source"] for reply in response.json()["replies"]] == ["json"] * 3
+
+
+@pytest.fixture
+def export(monkeypatch):
+    # A small export instead of a scan of the collections
+    async def export_ndjson(since, until, user_ids):
+        yield b'{"message": "m0"}\n'
+
+    monkeypatch.setattr(main, "export_ndjson", export_ndjson)
+
+
+@pytest.mark.anyio
+async def test_concurrent_export_is_refused_before_streaming(export):
+    from fastapi import HTTPException
+
+    first = await main.admin_export_chats(since=None, until=None, user_id=None, gzip=False)
+    with pytest.raises(HTTPException) as refused:
+        await main.admin_export_chats(since=None, until=None, user_id=None, gzip=False)  # Before the first body has started
+    assert refused.value.status_code == 429
+
+    assert [chunk async for chunk in first.body_iterator] == [b'{"message": "m0"}\n']
+    await first.background()
+    assert not main.export_slots.locked()
+
+
+@pytest.mark.anyio
+async def test_export_slot_is_freed_when_the_body_never_runs(export):
+    response = await main.admin_export_chats(since=None, until=None, user_id=None, gzip=False)
+    await response.background()  # The client went away before the first chunk
+    assert not main.export_slots.locked()
+    await response.body_iterator.aclose()
+
+
+@pytest.mark.anyio
+async def test_export_over_http(client, export):
+    response = await client.get("/admin/export/chats", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200 and response.content == b'{"message": "m0"}\n'
+    assert not main.export_slots.locked()
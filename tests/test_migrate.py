@@ -0,0 +1,74 @@
+"""
+Tests of the 'explode' migration in migrate.py (legacy chat_histories arrays into chat_messages).
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.db as db
+import migrate
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def mongo(monkeypatch):
+    # The migration opens its own client: hand it the test database's
+    monkeypatch.setattr(migrate, "AsyncIOMotorClient", lambda uri: db.client)
+    monkeypatch.setattr(db.client, "close", lambda: None, raising=False)
+
+
+def turn(i: int, timestamped: bool = True) -> dict:
+    msg = {"message": f"m{i}", "reply": f"r{i}", "sentiment": "neutral", "source": "json"}
+    if timestamped:
+        msg["created_at"] = START + timedelta(minutes=i)
+    return msg
+
+
+@pytest.mark.anyio
+async def test_turns_are_copied_once_and_documents_marked():
+    await db.chat_collection.insert_many([{"user_id": f"u{u}", "messages": [turn(i) for i in range(u + 1)]} for u in range(5)])
+    await db.messages_collection.insert_one({"user_id": "u2", **turn(0)})  # Already copied by an interrupted run
+
+    await migrate.explode(batch_size=2, pause=0, restart=False)
+    await migrate.explode(batch_size=2, pause=0, restart=True)  # Re-running changes nothing
+
+    assert await db.messages_collection.count_documents({}) == sum(range(1, 6))
+    assert await db.chat_collection.count_documents({"migrated": True}) == 5
+
+
+@pytest.mark.anyio
+async def test_turns_without_a_timestamp_are_kept_in_place():
+    await db.chat_collection.insert_one({"user_id": "u1", "messages": [turn(0, False), turn(1), turn(2, False), turn(3, False), turn(4)]})
+
+    await migrate.explode(batch_size=10, pause=0, restart=False)
+    await migrate.explode(batch_size=10, pause=0, restart=True)
+
+    docs = await db.messages_collection.find({"user_id": "u1"}).sort("legacy_index", 1).to_list(length=None)
+    assert sorted(doc["message"] for doc in docs) == ["m0", "m1", "m2", "m3", "m4"]
+    estimated = {doc["message"]: doc["created_at"] for doc in docs if doc.get("created_at_estimated")}
+    ms = timedelta(milliseconds=1)
+    assert estimated == {"m0": START + timedelta(minutes=1) - ms, "m2": START + timedelta(minutes=1) + ms, "m3": START + timedelta(minutes=1) + 2 * ms}
+    assert await db.chat_collection.count_documents({"migrated": True}) == 1
+
+
+def test_estimated_timestamps_skip_taken_ones():
+    doc = {"_id": "legacy", "messages": [turn(0), turn(1, False), {**turn(2), "created_at": START + timedelta(milliseconds=1)}]}
+    assert migrate.estimated_timestamps(doc, doc["messages"]) == {1: START + timedelta(milliseconds=2)}
+
+
+@pytest.mark.anyio
+async def test_estimated_turns_are_not_lost_between_history_pages():
+    from app.services.history_service import load_history_page
+
+    await db.chat_collection.insert_one({"user_id": "u1", "messages": [turn(1), turn(2, False), {**turn(3), "created_at": START + timedelta(minutes=1, seconds=1)}]})
+    await migrate.explode(batch_size=10, pause=0, restart=False)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor, _ = await load_history_page("u1", cursor, 2)
+        seen = [t["message"] for t in page] + seen
+        if cursor is None:
+            break
+    assert seen == ["m1", "m2", "m3"]
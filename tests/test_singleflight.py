@@ -0,0 +1,92 @@
+"""
+Tests of app/services/singleflight.py: coalescing identical LLM calls inside a worker and across workers.
+"""
+
+import asyncio
+
+import pytest
+
+from app.redis_client import r
+from app.services.singleflight import coalesce, inflight
+
+
+class Producer:
+    # Counts its calls and answers after a short delay (or fails, when told to)
+    def __init__(self, delay: float = 0.05, error: Exception = None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return f"answer {self.calls}"
+
+
+@pytest.mark.anyio
+async def test_concurrent_callers_share_one_call():
+    produce = Producer()
+    results = await asyncio.gather(*(coalesce("k", produce) for _ in range(5)))
+    assert results == ["answer 1"] * 5
+    assert produce.calls == 1
+    assert inflight("k") is None
+    assert await r.get("llm_lock:k") is None  # Lock released
+    assert await r.get("llm_result:k") == "answer 1"  # Handed off to other workers
+
+
+@pytest.mark.anyio
+async def test_leader_failure_reaches_every_waiter_and_is_not_cached():
+    failing = Producer(error=RuntimeError("boom"))
+    results = await asyncio.gather(*(coalesce("k", failing) for _ in range(3)), return_exceptions=True)
+    assert [str(e) for e in results] == ["boom"] * 3
+    assert failing.calls == 1
+    assert await r.get("llm_lock:k") is None  # Other workers may take over at once
+
+    produce = Producer()
+    assert await coalesce("k", produce) == "answer 1"  # The next call runs again
+
+
+@pytest.mark.anyio
+async def test_cancelled_leader_hands_over_to_a_waiter():
+    produce = Producer(delay=0.2)
+    leader = asyncio.create_task(coalesce("k", produce))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(coalesce("k", produce))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    assert await waiter == "answer 2"
+    assert produce.calls == 2
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+
+@pytest.mark.anyio
+async def test_waits_for_the_answer_of_another_worker():
+    await r.set("llm_lock:k", "other-worker", ex=10)
+
+    async def other_worker():
+        await asyncio.sleep(0.1)
+        await r.setex("llm_result:k", 30, "from other worker")
+        await r.delete("llm_lock:k")
+
+    produce = Producer()
+    result, _ = await asyncio.gather(coalesce("k", produce), other_worker())
+    assert result == "from other worker"
+    assert produce.calls == 0
+
+
+@pytest.mark.anyio
+async def test_takes_over_when_the_other_worker_gives_up():
+    await r.set("llm_lock:k", "other-worker", ex=10)
+
+    async def other_worker():
+        await asyncio.sleep(0.1)
+        await r.delete("llm_lock:k")  # Failed without publishing an answer
+
+    produce = Producer()
+    result, _ = await asyncio.gather(coalesce("k", produce), other_worker())
+    assert result == "answer 1"
+    assert produce.calls == 1
@@ -0,0 +1,96 @@
+"""
+Tests of app/services/summary_service.py: which turns are kept verbatim and when older ones are folded into the summary.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.services.summary_service as summary_service
+from app.config import HISTORY_CONTEXT_TURNS, SUMMARY_FOLD_TURNS
+from app.services.summary_service import conversation_context
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_turn(i: int) -> dict:
+    return {"message": f"m{i}", "reply": f"r{i}", "sentiment": "neutral", "source": "json", "created_at": START + timedelta(minutes=i)}
+
+
+class StubLLM:
+    # "Summarizes" by appending the folded turns' messages to the previous summary
+    def __init__(self):
+        self.folded = []
+
+    async def summarize(self, summary: str, conversation: str, max_tokens: int, timeout: float = None) -> str:
+        messages = [line.split(" | ")[0].removeprefix("User: ") for line in conversation.splitlines()]
+        self.folded.append(messages)
+        return " ".join(filter(None, [summary, *messages]))
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    stub = StubLLM()
+    monkeypatch.setattr(summary_service, "get_llm", lambda: stub)
+    return stub
+
+
+async def seed(user_id: str, count: int):
+    from app.db import messages_collection
+
+    await messages_collection.insert_many([{"user_id": user_id, **make_turn(i)} for i in range(count)])
+
+
+async def settle():
+    # Wait for the background summary updates started so far
+    await asyncio.gather(*summary_service._tasks)
+
+
+def first_message(context: str) -> str:
+    return context.splitlines()[0].split(" | ")[0].removeprefix("User: ")
+
+
+@pytest.mark.anyio
+async def test_turns_older_than_the_window_are_folded_when_the_recent_ones_fit(llm):
+    await seed("u1", 30)  # Short turns: the whole window fits in the token budget
+
+    summary, context = await conversation_context("u1")
+    assert (summary, first_message(context)) == ("", f"m{30 - HISTORY_CONTEXT_TURNS}")
+    await settle()
+
+    # Everything before the window was folded, together with the oldest turns of the window
+    folded_until = 30 - HISTORY_CONTEXT_TURNS + SUMMARY_FOLD_TURNS
+    assert llm.folded == [[f"m{i}" for i in range(folded_until)]]
+    summary, context = await conversation_context("u1")
+    assert summary == " ".join(f"m{i}" for i in range(folded_until))
+    assert first_message(context) == f"m{folded_until}"
+    assert len(context.splitlines()) == HISTORY_CONTEXT_TURNS - SUMMARY_FOLD_TURNS
+
+
+@pytest.mark.anyio
+async def test_next_fold_waits_for_a_batch_of_new_turns(llm, monkeypatch):
+    await seed("u1", HISTORY_CONTEXT_TURNS)
+    turns = [make_turn(i) for i in range(HISTORY_CONTEXT_TURNS)]  # As held by a WebSocket session
+    await conversation_context("u1", turns)  # Full window, no summary yet
+    await settle()
+    assert len(llm.folded) == 1
+
+    scheduled = []
+    monkeypatch.setattr(summary_service, "schedule_summary_update", lambda user_id, cutoff: scheduled.append(cutoff))
+    for i in range(HISTORY_CONTEXT_TURNS, HISTORY_CONTEXT_TURNS + SUMMARY_FOLD_TURNS):
+        turns.append(make_turn(i))
+        await conversation_context("u1", turns)
+    # Only once the window has moved past every summarized turn
+    assert len(scheduled) == 1
+
+
+@pytest.mark.anyio
+async def test_short_history_is_not_summarized(llm, monkeypatch):
+    await seed("u1", HISTORY_CONTEXT_TURNS - 1)
+    scheduled = []
+    monkeypatch.setattr(summary_service, "schedule_summary_update", lambda user_id, cutoff: scheduled.append(cutoff))
+
+    summary, context = await conversation_context("u1")
+    assert summary == "" and len(context.splitlines()) == HISTORY_CONTEXT_TURNS - 1
+    assert scheduled == []
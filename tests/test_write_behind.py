@@ -0,0 +1,188 @@
+"""
+Tests of app/services/write_behind.py: batching, retries, dropped turns and the shutdown flush.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+
+import app.services.write_behind as write_behind
+from app.services.metrics import TURNS_DROPPED
+from app.services.write_behind import TurnWriter
+
+
+class FlakyCollection:
+    # Stands in for a MongoDB collection: bulk_write raises the queued errors (None = succeed) before succeeding
+    def __init__(self, *errors, always: Exception = None):
+        self.errors = list(errors)
+        self.always = always
+        self.calls = []  # Turns sent by each bulk_write call
+        self.docs = []  # Turns stored
+
+    async def bulk_write(self, requests, ordered=True):
+        docs = [request._doc for request in requests]
+        self.calls.append(docs)
+        error = self.errors.pop(0) if self.errors else self.always
+        if isinstance(error, BulkWriteError):
+            failed = {err["index"] for err in error.details["writeErrors"]}
+            self.docs += [doc for i, doc in enumerate(docs) if i not in failed]  # Unordered: the others are stored
+        elif error is None:
+            self.docs += docs
+        if error is not None:
+            raise error
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+def turn(user_id: str = "u1") -> dict:
+    return {"_id": ObjectId(), "user_id": user_id, "message": "m", "reply": "r", "sentiment": "neutral", "source": "json", "created_at": datetime.now(timezone.utc)}
+
+
+def dropped(reason: str) -> float:
+    return TURNS_DROPPED.labels(reason)._value.get()
+
+
+async def run_writer(collection, docs):
+    # Queue 'docs' on a fresh writer and wait until it has processed all of them
+    writer = TurnWriter(collection, max_queue=100, batch_size=10, flush_interval=0.01)
+    writer.start()
+    for doc in docs:
+        assert await writer.submit(doc)
+    await writer.stop()
+    return writer
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_RETRIES", 2)
+
+
+@pytest.mark.anyio
+async def test_turns_are_written_in_one_batch_and_visible_until_then():
+    from app.db import messages_collection
+
+    writer = TurnWriter(messages_collection, max_queue=100, batch_size=10, flush_interval=0.05)
+    writer.start()
+    docs = [turn("u1"), turn("u2"), turn("u1")]
+    for doc in docs:
+        await writer.submit(doc)
+    assert [d["_id"] for d in writer.pending_for("u1")] == [docs[0]["_id"], docs[2]["_id"]]
+
+    await writer.stop()
+    assert await messages_collection.count_documents({}) == 3
+    assert writer.pending_for("u1") == [] and not writer.pending
+
+
+@pytest.mark.anyio
+async def test_transient_errors_are_retried():
+    collection = FlakyCollection(AutoReconnect("primary stepped down"), None)
+    await run_writer(collection, [turn()])
+    assert len(collection.calls) == 2
+    assert len(collection.docs) == 1
+
+
+@pytest.mark.anyio
+async def test_retries_are_capped_and_the_writer_moves_on(caplog):
+    collection = FlakyCollection(*[AutoReconnect("down")] * 3)
+    before = dropped("retries_exhausted")
+    docs = [turn()]
+    writer = TurnWriter(collection, max_queue=100, batch_size=10, flush_interval=0.01)
+    writer.start()
+    await writer.submit(docs[0])
+    await asyncio.sleep(0.5)  # First attempt and two retries (0.1 s and 0.2 s apart)
+    later = turn()
+    await writer.submit(later)
+    await writer.stop()
+
+    assert len(collection.calls) == 4  # Three for the first batch, one for the next
+    assert collection.docs == [later]
+    assert dropped("retries_exhausted") == before + 1
+    assert "retries_exhausted" in caplog.text
+
+
+@pytest.mark.anyio
+async def test_permanent_errors_are_not_retried():
+    collection = FlakyCollection(OperationFailure("Document failed validation", code=121))
+    before = dropped("rejected")
+    await run_writer(collection, [turn(), turn()])
+    assert len(collection.calls) == 1
+    assert dropped("rejected") == before + 2
+
+
+@pytest.mark.anyio
+async def test_rejected_turns_are_dropped_and_the_rest_kept():
+    docs = [turn(), turn(), turn()]
+    error = BulkWriteError({
+        "writeErrors": [
+            {"index": 0, "code": 121, "errmsg": "Document failed validation"},
+            {"index": 1, "code": write_behind.DUPLICATE_KEY, "errmsg": "duplicate key"},
+        ],
+        "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}],
+    })
+    collection = FlakyCollection(error, None)
+    before = dropped("rejected")
+    await run_writer(collection, docs)
+
+    assert dropped("rejected") == before + 1
+    assert collection.calls[1] == docs[1:]  # The retry skips the rejected turn; the duplicate is harmless
+    assert docs[0] not in collection.docs
+
+
+@pytest.mark.anyio
+async def test_shutdown_flush_is_bounded_and_reports_lost_turns(caplog, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_RETRIES", 1000)
+    collection = FlakyCollection(always=AutoReconnect("MongoDB is down"))
+    writer = TurnWriter(collection, max_queue=100, batch_size=10, flush_interval=0.01)
+    writer.start()
+    for _ in range(3):
+        await writer.submit(turn())
+    before = dropped("shutdown")
+
+    with caplog.at_level(logging.ERROR):
+        await asyncio.wait_for(writer.stop(timeout=0.2), timeout=2)
+
+    assert dropped("shutdown") == before + 3
+    assert "dropped 3 chat turns (shutdown)" in caplog.text
+    assert collection.docs == []
+
+
+@pytest.mark.anyio
+async def test_pending_counter_survives_slow_retries_and_never_goes_negative(monkeypatch):
+    from app.redis_client import r
+
+    async def expired_meanwhile(docs):
+        await r.delete(write_behind.pending_key("u1"))  # As if PENDING_TTL passed during the retries
+
+    collection = FlakyCollection(AutoReconnect("down"), None)
+    writer = TurnWriter(collection, max_queue=100, batch_size=10, flush_interval=0.01)
+    monkeypatch.setattr(writer, "_keep_pending", expired_meanwhile)
+    async with r.pipeline(transaction=False) as pipe:
+        write_behind.mark_pending(pipe, "u1")
+        await pipe.execute()
+    writer.start()
+    await writer.submit(turn("u1"))
+    await writer.stop()
+    assert await r.exists(write_behind.pending_key("u1")) == 0  # Not recreated as -1
+
+    async with r.pipeline(transaction=False) as pipe:
+        write_behind.mark_pending(pipe, "u1")
+        await pipe.execute()
+    assert await r.get(write_behind.pending_key("u1")) == "1"
+    assert await r.ttl(write_behind.pending_key("u1")) > 0
+
+
+@pytest.mark.anyio
+async def test_retries_refresh_the_pending_counter():
+    from app.redis_client import r
+
+    async with r.pipeline(transaction=False) as pipe:
+        write_behind.mark_pending(pipe, "u1")
+        await pipe.execute()
+    await r.expire(write_behind.pending_key("u1"), 1)
+    await TurnWriter(FlakyCollection(), 100, 10, 0.01)._keep_pending([turn("u1")])
+    assert await r.ttl(write_behind.pending_key("u1")) > 1